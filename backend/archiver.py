@@ -0,0 +1,148 @@
+"""
+Фоновый архиватор: переносит выполненные заказы старше ARCHIVE_AFTER_HOURS
+из горячих таблиц orders/order_items в orders_archive/order_items_archive
+пачками по ARCHIVE_BATCH_SIZE, чтобы горячие таблицы оставались маленькими
+"""
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+from sqlalchemy import delete, exists, insert, select
+from sqlalchemy.orm import Session
+
+import models
+import outbox
+from database import SessionLocal, engine, wait_for_db
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("OrderArchiver")
+
+
+ARCHIVE_AFTER_HOURS = int(os.getenv("ARCHIVE_AFTER_HOURS", "72"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", "300"))
+# Пауза между пачками, чтобы не держать горячие таблицы под постоянной нагрузкой
+ARCHIVE_BATCH_PAUSE_SECONDS = float(os.getenv("ARCHIVE_BATCH_PAUSE_SECONDS", "0.2"))
+
+
+def archive_batch(db: Session, cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> List[int]:
+    """Архивирует одну пачку заказов в одной транзакции и возвращает их id."""
+    Order, OrderItem = models.Order, models.OrderItem
+
+    candidates = (
+        select(Order.id, Order.restaurant_id, Order.waiter_id)
+        .where(
+            Order.status == "completed",
+            Order.created_at < cutoff,
+            # Заказ, на который еще ссылается стол, не трогаем
+            ~exists().where(models.Table.current_order_id == Order.id),
+        )
+        .order_by(Order.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    rows = db.execute(candidates).all()
+    if not rows:
+        return []
+    order_ids = [order_id for order_id, _, _ in rows]
+
+    db.execute(
+        insert(models.ArchivedOrder).from_select(
+            ["id", "restaurant_id", "code", "table_number", "status", "created_at", "waiter_id", "waiter_name",
+             "total_amount"],
+            select(
+                Order.id,
+                Order.restaurant_id,
+                Order.code,
+                Order.table_number,
+                Order.status,
+                Order.created_at,
+                Order.waiter_id,
+                models.User.username,
+                Order.total_amount,
+            )
+            .outerjoin(models.User, models.User.id == Order.waiter_id)
+            .where(Order.id.in_(order_ids)),
+        )
+    )
+    db.execute(
+        insert(models.ArchivedOrderItem).from_select(
+            ["id", "order_id", "dish_id", "dish_name", "unit_price", "quantity"],
+            select(
+                OrderItem.id,
+                OrderItem.order_id,
+                OrderItem.dish_id,
+                OrderItem.dish_name,
+                OrderItem.unit_price,
+                OrderItem.quantity,
+            )
+            .where(OrderItem.order_id.in_(order_ids)),
+        )
+    )
+    db.execute(delete(OrderItem).where(OrderItem.order_id.in_(order_ids)))
+    db.execute(delete(Order).where(Order.id.in_(order_ids)))
+    # Кеш заказов разложен по ресторанам: инвалидация идет через outbox вместе с переносом
+    by_restaurant: Dict[int, List] = {}
+    for order_id, restaurant_id, waiter_id in rows:
+        by_restaurant.setdefault(restaurant_id, []).append((order_id, waiter_id))
+    for restaurant_id, orders in by_restaurant.items():
+        outbox.enqueue(db, "invalidate_orders", restaurant_id=restaurant_id,
+                       order_ids=[order_id for order_id, _ in orders],
+                       waiter_ids=sorted({waiter_id for _, waiter_id in orders if waiter_id}))
+    db.commit()
+
+    return order_ids
+
+
+def archive_completed_orders(older_than_hours: int = ARCHIVE_AFTER_HOURS,
+                             batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=older_than_hours)
+    archived = 0
+
+    while True:
+        db = SessionLocal()
+        try:
+            order_ids = archive_batch(db, cutoff, batch_size)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        if not order_ids:
+            break
+        archived += len(order_ids)
+        logger.info(f"Archived batch of {len(order_ids)} orders (total {archived})")
+
+        if len(order_ids) < batch_size:
+            break
+        time.sleep(ARCHIVE_BATCH_PAUSE_SECONDS)
+
+    return archived
+
+
+if __name__ == "__main__":
+    logger.info("Order Archiver Service Started")
+    logger.info(
+        f"Archiving completed orders older than {ARCHIVE_AFTER_HOURS}h "
+        f"in batches of {ARCHIVE_BATCH_SIZE} every {ARCHIVE_INTERVAL_SECONDS} seconds"
+    )
+
+    if wait_for_db():
+        models.Base.metadata.create_all(bind=engine)
+
+    while True:
+        try:
+            count = archive_completed_orders()
+            if count:
+                logger.info(f"Archived {count} orders")
+        except Exception as e:
+            logger.error(f"Error during archiving: {e}")
+        time.sleep(ARCHIVE_INTERVAL_SECONDS)
@@ -1,17 +1,26 @@
-from passlib.context import CryptContext
 import jwt
 from datetime import datetime, timedelta
+from fastapi import HTTPException
+from functools import lru_cache
+from typing import Optional, Tuple
 from sqlalchemy.orm import Session
 import secrets
 import os
 
-try:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-    pwd_context.hash("test")
-    print("bcrypt успешно инициализирован")
-except Exception as e:
-    print(f"bcrypt не доступен: {e}, используем pbkdf2_sha256")
-    pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+
+@lru_cache(maxsize=None)
+def password_context():
+    # passlib и проверочный хеш bcrypt (около 0,3 с) загружаются при первом хешировании,
+    # а не при импорте: под сервиса авторизации быстрее готов принимать запросы
+    from passlib.context import CryptContext
+    try:
+        context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        context.hash("test")
+        print("bcrypt успешно инициализирован")
+        return context
+    except Exception as e:
+        print(f"bcrypt не доступен: {e}, используем pbkdf2_sha256")
+        return CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
 
 def get_secret_key():
@@ -41,14 +50,16 @@ def get_secret_key():
 SECRET_KEY = get_secret_key()
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Приглашение администратора в ресторан: подписанный токен без sub, войти им нельзя
+INVITE_EXPIRE_HOURS = 72
 
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_context().verify(plain_password, hashed_password)
 
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return password_context().hash(password)
 
 
 def authenticate_user(db: Session, username: str, password: str):
@@ -74,4 +85,46 @@ def verify_token(token: str):
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
-        return None
\ No newline at end of file
+        return None
+
+
+def create_invite(restaurant_id: int, role: str) -> Tuple[str, datetime]:
+    expire = datetime.utcnow() + timedelta(hours=INVITE_EXPIRE_HOURS)
+    invite = jwt.encode({"invite": role, "restaurant_id": restaurant_id, "exp": expire}, SECRET_KEY,
+                        algorithm=ALGORITHM)
+    return invite, expire
+
+
+def verify_invite(invite: str) -> Optional[dict]:
+    payload = verify_token(invite)
+    if not payload or "sub" in payload or not payload.get("invite") or not payload.get("restaurant_id"):
+        return None
+    return payload
+
+
+def registration_target(db: Session, role: str, invite: Optional[str],
+                        authorization: Optional[str]) -> Tuple[int, str]:
+    """Ресторан и роль нового пользователя. Ресторан никогда не берется из тела запроса:
+    пользователя заводит администратор ресторана (его токен) или его приглашение. Без них
+    можно зарегистрироваться только в пустой установке - первым администратором ресторана
+    по умолчанию. Новые рестораны заводит оператор (POST /restaurants)"""
+    from models import DEFAULT_RESTAURANT_ID, User
+
+    if authorization:
+        payload = verify_token(authorization.replace("Bearer ", ""))
+        admin = payload and payload.get("sub") and db.query(User).filter(User.username == payload["sub"]).first()
+        if not admin:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        if admin.role != "admin":
+            raise HTTPException(status_code=403, detail="Only administrators can register users")
+        return admin.restaurant_id, role
+
+    if invite:
+        payload = verify_invite(invite)
+        if not payload:
+            raise HTTPException(status_code=403, detail="Invite is invalid or expired")
+        return payload["restaurant_id"], payload["invite"]
+
+    if db.query(User.id).first() is None:
+        return DEFAULT_RESTAURANT_ID, "admin"
+    raise HTTPException(status_code=403, detail="Registration requires an invite from a restaurant administrator")
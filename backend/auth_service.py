@@ -1,23 +1,37 @@
+"""
+Сервис авторизации: регистрация, вход и управление пользователями. Масштабируется
+отдельно от API на всплесках входов, поэтому импортирует только то, что нужно для
+таблицы users: схему, миграции и столы создает backend-api, конфигурацию нового
+ресторана - outbox-воркер, а модули заказов загружаются лишь при удалении официанта
+"""
 from fastapi import FastAPI, Depends, HTTPException, status, Header
+from fastapi.responses import JSONResponse
 from typing import List, Optional
 from sqlalchemy.orm import Session
 import models
 import auth
-from database import engine, get_db, init_restaurant_config, wait_for_db
-from schemas import UserCreate, UserResponse, PasswordChange
+from database import engine, get_db, get_read_db
+from schemas import UserCreate, UserResponse, InviteCreate, InviteResponse, PasswordChange
+from readiness import Readiness
+from read_your_writes import ReadYourWritesMiddleware
 
 app = FastAPI()
+app.add_middleware(ReadYourWritesMiddleware)
+
+# Схему создает backend-api: до этого регистрация и вход падали бы с ошибкой БД
+readiness = Readiness(engine, required_tables=[models.User.__tablename__])
 
 
 @app.on_event("startup")
 def startup_event():
+    # Без ожидания БД и создания схемы: пока Postgres недоступен или в нем нет таблицы users,
+    # /ready не пускает трафик
+    readiness.start()
+
 
-    if wait_for_db():
-        try:
-            models.Base.metadata.create_all(bind=engine)
-            init_restaurant_config()
-        except Exception:
-            pass
+@app.on_event("shutdown")
+def shutdown_event():
+    readiness.stop()
 
 
 @app.get("/health")
@@ -25,7 +39,18 @@ def health_check():
     return {"status": "auth service healthy"}
 
 
-async def get_current_user(authorization: Optional[str] = Header(None), db: Session = Depends(get_db)):
+@app.get("/live")
+async def liveness_check():
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def readiness_check():
+    ready, verdict = readiness.snapshot()
+    return JSONResponse(verdict, status_code=200 if ready else 503)
+
+
+def get_current_user(authorization: Optional[str] = Header(None), db: Session = Depends(get_db)):
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Not authenticated")
 
@@ -47,19 +72,36 @@ async def get_current_user(authorization: Optional[str] = Header(None), db: Sess
 
 
 @app.post("/register", response_model=UserResponse)
-def register(user: UserCreate, db: Session = Depends(get_db)):
+def register(user: UserCreate, db: Session = Depends(get_db), authorization: Optional[str] = Header(None)):
+    restaurant_id, role = auth.registration_target(db, user.role, user.invite, authorization)
     db_user = db.query(models.User).filter(models.User.username == user.username).first()
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
 
     hashed_password = auth.get_password_hash(user.password)
-    db_user = models.User(username=user.username, password=hashed_password, role=user.role)
+    db_user = models.User(username=user.username, password=hashed_password, role=role, restaurant_id=restaurant_id)
     db.add(db_user)
+
+    config_exists = db.query(models.RestaurantConfig.id).filter(
+        models.RestaurantConfig.restaurant_id == restaurant_id
+    ).first()
+    if not config_exists:
+        # Первый администратор пустой установки: конфигурацию и столы создаст воркер
+        import outbox
+        outbox.enqueue(db, "init_restaurant", restaurant_id=restaurant_id)
     db.commit()
     db.refresh(db_user)
     return db_user
 
 
+@app.post("/invites", response_model=InviteResponse)
+def create_invite(invite: InviteCreate, current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only administrators can invite users")
+    code, expires_at = auth.create_invite(current_user.restaurant_id, invite.role)
+    return {"invite": code, "role": invite.role, "expires_at": expires_at}
+
+
 @app.post("/login")
 def login(user: dict, db: Session = Depends(get_db)):
     username = user.get("username")
@@ -70,14 +112,17 @@ def login(user: dict, db: Session = Depends(get_db)):
     if not db_user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
 
-    access_token = auth.create_access_token(data={"sub": db_user.username, "role": db_user.role})
+    access_token = auth.create_access_token(
+        data={"sub": db_user.username, "role": db_user.role, "restaurant_id": db_user.restaurant_id}
+    )
     return {
         "access_token": access_token,
         "token_type": "bearer",
         "user": {
             "id": db_user.id,
             "username": db_user.username,
-            "role": db_user.role
+            "role": db_user.role,
+            "restaurant_id": db_user.restaurant_id
         }
     }
 
@@ -88,10 +133,10 @@ def get_current_user_info(current_user: models.User = Depends(get_current_user))
 
 
 @app.get("/users", response_model=List[UserResponse])
-def get_users(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def get_users(db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Only administrators can view users")
-    return db.query(models.User).all()
+    return db.query(models.User).filter(models.User.restaurant_id == current_user.restaurant_id).all()
 
 
 @app.delete("/users/{user_id}")
@@ -100,24 +145,14 @@ def delete_user(user_id: int, db: Session = Depends(get_db), current_user: model
         raise HTTPException(status_code=403, detail="Only administrators can delete users")
     if user_id == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot delete your own account")
-    user_to_delete = db.query(models.User).filter(models.User.id == user_id).first()
+    user_to_delete = db.query(models.User).filter(
+        models.User.id == user_id, models.User.restaurant_id == current_user.restaurant_id
+    ).first()
     if not user_to_delete:
         raise HTTPException(status_code=404, detail="User not found")
     if user_to_delete.role == "waiter":
-        waiter_orders = db.query(models.Order).filter(models.Order.waiter_id == user_id).all()
-        if waiter_orders:
-            other_waiter = db.query(models.User).filter(models.User.role == "waiter", models.User.id != user_id).first()
-            if other_waiter:
-                for order in waiter_orders:
-                    order.waiter_id = other_waiter.id
-            else:
-                for order in waiter_orders:
-                    table = db.query(models.Table).filter(models.Table.current_order_id == order.id).first()
-                    if table:
-                        table.is_available = True
-                        table.current_order_id = None
-                    db.query(models.OrderItem).filter(models.OrderItem.order_id == order.id).delete()
-                    db.delete(order)
+        import bulk_orders
+        bulk_orders.hand_over_waiter_orders(db, user_to_delete)
     db.delete(user_to_delete)
     db.commit()
     return {"message": f"User {user_to_delete.username} deleted successfully."}
@@ -140,25 +175,15 @@ def change_password(user_id: int, password_data: PasswordChange, db: Session = D
 @app.delete("/me")
 def delete_own_account(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role == "admin":
-        admin_count = db.query(models.User).filter(models.User.role == "admin").count()
+        admin_count = db.query(models.User).filter(
+            models.User.role == "admin", models.User.restaurant_id == current_user.restaurant_id
+        ).count()
         if admin_count <= 1:
             raise HTTPException(status_code=400, detail="Cannot delete the last administrator account")
     # Handle waiter orders similar to delete_user
     if current_user.role == "waiter":
-        user_orders = db.query(models.Order).filter(models.Order.waiter_id == current_user.id).all()
-        if user_orders:
-            other_waiter = db.query(models.User).filter(models.User.role == "waiter", models.User.id != current_user.id).first()
-            if other_waiter:
-                for order in user_orders:
-                    order.waiter_id = other_waiter.id
-            else:
-                for order in user_orders:
-                    table = db.query(models.Table).filter(models.Table.current_order_id == order.id).first()
-                    if table:
-                        table.is_available = True
-                        table.current_order_id = None
-                    db.query(models.OrderItem).filter(models.OrderItem.order_id == order.id).delete()
-                    db.delete(order)
+        import bulk_orders
+        bulk_orders.hand_over_waiter_orders(db, current_user)
     username = current_user.username
     db.delete(current_user)
     db.commit()
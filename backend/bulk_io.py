@@ -0,0 +1,258 @@
+"""
+Потоковый импорт/экспорт: разбор CSV/NDJSON по мере чтения тела запроса
+и сериализация строк ответа пачками, без загрузки всего файла в память
+"""
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Any, AsyncIterator, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Float, cast, select
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+
+
+IMPORT_CHUNK_SIZE = 500
+EXPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+DISH_EXPORT_COLUMNS = ["id", "name", "description", "price", "available", "station"]
+ORDER_EXPORT_COLUMNS = [
+    "order_id", "order_code", "table_number", "status", "created_at", "waiter_id", "waiter_name",
+    "item_id", "dish_id", "dish_name", "dish_price", "quantity", "order_total", "archived",
+]
+
+
+class ImportFormatError(ValueError):
+    """Файл нельзя разобрать целиком (нет заголовка, неизвестный формат)"""
+
+
+def detect_format(requested: Optional[str], content_type: Optional[str]) -> str:
+    if requested:
+        if requested not in FORMATS:
+            raise ImportFormatError(f"Unsupported format '{requested}', use one of: {', '.join(FORMATS)}")
+        return requested
+
+    content_type = (content_type or "").lower()
+    if "ndjson" in content_type or "jsonl" in content_type or "json" in content_type:
+        return "ndjson"
+    return "csv"
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    buffer = b""
+    first = True
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield _decode_line(line, first)
+            first = False
+    if buffer:
+        yield _decode_line(buffer, first)
+
+
+def _decode_line(raw: bytes, first: bool) -> str:
+    # BOM встречается в CSV, сохраненных из Excel
+    return raw.decode("utf-8-sig" if first else "utf-8").rstrip("\r")
+
+
+async def iter_records(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[Tuple[int, Any]]:
+    """Возвращает пары (номер записи, словарь полей или исключение разбора)."""
+    if fmt == "ndjson":
+        row_number = 0
+        async for line in iter_lines(chunks):
+            if not line.strip():
+                continue
+            row_number += 1
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("Row must be a JSON object")
+                yield row_number, record
+            except ValueError as e:
+                yield row_number, e
+        return
+
+    header: Optional[List[str]] = None
+    delimiter = ","
+    pending = ""
+    row_number = 0
+    async for line in iter_lines(chunks):
+        # Перевод строки внутри кавычек: копим строки, пока кавычки не закроются
+        pending = f"{pending}\n{line}" if pending else line
+        if pending.count('"') % 2:
+            continue
+        record_line, pending = pending, ""
+        if not record_line.strip():
+            continue
+
+        if header is None:
+            if ";" in record_line and "," not in record_line:
+                delimiter = ";"
+            header = [column.strip().lower() for column in _parse_csv_line(record_line, delimiter)]
+            if "name" not in header or "price" not in header:
+                raise ImportFormatError("CSV header must contain at least 'name' and 'price' columns")
+            continue
+
+        row_number += 1
+        values = _parse_csv_line(record_line, delimiter)
+        if len(values) > len(header):
+            yield row_number, ValueError(f"Expected {len(header)} columns, got {len(values)}")
+            continue
+        # Недостающие хвостовые колонки считаем пустыми, как csv.DictReader
+        yield row_number, dict(zip(header, values + [""] * (len(header) - len(values))))
+
+    if pending:
+        yield row_number + 1, ValueError("Unterminated quoted field")
+    if header is None:
+        raise ImportFormatError("CSV file is empty")
+
+
+def _parse_csv_line(line: str, delimiter: str) -> List[str]:
+    return next(csv.reader([line], delimiter=delimiter))
+
+
+def parse_bool(value: Any, default: bool = True) -> bool:
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool):
+        return value
+    normalized = str(value).strip().lower()
+    if normalized in ("1", "true", "yes", "y", "да"):
+        return True
+    if normalized in ("0", "false", "no", "n", "нет"):
+        return False
+    raise ValueError(f"Invalid boolean value '{value}'")
+
+
+def format_error(error: Exception) -> str:
+    errors = getattr(error, "errors", None)
+    if callable(errors):
+        return "; ".join(
+            f"{'.'.join(str(part) for part in e.get('loc', ()))}: {e.get('msg')}" for e in errors()
+        )
+    return str(error)
+
+
+def stream_rows(fmt: str, columns: Sequence[str], rows: Iterable[Sequence[Any]],
+                batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[str]:
+    """Сериализует строки в CSV/NDJSON и отдает их пачками по batch_size строк."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer:
+        writer.writerow(columns)
+
+    pending = 0
+    for row in rows:
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str))
+            buffer.write("\n")
+        pending += 1
+        if pending >= batch_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    tail = buffer.getvalue()
+    if tail:
+        yield tail
+
+
+def stream_dishes(fmt: str, restaurant_id: int) -> Iterator[str]:
+    # Своя сессия: генератор дочитывается уже после выхода из обработчика
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(
+                models.Dish.id,
+                models.Dish.name,
+                models.Dish.description,
+                models.Dish.price,
+                models.Dish.available,
+                models.Dish.station,
+            )
+            .filter(models.Dish.restaurant_id == restaurant_id)
+            .order_by(models.Dish.id)
+            .yield_per(EXPORT_BATCH_SIZE)
+        )
+        yield from stream_rows(fmt, DISH_EXPORT_COLUMNS, rows)
+    finally:
+        db.close()
+
+
+
+def iter_order_export_rows(db: Session, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                           include_archived: bool = False,
+                           restaurant_id: int = models.DEFAULT_RESTAURANT_ID) -> Iterator[Sequence[Any]]:
+    """Строки экспорта заказов (одна строка на позицию) через серверный курсор.
+
+    Вместо get_order_response на каждый заказ - один запрос с join-ами позиций
+    и официантов, который читается пачками по EXPORT_BATCH_SIZE строк. Название и цена
+    берутся из снимка в позиции, поэтому dishes не читается.
+    """
+    Order, OrderItem = models.Order, models.OrderItem
+    hot = (
+        select(
+            Order.id, Order.code, Order.table_number, Order.status, Order.created_at,
+            Order.waiter_id, models.User.username,
+            OrderItem.id, OrderItem.dish_id, OrderItem.dish_name, cast(OrderItem.unit_price, Float) / 100,
+            OrderItem.quantity, cast(Order.total_amount, Float) / 100,
+        )
+        .outerjoin(models.User, models.User.id == Order.waiter_id)
+        .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+        .where(Order.restaurant_id == restaurant_id)
+    )
+    if date_from:
+        hot = hot.where(Order.created_at >= date_from)
+    if date_to:
+        hot = hot.where(Order.created_at < date_to)
+    hot = hot.order_by(Order.id, OrderItem.id)
+
+    for row in db.execute(hot, execution_options={"yield_per": EXPORT_BATCH_SIZE}):
+        yield (*row, False)
+
+    if not include_archived:
+        return
+
+    ArchivedOrder, ArchivedOrderItem = models.ArchivedOrder, models.ArchivedOrderItem
+    archived = (
+        select(
+            ArchivedOrder.id, ArchivedOrder.code, ArchivedOrder.table_number, ArchivedOrder.status,
+            ArchivedOrder.created_at, ArchivedOrder.waiter_id, ArchivedOrder.waiter_name,
+            ArchivedOrderItem.id, ArchivedOrderItem.dish_id, ArchivedOrderItem.dish_name,
+            cast(ArchivedOrderItem.unit_price, Float) / 100, ArchivedOrderItem.quantity,
+            cast(ArchivedOrder.total_amount, Float) / 100,
+        )
+        .outerjoin(ArchivedOrderItem, ArchivedOrderItem.order_id == ArchivedOrder.id)
+        .where(ArchivedOrder.restaurant_id == restaurant_id)
+    )
+    if date_from:
+        archived = archived.where(ArchivedOrder.created_at >= date_from)
+    if date_to:
+        archived = archived.where(ArchivedOrder.created_at < date_to)
+    archived = archived.order_by(ArchivedOrder.id, ArchivedOrderItem.id)
+
+    for row in db.execute(archived, execution_options={"yield_per": EXPORT_BATCH_SIZE}):
+        yield (*row, True)
+
+
+def stream_orders(fmt: str, restaurant_id: int, date_from: Optional[datetime] = None,
+                  date_to: Optional[datetime] = None, include_archived: bool = False) -> Iterator[str]:
+    db = SessionLocal()
+    try:
+        rows = iter_order_export_rows(db, date_from, date_to, include_archived, restaurant_id)
+        yield from stream_rows(fmt, ORDER_EXPORT_COLUMNS, rows)
+    finally:
+        db.close()
@@ -0,0 +1,171 @@
+"""
+Групповые операции над заказами (закрытие смены, удаление официанта, чистка
+заказов без официанта): статус, передача, освобождение столов и удаление выполняются
+UPDATE/DELETE над выборкой заказов (WHERE ... IN (подзапрос)), а инвалидации и события
+кухни записываются в outbox по одному событию на операцию. Функции не коммитят:
+транзакцию завершает вызывающий
+"""
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import Session
+
+import kitchen
+import models
+import outbox
+from redis_client import popular_hour
+
+
+Order = models.Order
+
+
+def selection(restaurant_id: int, *criteria):
+    """Подзапрос id заказов ресторана"""
+    return select(Order.id).where(Order.restaurant_id == restaurant_id, *criteria)
+
+
+def release_tables(db: Session, restaurant_id: int, selected) -> List[int]:
+    """Освобождает столы выбранных заказов одним UPDATE и возвращает их номера"""
+    numbers = list(db.execute(
+        update(models.Table)
+        .where(models.Table.restaurant_id == restaurant_id, models.Table.current_order_id.in_(selected))
+        .values(is_available=True, current_order_id=None)
+        .returning(models.Table.number)
+        .execution_options(synchronize_session=False)
+    ).scalars())
+    if numbers:
+        outbox.enqueue(db, "table_availability", restaurant_id=restaurant_id,
+                       tables={number: True for number in numbers})
+        outbox.enqueue(db, "invalidate_tables", restaurant_id=restaurant_id)
+    return numbers
+
+
+def invalidate(db: Session, restaurant_id: int, order_ids: List[int], waiter_ids) -> None:
+    outbox.enqueue(db, "invalidate_orders", restaurant_id=restaurant_id, order_ids=sorted(order_ids),
+                   waiter_ids=sorted({waiter_id for waiter_id in waiter_ids if waiter_id}))
+
+
+def return_stock(db: Session, restaurant_id: int, quantities: Dict[int, int]) -> None:
+    """Возвращает порции удаленных невыполненных заказов через outbox: в dishes.stock
+    (reconcile_stock) и в счетчики Redis (take_stock), только после коммита удаления"""
+    returned = {dish_id: -quantity for dish_id, quantity in quantities.items() if quantity}
+    if returned:
+        outbox.enqueue(db, "reconcile_stock", restaurant_id=restaurant_id, quantities=returned)
+        outbox.enqueue(db, "take_stock", restaurant_id=restaurant_id, quantities=returned)
+
+
+def removal_events(db: Session, selected) -> List[kitchen.KitchenEvent]:
+    # Позиции выполненных заказов уже сняты с экранов кухни
+    active = db.query(Order).filter(Order.id.in_(selected), Order.status != "completed").order_by(Order.id).all()
+    return kitchen.orders_events(db, active, "removed")
+
+
+def set_status(db: Session, restaurant_id: int, order_ids: List[int], status: str) -> List[int]:
+    """Меняет статус заказов ресторана; выполненные освобождают столы и уходят с экранов кухни.
+    Возвращает id найденных заказов"""
+    selected = selection(restaurant_id, Order.id.in_(order_ids))
+    kitchen_events = removal_events(db, selected) if status == "completed" else []
+
+    rows = db.execute(
+        update(Order)
+        .where(Order.id.in_(selected))
+        .values(status=status)
+        .returning(Order.id, Order.waiter_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if not rows:
+        return []
+    if status == "completed":
+        release_tables(db, restaurant_id, selected)
+
+    invalidate(db, restaurant_id, [order_id for order_id, _ in rows], [waiter_id for _, waiter_id in rows])
+    if kitchen_events:
+        outbox.enqueue(db, "kitchen_events", restaurant_id=restaurant_id, events=kitchen_events)
+    return sorted(order_id for order_id, _ in rows)
+
+
+def delete_orders(db: Session, restaurant_id: int, order_ids: List[int]) -> List[int]:
+    """Удаляет заказы ресторана по списку id и возвращает id найденных заказов"""
+    return delete_selected(db, restaurant_id, selection(restaurant_id, Order.id.in_(order_ids)))
+
+
+def delete_selected(db: Session, restaurant_id: int, selected) -> List[int]:
+    """Удаляет выбранные заказы вместе с позициями: столы, позиции и заказы - по одному запросу"""
+    kitchen_events = removal_events(db, selected)
+    # Удаленные заказы не должны влиять на популярность блюд: количества снимаются с бакетов
+    # часов, в которых заказы учтены
+    by_hour: Dict[int, Dict[int, int]] = {}
+    for created_at, dish_id, quantity in (
+        db.query(Order.created_at, models.OrderItem.dish_id, func.sum(models.OrderItem.quantity))
+        .join(Order, Order.id == models.OrderItem.order_id)
+        .filter(models.OrderItem.order_id.in_(selected))
+        .group_by(Order.id, models.OrderItem.dish_id)
+    ):
+        quantities = by_hour.setdefault(popular_hour(created_at), {})
+        quantities[dish_id] = quantities.get(dish_id, 0) - int(quantity)
+    # Порции выполненных заказов поданы, возвращаются только порции остальных
+    unserved: Dict[int, int] = {
+        dish_id: int(quantity)
+        for dish_id, quantity in db.query(models.OrderItem.dish_id, func.sum(models.OrderItem.quantity))
+        .join(Order, Order.id == models.OrderItem.order_id)
+        .filter(models.OrderItem.order_id.in_(selected), Order.status != "completed")
+        .group_by(models.OrderItem.dish_id)
+    }
+
+    release_tables(db, restaurant_id, selected)
+    db.execute(delete(models.OrderItem).where(models.OrderItem.order_id.in_(selected))
+               .execution_options(synchronize_session=False))
+    rows = db.execute(
+        delete(Order)
+        .where(Order.id.in_(selected))
+        .returning(Order.id, Order.waiter_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if not rows:
+        return []
+
+    invalidate(db, restaurant_id, [order_id for order_id, _ in rows], [waiter_id for _, waiter_id in rows])
+    if kitchen_events:
+        outbox.enqueue(db, "kitchen_events", restaurant_id=restaurant_id, events=kitchen_events)
+    for hour, quantities in sorted(by_hour.items()):
+        outbox.enqueue(db, "record_dish_orders", restaurant_id=restaurant_id, hour=hour, quantities=quantities)
+    return_stock(db, restaurant_id, unserved)
+    return sorted(order_id for order_id, _ in rows)
+
+
+def delete_orphans(db: Session, restaurant_id: int) -> List[int]:
+    """Заказы без официанта (записанные до обязательного waiter_id)"""
+    return delete_selected(db, restaurant_id, selection(restaurant_id, Order.waiter_id.is_(None)))
+
+
+def reassign(db: Session, restaurant_id: int, from_waiter_id: int, to_waiter_id: int) -> List[int]:
+    """Передает все заказы официанта другому одним UPDATE"""
+    order_ids = sorted(db.execute(
+        update(Order)
+        .where(Order.restaurant_id == restaurant_id, Order.waiter_id == from_waiter_id)
+        .values(waiter_id=to_waiter_id)
+        .returning(Order.id)
+        .execution_options(synchronize_session=False)
+    ).scalars())
+    if order_ids:
+        invalidate(db, restaurant_id, order_ids, [from_waiter_id, to_waiter_id])
+    return order_ids
+
+
+def hand_over_waiter_orders(db: Session, waiter: models.User) -> Tuple[int, Optional[models.User]]:
+    """Готовит удаление официанта: заказы без официанта удаляются, его заказы передаются
+    другому официанту ресторана, а если других нет - удаляются.
+    Возвращает число заказов официанта и того, кому они переданы"""
+    restaurant_id = waiter.restaurant_id
+    orphans = delete_orphans(db, restaurant_id)
+    if orphans:
+        print(f"Удалено {len(orphans)} заказов с NULL waiter_id")
+
+    other_waiter = db.query(models.User).filter(
+        models.User.role == "waiter",
+        models.User.restaurant_id == restaurant_id,
+        models.User.id != waiter.id
+    ).order_by(models.User.id).first()
+    if other_waiter:
+        return len(reassign(db, restaurant_id, waiter.id, other_waiter.id)), other_waiter
+    return len(delete_selected(db, restaurant_id, selection(restaurant_id, Order.waiter_id == waiter.id))), None
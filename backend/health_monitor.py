@@ -1,11 +1,20 @@
+import asyncio
+import logging
+import math
 import os
+import threading
 import time
-import logging
-from typing import Dict, Tuple
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
 
 import psycopg2
 import redis
 import requests
+import uvicorn
+from fastapi import FastAPI
+from requests.adapters import HTTPAdapter
+
+from synthetic_probe import OrderProbe, ProbeError
 
 # Настройка логирования
 logging.basicConfig(
@@ -25,6 +34,25 @@ DATABASE_URL = os.getenv(
 )
 REDIS_HOST = os.getenv("REDIS_HOST", "redis")
 
+CHECK_INTERVAL_SECONDS = float(os.getenv("HEALTH_CHECK_INTERVAL_SECONDS", "10"))
+CHECK_TIMEOUT_SECONDS = float(os.getenv("HEALTH_CHECK_TIMEOUT_SECONDS", "5"))
+# 360 проверок при интервале 10 секунд - последний час
+HISTORY_SIZE = int(os.getenv("HEALTH_HISTORY_SIZE", "360"))
+STATUS_PORT = int(os.getenv("HEALTH_MONITOR_PORT", "8080"))
+
+# Синтетическая проверка идет через nginx, как запросы официантов. Учетные записи пробы
+# заводятся заранее, пароли приходят из секрета: значений по умолчанию у них нет
+PROBE_ENABLED = os.getenv("PROBE_ENABLED", "false").lower() == "true"
+PROBE_BASE_URL = os.getenv("PROBE_BASE_URL", f"{FRONTEND_URL}/api")
+PROBE_INTERVAL_SECONDS = float(os.getenv("PROBE_INTERVAL_SECONDS", "60"))
+PROBE_WAITER_USERNAME = os.getenv("PROBE_WAITER_USERNAME", "probe-waiter")
+PROBE_WAITER_PASSWORD = os.getenv("PROBE_WAITER_PASSWORD", "")
+PROBE_ADMIN_USERNAME = os.getenv("PROBE_ADMIN_USERNAME", "probe-admin")
+PROBE_ADMIN_PASSWORD = os.getenv("PROBE_ADMIN_PASSWORD", "")
+PROBE_STEP_SLO_MS = float(os.getenv("PROBE_STEP_SLO_MS", "500"))
+PROBE_TOTAL_SLO_MS = float(os.getenv("PROBE_TOTAL_SLO_MS", "2000"))
+PROBE_ALERT_WEBHOOK_URL = os.getenv("PROBE_ALERT_WEBHOOK_URL", "")
+
 
 def _detect_redis_port() -> int:
 
@@ -45,9 +73,53 @@ def _detect_redis_port() -> int:
 REDIS_PORT = _detect_redis_port()
 
 
-def check_http_service(name: str, url: str, timeout: float = 5.0) -> Tuple[bool, str]:
+# Постоянные соединения: HTTP keep-alive, пул Redis и одно соединение с Postgres
+http_session = requests.Session()
+http_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+redis_connection = redis.Redis(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    decode_responses=True,
+    socket_connect_timeout=CHECK_TIMEOUT_SECONDS,
+    socket_timeout=CHECK_TIMEOUT_SECONDS,
+)
+
+
+class DatabaseConnection:
+    """Одно переиспользуемое соединение с Postgres, пересоздается после ошибки."""
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.conn = None
+        # Проверка, зависшая дольше таймаута, еще держит соединение в своем потоке
+        self.lock = threading.Lock()
+
+    def ping(self) -> None:
+        if not self.lock.acquire(blocking=False):
+            raise RuntimeError("previous check is still running")
+        try:
+            if self.conn is None or self.conn.closed:
+                self.conn = psycopg2.connect(self.dsn, connect_timeout=int(CHECK_TIMEOUT_SECONDS))
+                self.conn.autocommit = True
+            try:
+                with self.conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                    cur.fetchone()
+            except Exception:
+                self.conn.close()
+                self.conn = None
+                raise
+        finally:
+            self.lock.release()
+
+
+database = DatabaseConnection(DATABASE_URL)
+
+
+def check_http_service(name: str, url: str, timeout: float = CHECK_TIMEOUT_SECONDS) -> Tuple[bool, str]:
     try:
-        resp = requests.get(url, timeout=timeout)
+        resp = http_session.get(url, timeout=timeout)
         if resp.ok:
             return True, f"{name}: OK ({resp.status_code})"
         return False, f"{name}: FAIL ({resp.status_code})"
@@ -73,11 +145,7 @@ def check_frontend() -> Tuple[bool, str]:
 
 def check_database() -> Tuple[bool, str]:
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        with conn.cursor() as cur:
-            cur.execute("SELECT 1")
-            _ = cur.fetchone()
-        conn.close()
+        database.ping()
         return True, "postgres: OK"
     except Exception as e:
         return False, f"postgres: ERROR ({e})"
@@ -85,54 +153,211 @@ def check_database() -> Tuple[bool, str]:
 
 def check_redis() -> Tuple[bool, str]:
     try:
-        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
-        r.ping()
+        redis_connection.ping()
         return True, "redis: OK"
     except Exception as e:
         return False, f"redis: ERROR ({e})"
 
 
-def monitor_all_services() -> Dict[str, bool]:
-    checks = {
-        "backend_auth": check_backend_auth,
-        "backend_api": check_backend_api,
-        "cache_via_api": check_cache_via_api,
-        "frontend": check_frontend,
-        "database": check_database,
-        "redis": check_redis,
-    }
+CHECKS: Dict[str, Callable[[], Tuple[bool, str]]] = {
+    "backend_auth": check_backend_auth,
+    "backend_api": check_backend_api,
+    "cache_via_api": check_cache_via_api,
+    "frontend": check_frontend,
+    "database": check_database,
+    "redis": check_redis,
+}
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class HealthHistory:
+    """Кольцевые буферы последних результатов по каждой проверке."""
+
+    def __init__(self, size: int = HISTORY_SIZE):
+        self.size = size
+        self.started_at = time.time()
+        self.last_cycle_at: Optional[float] = None
+        self.results: Dict[str, Deque[Dict]] = {}
+
+    def record(self, name: str, ok: bool, latency_ms: float, message: str) -> None:
+        buffer = self.results.setdefault(name, deque(maxlen=self.size))
+        buffer.append({"at": time.time(), "ok": ok, "latency_ms": round(latency_ms, 2), "message": message})
+
+    def summary(self) -> Dict:
+        checks = {}
+        for name, buffer in self.results.items():
+            last = buffer[-1]
+            latencies = [result["latency_ms"] for result in buffer]
+            checks[name] = {
+                "ok": last["ok"],
+                "message": last["message"],
+                "latency_ms": last["latency_ms"],
+                "p95_latency_ms": percentile(latencies, 0.95),
+                "uptime_percent": round(100.0 * sum(result["ok"] for result in buffer) / len(buffer), 2),
+                "samples": len(buffer),
+            }
+        return {
+            "status": "ok" if checks and all(check["ok"] for check in checks.values()) else "degraded",
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "last_cycle_at": self.last_cycle_at,
+            "checks": checks,
+        }
+
+
+history = HealthHistory()
+
+
+async def run_check(name: str, func: Callable[[], Tuple[bool, str]],
+                    timeout: float = CHECK_TIMEOUT_SECONDS) -> Tuple[bool, str, float]:
+    started = time.perf_counter()
+    try:
+        ok, message = await asyncio.wait_for(asyncio.to_thread(func), timeout)
+    except asyncio.TimeoutError:
+        ok, message = False, f"{name}: TIMEOUT ({timeout}s)"
+    except Exception as e:
+        ok, message = False, f"{name}: ERROR ({e})"
+    return ok, message, (time.perf_counter() - started) * 1000
+
+
+async def monitor_all_services(checks: Optional[Dict[str, Callable[[], Tuple[bool, str]]]] = None,
+                               timeout: float = CHECK_TIMEOUT_SECONDS) -> Dict[str, bool]:
+    """Запускает все проверки одновременно: цикл длится не дольше самого медленного таймаута."""
+    checks = checks or CHECKS
+    outcomes = await asyncio.gather(*(run_check(name, func, timeout) for name, func in checks.items()))
 
     results: Dict[str, bool] = {}
     logger.info("=" * 60)
     logger.info("Health check results:")
 
-    for name, func in checks.items():
-        ok, message = func()
+    for name, (ok, message, latency_ms) in zip(checks, outcomes):
         results[name] = ok
+        history.record(name, ok, latency_ms, message)
         if ok:
-            logger.info(f"[OK ] {message}")
+            logger.info(f"[OK ] {message} {latency_ms:.1f}ms")
         else:
-            logger.warning(f"[FAIL] {message}")
+            logger.warning(f"[FAIL] {message} {latency_ms:.1f}ms")
 
+    history.last_cycle_at = time.time()
     logger.info("=" * 60)
     return results
 
 
-if __name__ == "__main__":
-    logger.info("Health Monitor Service Started")
-    logger.info("Waiting 15 seconds before first check to let services start...")
-    time.sleep(15)
-    
-    logger.info("Starting monitoring services every 60 seconds...")
+def slo_breaches(timings: Dict[str, float], step_slo_ms: float = PROBE_STEP_SLO_MS,
+                 total_slo_ms: float = PROBE_TOTAL_SLO_MS) -> List[str]:
+    breaches = [f"{step} {latency:.0f}ms > {step_slo_ms:g}ms" for step, latency in timings.items()
+                if latency > step_slo_ms]
+    total = sum(timings.values())
+    if total > total_slo_ms:
+        breaches.append(f"total {total:.0f}ms > {total_slo_ms:g}ms")
+    return breaches
 
-    check_interval = 10
 
+def send_alert(message: str) -> None:
+    logger.error(f"[ALERT] {message}")
+    if not PROBE_ALERT_WEBHOOK_URL:
+        return
+    try:
+        http_session.post(PROBE_ALERT_WEBHOOK_URL, json={"text": message}, timeout=CHECK_TIMEOUT_SECONDS)
+    except Exception as e:
+        logger.error(f"Failed to deliver alert: {e}")
+
+
+def run_order_probe(probe: OrderProbe) -> bool:
+    """Один прогон синтетической проверки: шаги попадают в историю как probe:<шаг>."""
+    try:
+        timings = probe.run()
+    except ProbeError as e:
+        for step, latency in e.timings.items():
+            if step == e.step:
+                continue
+            history.record(f"probe:{step}", True, latency, f"probe {step}: OK")
+        history.record(f"probe:{e.step}", False, 0.0, f"probe {e}")
+        send_alert(f"Synthetic order probe failed at {e}")
+        return False
+
+    breaches = slo_breaches(timings)
+    for step, latency in timings.items():
+        ok = latency <= PROBE_STEP_SLO_MS
+        history.record(f"probe:{step}", ok, latency, f"probe {step}: {'OK' if ok else 'SLOW'}")
+    total = sum(timings.values())
+    history.record("probe:total", total <= PROBE_TOTAL_SLO_MS, total, f"probe total: {total:.0f}ms")
+
+    if breaches:
+        send_alert(f"Synthetic order probe SLO breached: {', '.join(breaches)}")
+        return False
+    logger.info(f"[OK ] probe order lifecycle {total:.1f}ms " +
+                " ".join(f"{step}={latency:.0f}ms" for step, latency in timings.items()))
+    return True
+
+
+app = FastAPI()
+
+
+@app.get("/status")
+def status():
+    return history.summary()
+
+
+async def monitor_loop() -> None:
+    logger.info("Waiting 15 seconds before first check to let services start...")
+    await asyncio.sleep(15)
+
+    logger.info(f"Starting monitoring services every {CHECK_INTERVAL_SECONDS:g} seconds...")
     while True:
+        started = time.monotonic()
         try:
-            monitor_all_services()
+            await monitor_all_services()
         except Exception as e:
             logger.error(f"Error during monitoring: {e}")
-        logger.info(f"Next check in {check_interval} seconds...")
-        time.sleep(check_interval)
+        # Интервал считается от начала цикла, чтобы медленные проверки не сдвигали расписание
+        await asyncio.sleep(max(0.0, CHECK_INTERVAL_SECONDS - (time.monotonic() - started)))
+
+
+def probe_configured() -> bool:
+    if not PROBE_ENABLED:
+        return False
+    if not PROBE_WAITER_PASSWORD or not PROBE_ADMIN_PASSWORD:
+        logger.warning("Synthetic order probe disabled: PROBE_WAITER_PASSWORD and PROBE_ADMIN_PASSWORD are not set")
+        return False
+    return True
+
+
+async def probe_loop() -> None:
+    probe = OrderProbe(
+        http_session,
+        PROBE_BASE_URL,
+        waiter={"username": PROBE_WAITER_USERNAME, "password": PROBE_WAITER_PASSWORD},
+        admin={"username": PROBE_ADMIN_USERNAME, "password": PROBE_ADMIN_PASSWORD},
+        timeout=CHECK_TIMEOUT_SECONDS,
+    )
+    await asyncio.sleep(15)
+
+    logger.info(f"Starting synthetic order probe every {PROBE_INTERVAL_SECONDS:g} seconds...")
+    while True:
+        started = time.monotonic()
+        try:
+            await asyncio.to_thread(run_order_probe, probe)
+        except Exception as e:
+            logger.error(f"Error during synthetic probe: {e}")
+        await asyncio.sleep(max(0.0, PROBE_INTERVAL_SECONDS - (time.monotonic() - started)))
+
+
+async def main() -> None:
+    server = uvicorn.Server(uvicorn.Config(app, host="0.0.0.0", port=STATUS_PORT, log_level="warning"))
+    loops = [server.serve(), monitor_loop()]
+    if probe_configured():
+        logger.info(f"Synthetic order probe against {PROBE_BASE_URL} as {PROBE_WAITER_USERNAME}")
+        loops.append(probe_loop())
+    await asyncio.gather(*loops)
 
 
+if __name__ == "__main__":
+    logger.info("Health Monitor Service Started")
+    logger.info(f"Status endpoint on port {STATUS_PORT}: /status")
+    asyncio.run(main())
@@ -0,0 +1,163 @@
+"""
+Idempotency-Key для изменяющих запросов: первый успешный ответ сохраняется в Redis,
+повтор с тем же ключом в пределах IDEMPOTENCY_TTL_SECONDS получает сохраненный ответ
+без обращения к Postgres. Одновременный дубль ждет завершения первого запроса
+под короткой блокировкой, а если не дождался - получает 409
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import auth
+from redis_client import redis_client
+
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "5"))
+IDEMPOTENCY_POLL_SECONDS = 0.1
+MAX_KEY_LENGTH = 255
+
+IDEMPOTENT_ROUTES = [
+    ("POST", re.compile(r"^/orders/?$")),
+    ("PUT", re.compile(r"^/orders/\d+/?$")),
+    ("POST", re.compile(r"^/dishes/?$")),
+]
+
+
+def _header(scope: Scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", []):
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _token_subject(scope: Scope) -> Optional[str]:
+    # Ключи разных пользователей не должны пересекаться; пользователя берем из JWT без БД
+    authorization = _header(scope, b"authorization")
+    if not authorization or not authorization.startswith("Bearer "):
+        return None
+    payload = auth.verify_token(authorization.replace("Bearer ", ""))
+    return payload.get("sub") if payload else None
+
+
+async def _send_json(send: Send, status: int, body: bytes, replayed: bool = False) -> None:
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    if replayed:
+        headers.append((b"idempotent-replayed", b"true"))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_error(send: Send, status: int, detail: str) -> None:
+    await _send_json(send, status, json.dumps({"detail": detail}).encode())
+
+
+class IdempotencyMiddleware:
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not any(
+            scope["method"] == method and pattern.match(scope["path"]) for method, pattern in IDEMPOTENT_ROUTES
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        idempotency_key = _header(scope, b"idempotency-key")
+        subject = _token_subject(scope) if idempotency_key else None
+        if not idempotency_key or not subject:
+            await self.app(scope, receive, send)
+            return
+        if len(idempotency_key) > MAX_KEY_LENGTH:
+            await _send_error(send, 400, f"Idempotency-Key cannot exceed {MAX_KEY_LENGTH} characters")
+            return
+
+        # Тело читаем целиком: по нему проверяется, что ключ не переиспользован для другого запроса
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+        fingerprint = hashlib.sha256(body).hexdigest()
+        key = f"{subject}:{scope['method']}:{scope['path']}:{idempotency_key}"
+
+        stored = await run_in_threadpool(redis_client.get_idempotent_response, key)
+        if stored is None:
+            locked = await run_in_threadpool(redis_client.acquire_idempotency_lock, key)
+            if locked is None:
+                # Без Redis идемпотентность не гарантируем, но запрос не отклоняем
+                await self.app(scope, self._replay_body(body, receive), send)
+                return
+            if locked:
+                await self._run_and_store(scope, receive, body, fingerprint, key, send)
+                return
+            stored = await self._wait_for_response(key)
+            if stored is None:
+                await _send_error(send, 409, "A request with this Idempotency-Key is already in progress")
+                return
+
+        if stored["fingerprint"] != fingerprint:
+            await _send_error(send, 422, "Idempotency-Key was already used with a different request")
+            return
+        await _send_json(send, stored["status"], stored["body"].encode(), replayed=True)
+
+    @staticmethod
+    def _replay_body(body: bytes, receive: Receive) -> Receive:
+        """Отдает приложению уже прочитанное тело, дальше - исходный receive (disconnect)."""
+        sent = False
+
+        async def replay() -> Message:
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return replay
+
+    async def _wait_for_response(self, key: str) -> Optional[dict]:
+        waited = 0.0
+        while waited < IDEMPOTENCY_WAIT_SECONDS:
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+            waited += IDEMPOTENCY_POLL_SECONDS
+            stored = await run_in_threadpool(redis_client.get_idempotent_response, key)
+            if stored is not None:
+                return stored
+        return None
+
+    async def _run_and_store(self, scope: Scope, receive: Receive, body: bytes, fingerprint: str, key: str,
+                             send: Send) -> None:
+        status = 500
+        chunks = []
+
+        async def capture(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, self._replay_body(body, receive), capture)
+        finally:
+            # Сохраняем только успешные ответы: при ошибке обработчик ничего не записал,
+            # и повтор с тем же ключом должен выполниться заново
+            if 200 <= status < 300:
+                response = {
+                    "status": status,
+                    "body": b"".join(chunks).decode("utf-8"),
+                    "fingerprint": fingerprint,
+                }
+                await run_in_threadpool(redis_client.store_idempotent_response, key, response, IDEMPOTENCY_TTL_SECONDS)
+            else:
+                await run_in_threadpool(redis_client.release_idempotency_lock, key)
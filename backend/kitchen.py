@@ -0,0 +1,134 @@
+"""
+Очередь кухни: статусы приготовления позиций заказа и события для кухонных экранов.
+Экраны читают очередь и события только из Redis (поток kitchen:events и его проекция),
+Postgres нужен лишь для записи изменений и для перестроения проекции
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session
+
+import models
+
+
+PREP_STATUSES = ["queued", "cooking", "ready", "served"]
+# Кто меняет статус приготовления: повара с кухонных экранов и администратор
+PREP_STATUS_ROLES = ("kitchen", "admin")
+DEFAULT_STATION = "hot"
+
+# Пары (тип события, данные позиции) для redis_client.publish_kitchen_events
+KitchenEvent = Tuple[str, Dict]
+
+
+def item_data(item: models.OrderItem, order: models.Order, dish: Optional[models.Dish]) -> Dict:
+    return {
+        "item_id": item.id,
+        "order_id": order.id,
+        "order_code": order.code,
+        "table_number": order.table_number,
+        "dish_id": item.dish_id,
+        "dish_name": item.dish_name or (dish.name if dish else "Unknown"),
+        "station": (dish.station if dish else None) or DEFAULT_STATION,
+        "quantity": item.quantity,
+        "status": item.prep_status,
+        "queued_at": item.created_at.isoformat() if item.created_at else None,
+    }
+
+
+def build_events(db: Session, order: models.Order, changes: Sequence[Tuple[str, models.OrderItem]]) -> List[KitchenEvent]:
+    dish_ids = {item.dish_id for _, item in changes}
+    dishes = {}
+    if dish_ids:
+        dishes = {dish.id: dish for dish in db.query(models.Dish).filter(models.Dish.id.in_(dish_ids))}
+    return [(event_type, item_data(item, order, dishes.get(item.dish_id))) for event_type, item in changes]
+
+
+def reconcile_items(db: Session, order_id: int, new_items,
+                    dishes: Dict[int, models.Dish]) -> List[Tuple[str, models.OrderItem]]:
+    """Приводит позиции заказа к новому списку, не сбрасывая уже начатое приготовление.
+
+    Позиция с тем же блюдом сохраняется вместе со статусом и ценой на момент заказа.
+    Если количество выросло, а блюдо уже готовится, добавка уходит на кухню отдельной
+    позицией по текущей цене из dishes. Возвращает изменения (тип события, позиция);
+    новые позиции уже добавлены в сессию.
+    """
+    old_by_dish: Dict[int, List[models.OrderItem]] = {}
+    for item in db.query(models.OrderItem).filter(models.OrderItem.order_id == order_id).order_by(models.OrderItem.id):
+        old_by_dish.setdefault(item.dish_id, []).append(item)
+
+    changes = []
+    for new_item in new_items:
+        candidates = old_by_dish.get(new_item.dish_id)
+        existing = candidates.pop(0) if candidates else None
+
+        if existing is None:
+            added = models.OrderItem(order_id=order_id, dish_id=new_item.dish_id, quantity=new_item.quantity,
+                                     **models.dish_snapshot(dishes[new_item.dish_id]))
+            db.add(added)
+            changes.append(("queued", added))
+        elif new_item.quantity > existing.quantity and existing.prep_status != "queued":
+            added = models.OrderItem(order_id=order_id, dish_id=new_item.dish_id,
+                                     quantity=new_item.quantity - existing.quantity,
+                                     **models.dish_snapshot(dishes[new_item.dish_id]))
+            db.add(added)
+            changes.append(("queued", added))
+        elif new_item.quantity != existing.quantity:
+            existing.quantity = new_item.quantity
+            changes.append(("updated", existing))
+
+    for leftovers in old_by_dish.values():
+        for item in leftovers:
+            db.delete(item)
+            changes.append(("removed", item))
+
+    db.flush()
+    return changes
+
+
+def order_events(db: Session, order: models.Order, event_type: str) -> List[KitchenEvent]:
+    """Событие для каждой неподанной позиции заказа: "removed", когда заказ завершен
+    или удален, "updated", когда поменялись общие для позиций поля (номер стола)."""
+    return orders_events(db, [order], event_type)
+
+
+def orders_events(db: Session, orders: Sequence[models.Order], event_type: str) -> List[KitchenEvent]:
+    """order_events для нескольких заказов: позиции и блюда читаются одним запросом на всех."""
+    by_id = {order.id: order for order in orders}
+    if not by_id:
+        return []
+    items = (
+        db.query(models.OrderItem)
+        .filter(models.OrderItem.order_id.in_(by_id), models.OrderItem.prep_status != "served")
+        .order_by(models.OrderItem.id)
+        .all()
+    )
+    dish_ids = {item.dish_id for item in items}
+    dishes = {}
+    if dish_ids:
+        dishes = {dish.id: dish for dish in db.query(models.Dish).filter(models.Dish.id.in_(dish_ids))}
+    return [(event_type, item_data(item, by_id[item.order_id], dishes.get(item.dish_id))) for item in items]
+
+
+def active_items(db: Session, restaurant_id: int = models.DEFAULT_RESTAURANT_ID) -> List[Dict]:
+    """Позиции, которые должны быть на кухонных экранах ресторана (для перестроения проекции)."""
+    rows = (
+        db.query(models.OrderItem, models.Order, models.Dish)
+        .join(models.Order, models.Order.id == models.OrderItem.order_id)
+        .outerjoin(models.Dish, models.Dish.id == models.OrderItem.dish_id)
+        .filter(
+            models.Order.restaurant_id == restaurant_id,
+            models.Order.status != "completed",
+            models.OrderItem.prep_status != "served",
+        )
+        .all()
+    )
+    return [item_data(item, order, dish) for item, order, dish in rows]
+
+
+def group_by_station(items: List[Dict], station: Optional[str] = None) -> List[Dict]:
+    grouped: Dict[str, List[Dict]] = {}
+    for item in sorted(items, key=lambda i: (i.get("queued_at") or "", i["item_id"])):
+        if station and item["station"] != station:
+            continue
+        grouped.setdefault(item["station"], []).append(item)
+    return [{"station": name, "items": grouped[name]} for name in sorted(grouped)]
+
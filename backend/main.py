@@ -1,35 +1,78 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Header
+from fastapi import FastAPI, Depends, HTTPException, status, Header, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import func, insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, List, Optional, Tuple
 import models
 import auth
-from database import engine, get_db, init_restaurant_config, wait_for_db
+import bulk_io
+import bulk_orders
+import kitchen
+import outbox
+import reservations
+import stock
+import table_state
+from database import engine, get_db, get_read_db, init_restaurant_config, primary_pinned, wait_for_db, SessionLocal
 from schemas import (
     UserCreate,
     UserResponse,
+    InviteCreate,
+    InviteResponse,
+    RestaurantCreate,
     DishCreate,
     DishResponse,
+    DishStockUpdate,
     OrderItemCreate,
     OrderItemResponse,
     OrderCreate,
     OrderResponse,
     OrderUpdate,
+    OrderBulkStatus,
+    OrderBulkDelete,
     TableResponse,
+    TableSeatsUpdate,
+    FreeTableResponse,
+    ReservationCreate,
+    ReservationResponse,
+    as_utc,
     RestaurantConfigUpdate,
     UserLogin,
     PasswordChange,
+    PopularDishResponse,
+    KitchenQueueResponse,
+    KitchenEventsResponse,
+    KITCHEN_STATIONS,
 )
-from datetime import datetime
+from datetime import datetime, timezone
 import uvicorn
 import os
 import random
+import secrets
 import string
-from redis_client import redis_client
+import threading
+from redis_client import redis_client, order_cache_key, waiter_orders_cache_key, popular_hour, POPULAR_WINDOWS
+from menu_search import TenantMenuIndexes
+from migrations import run_migrations
+from idempotency import IdempotencyMiddleware
+from read_your_writes import ReadYourWritesMiddleware
+from readiness import Readiness
 
 
 app = FastAPI()
 
+menu_indexes = TenantMenuIndexes()
+readiness = Readiness(engine, redis_client)
+
+# Добавляется раньше CORS, чтобы CORS-заголовки получали и повторно отданные ответы
+app.add_middleware(IdempotencyMiddleware)
+# Снаружи идемпотентности: повтор записи тоже закрепляет клиента за основной БД
+app.add_middleware(ReadYourWritesMiddleware)
+
 
 origins = [
     "http://localhost",
@@ -57,6 +100,7 @@ def startup_event():
         try:
             print("Создание таблиц в базе данных...")
             models.Base.metadata.create_all(bind=engine)
+            run_migrations(engine)
             print("Таблицы успешно созданы")
 
             # Инициализируем конфигурацию ресторана (создаст 10 столов при первом запуске)
@@ -68,11 +112,48 @@ def startup_event():
     else:
         print("Не удалось дождаться готовности базы данных при старте сервиса")
 
+    readiness.start()
+
     # После БД проверяем доступность Redis
     if redis_client.is_available():
         print(" Redis доступен")
     else:
         print("️ Redis недоступен, кеширование отключено")
+        return
+
+    # Redis мог быть перезапущен без данных: восстанавливаем очереди кухонь из БД
+    try:
+        db = SessionLocal()
+        try:
+            restaurant_ids = [row[0] for row in db.query(models.RestaurantConfig.restaurant_id)]
+        finally:
+            db.close()
+        for restaurant_id in restaurant_ids:
+            if not redis_client.has_kitchen_queue(restaurant_id):
+                print(f" Очередь кухни ресторана {restaurant_id} восстановлена: "
+                      f"{rebuild_kitchen_queue(restaurant_id)} позиций")
+    except Exception as e:
+        print(f"Ошибка восстановления очереди кухни: {e}")
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    readiness.stop()
+
+
+def get_restaurant_id(restaurant_id: int = models.DEFAULT_RESTAURANT_ID,
+                      authorization: Optional[str] = Header(None)) -> int:
+    """Ресторан для публичных эндпоинтов: из токена, если он передан, иначе из параметра restaurant_id"""
+    if authorization and authorization.startswith("Bearer "):
+        payload = auth.verify_token(authorization.replace("Bearer ", ""))
+        if payload:
+            return token_restaurant_id(payload)
+    return restaurant_id
+
+
+def token_restaurant_id(payload: dict) -> int:
+    # Токены, выданные до появления нескольких ресторанов, относятся к ресторану по умолчанию
+    return payload.get("restaurant_id", models.DEFAULT_RESTAURANT_ID)
 
 
 @app.get("/cache-test")
@@ -92,10 +173,13 @@ def cache_test():
 
 
 @app.get("/cache/info")
-def get_cache_info():
-    """Получить информацию о состоянии кеша"""
-    return redis_client.get_cache_info()
+def get_cache_info(restaurant_id: int = Depends(get_restaurant_id)):
+    """Получить информацию о состоянии кеша ресторана"""
+    return redis_client.get_cache_info(restaurant_id)
+
 
+# Ключ оператора для POST /restaurants (из секрета); пустой - новые рестораны не заводятся
+PROVISIONING_KEY = os.getenv("PROVISIONING_KEY", "")
 
 # Разделение логики по типу сервиса
 SERVICE_TYPE = os.getenv("SERVICE_TYPE", "menu")
@@ -109,19 +193,24 @@ else:
     def menu_health():
         return {"status": "menu service healthy"}
 
-async def get_current_user(authorization: Optional[str] = Header(None), db: Session = Depends(get_db)):
+def get_token_payload(authorization: Optional[str] = Header(None)) -> dict:
+    """Проверка JWT без обращения к БД: для эндпоинтов, которые не должны ходить в Postgres"""
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Not authenticated")
 
     token = authorization.replace("Bearer ", "")
     payload = auth.verify_token(token)
 
-    if not payload:
+    if not payload or not payload.get("sub"):
         raise HTTPException(status_code=401, detail="Invalid token")
 
+    return payload
+
+
+def get_current_user(payload: dict = Depends(get_token_payload), db: Session = Depends(get_db)):
+    # Синхронная зависимость выполняется в пуле потоков: запрос к БД в async-зависимости
+    # блокировал бы event loop, а при исчерпанном пуле соединений - подвешивал весь процесс
     username = payload.get("sub")
-    if not username:
-        raise HTTPException(status_code=401, detail="Invalid token")
 
     user = db.query(models.User).filter(models.User.username == username).first()
     if not user:
@@ -140,20 +229,78 @@ def health_check():
     return {"status": "ok", "message": "API is running"}
 
 
+@app.get("/live")
+async def liveness_check():
+    # Только сам процесс: перезапуск пода не лечит недоступную БД
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def readiness_check():
+    ready, verdict = readiness.snapshot()
+    return JSONResponse(verdict, status_code=200 if ready else 503)
+
+
 @app.post("/register", response_model=UserResponse)
-def register(user: UserCreate, db: Session = Depends(get_db)):
+def register(user: UserCreate, db: Session = Depends(get_db), authorization: Optional[str] = Header(None)):
     print(f"Регистрация пользователя: {user.username}")
+    restaurant_id, role = auth.registration_target(db, user.role, user.invite, authorization)
 
     db_user = db.query(models.User).filter(models.User.username == user.username).first()
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
 
     hashed_password = auth.get_password_hash(user.password)
-    db_user = models.User(username=user.username, password=hashed_password, role=user.role)
+    db_user = models.User(username=user.username, password=hashed_password, role=role, restaurant_id=restaurant_id)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
     print(f"Пользователь создан: {db_user.id}")
+
+    # Первый администратор пустой установки создает конфигурацию и столы ресторана
+    config_exists = db.query(models.RestaurantConfig.id).filter(
+        models.RestaurantConfig.restaurant_id == restaurant_id
+    ).first()
+    if not config_exists:
+        init_restaurant_config(restaurant_id)
+    return db_user
+
+
+@app.post("/invites", response_model=InviteResponse)
+def create_invite(invite: InviteCreate, current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only administrators can invite users")
+
+    code, expires_at = auth.create_invite(current_user.restaurant_id, invite.role)
+    return {"invite": code, "role": invite.role, "expires_at": expires_at}
+
+
+@app.post("/restaurants", response_model=UserResponse)
+def create_restaurant(restaurant: RestaurantCreate, db: Session = Depends(get_db),
+                      x_provisioning_key: Optional[str] = Header(None)):
+    # Рестораны заводит оператор ключом из секрета; без PROVISIONING_KEY эндпоинт выключен
+    if not PROVISIONING_KEY or not secrets.compare_digest(x_provisioning_key or "", PROVISIONING_KEY):
+        raise HTTPException(status_code=403, detail="Restaurant provisioning is not allowed")
+
+    restaurant_id = restaurant.restaurant_id
+    if restaurant_id is None:
+        restaurant_id = max(
+            db.query(func.max(models.RestaurantConfig.restaurant_id)).scalar() or 0,
+            db.query(func.max(models.User.restaurant_id)).scalar() or 0,
+        ) + 1
+    exists = db.query(models.User.id).filter(models.User.restaurant_id == restaurant_id).first() or \
+        db.query(models.RestaurantConfig.id).filter(models.RestaurantConfig.restaurant_id == restaurant_id).first()
+    if exists:
+        raise HTTPException(status_code=409, detail=f"Restaurant {restaurant_id} already exists")
+    if db.query(models.User.id).filter(models.User.username == restaurant.admin.username).first():
+        raise HTTPException(status_code=400, detail="Username already registered")
+
+    db_user = models.User(username=restaurant.admin.username, password=auth.get_password_hash(restaurant.admin.password),
+                          role="admin", restaurant_id=restaurant_id)
+    db.add(db_user)
+    db.commit()
+    db.refresh(db_user)
+    init_restaurant_config(restaurant_id)
     return db_user
 
 
@@ -164,7 +311,9 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
     if not db_user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
 
-    access_token = auth.create_access_token(data={"sub": db_user.username, "role": db_user.role})
+    access_token = auth.create_access_token(
+        data={"sub": db_user.username, "role": db_user.role, "restaurant_id": db_user.restaurant_id}
+    )
 
     return {
         "access_token": access_token,
@@ -172,7 +321,8 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
         "user": {
             "id": db_user.id,
             "username": db_user.username,
-            "role": db_user.role
+            "role": db_user.role,
+            "restaurant_id": db_user.restaurant_id
         }
     }
 
@@ -183,10 +333,10 @@ def get_current_user_info(current_user: models.User = Depends(get_current_user))
 
 
 @app.get("/users", response_model=List[UserResponse])
-def get_users(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def get_users(db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Only administrators can view users")
-    return db.query(models.User).all()
+    return db.query(models.User).filter(models.User.restaurant_id == current_user.restaurant_id).all()
 
 
 @app.delete("/users/{user_id}")
@@ -197,7 +347,10 @@ def delete_user(user_id: int, db: Session = Depends(get_db), current_user: model
     if user_id == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot delete your own account")
 
-    user_to_delete = db.query(models.User).filter(models.User.id == user_id).first()
+    user_to_delete = db.query(models.User).filter(
+        models.User.id == user_id,
+        models.User.restaurant_id == current_user.restaurant_id
+    ).first()
     if not user_to_delete:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -205,44 +358,11 @@ def delete_user(user_id: int, db: Session = Depends(get_db), current_user: model
 
     try:
         if user_to_delete.role == "waiter":
-            null_orders = db.query(models.Order).filter(models.Order.waiter_id == None).all()
-            for order in null_orders:
-                table = db.query(models.Table).filter(models.Table.current_order_id == order.id).first()
-                if table:
-                    table.is_available = True
-                    table.current_order_id = None
-                db.delete(order)
-
-            if null_orders:
-                print(f"Удалено {len(null_orders)} заказов с NULL waiter_id")
-
-            waiter_orders = db.query(models.Order).filter(models.Order.waiter_id == user_id).all()
-
-            if waiter_orders:
-
-                other_waiter = db.query(models.User).filter(
-                    models.User.role == "waiter",
-                    models.User.id != user_id
-                ).first()
-
-                if other_waiter:
-
-                    for order in waiter_orders:
-                        order.waiter_id = other_waiter.id
-                    transfer_message = f" All {len(waiter_orders)} orders transferred to {other_waiter.username}."
-                else:
-
-                    for order in waiter_orders:
-                        table = db.query(models.Table).filter(models.Table.current_order_id == order.id).first()
-                        if table:
-                            table.is_available = True
-                            table.current_order_id = None
-                        db.query(models.OrderItem).filter(models.OrderItem.order_id == order.id).delete()
-                        db.delete(order)
-                    transfer_message = f" All {len(waiter_orders)} orders deleted (no other waiters available)."
-
-            db.flush()
-
+            moved, other_waiter = bulk_orders.hand_over_waiter_orders(db, user_to_delete)
+            if moved and other_waiter:
+                transfer_message = f" All {moved} orders transferred to {other_waiter.username}."
+            elif moved:
+                transfer_message = f" All {moved} orders deleted (no other waiters available)."
 
         db.delete(user_to_delete)
         db.commit()
@@ -286,12 +406,16 @@ def transfer_order(order_id: int, new_waiter_id: int, db: Session = Depends(get_
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Only administrators can transfer orders")
 
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
+    order = db.query(models.Order).filter(
+        models.Order.id == order_id,
+        models.Order.restaurant_id == current_user.restaurant_id
+    ).first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
     new_waiter = db.query(models.User).filter(
         models.User.id == new_waiter_id,
+        models.User.restaurant_id == current_user.restaurant_id,
         models.User.role == "waiter"
     ).first()
 
@@ -301,6 +425,8 @@ def transfer_order(order_id: int, new_waiter_id: int, db: Session = Depends(get_
     if not new_waiter.id:
         raise HTTPException(status_code=400, detail="Invalid waiter ID")
 
+    outbox.enqueue(db, "invalidate_orders", restaurant_id=order.restaurant_id, order_ids=[order_id],
+                   waiter_ids=[order.waiter_id, new_waiter.id])
     order.waiter_id = new_waiter.id
     db.commit()
 
@@ -311,7 +437,10 @@ def transfer_order(order_id: int, new_waiter_id: int, db: Session = Depends(get_
 def delete_own_account(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
 
     if current_user.role == "admin":
-        admin_count = db.query(models.User).filter(models.User.role == "admin").count()
+        admin_count = db.query(models.User).filter(
+            models.User.role == "admin",
+            models.User.restaurant_id == current_user.restaurant_id
+        ).count()
         if admin_count <= 1:
             raise HTTPException(
                 status_code=400,
@@ -322,40 +451,11 @@ def delete_own_account(db: Session = Depends(get_db), current_user: models.User
 
     try:
         if current_user.role == "waiter":
-            null_orders = db.query(models.Order).filter(models.Order.waiter_id == None).all()
-            for order in null_orders:
-                table = db.query(models.Table).filter(models.Table.current_order_id == order.id).first()
-                if table:
-                    table.is_available = True
-                    table.current_order_id = None
-                db.delete(order)
-
-            if null_orders:
-                print(f"Удалено {len(null_orders)} заказов с NULL waiter_id")
-
-            user_orders = db.query(models.Order).filter(models.Order.waiter_id == current_user.id).all()
-
-            if user_orders:
-                other_waiter = db.query(models.User).filter(
-                    models.User.role == "waiter",
-                    models.User.id != current_user.id
-                ).first()
-
-                if other_waiter:
-                    for order in user_orders:
-                        order.waiter_id = other_waiter.id
-                    transfer_message = f" Все {len(user_orders)} заказов переданы официанту {other_waiter.username}."
-                else:
-                    for order in user_orders:
-                        table = db.query(models.Table).filter(models.Table.current_order_id == order.id).first()
-                        if table:
-                            table.is_available = True
-                            table.current_order_id = None
-                        db.query(models.OrderItem).filter(models.OrderItem.order_id == order.id).delete()
-                        db.delete(order)
-                    transfer_message = f" Все {len(user_orders)} заказов удалены (нет других официантов)."
-
-            db.flush()
+            moved, other_waiter = bulk_orders.hand_over_waiter_orders(db, current_user)
+            if moved and other_waiter:
+                transfer_message = f" Все {moved} заказов переданы официанту {other_waiter.username}."
+            elif moved:
+                transfer_message = f" Все {moved} заказов удалены (нет других официантов)."
 
         username = current_user.username
 
@@ -383,24 +483,9 @@ def cleanup_problematic_orders(db: Session = Depends(get_db), current_user: mode
 
     try:
 
-        problematic_orders = db.query(models.Order).filter(models.Order.waiter_id == None).all()
-
-        deleted_count = 0
-        for order in problematic_orders:
-
-            table = db.query(models.Table).filter(models.Table.current_order_id == order.id).first()
-            if table:
-                table.is_available = True
-                table.current_order_id = None
-
-            db.delete(order)
-            deleted_count += 1
-
+        deleted_count = len(bulk_orders.delete_orphans(db, current_user.restaurant_id))
         db.commit()
 
-        redis_client.invalidate_all_orders_cache()
-        redis_client.invalidate_tables_cache()
-
         return {
             "message": f"Cleaned up {deleted_count} problematic orders with NULL waiter_id",
             "deleted_count": deleted_count
@@ -410,32 +495,155 @@ def cleanup_problematic_orders(db: Session = Depends(get_db), current_user: mode
         print(f"Error during cleanup: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Cleanup error: {str(e)}")
 
+# Столы и меню отдаются из кеша Redis, а промах перезаполняет его: читать такие данные
+# с отстающей реплики значило бы закешировать устаревший ответ на весь TTL
 @app.get("/tables", response_model=List[TableResponse])
-def get_tables(db: Session = Depends(get_db)):
-    cached_tables = redis_client.get_cached_tables()
-    if cached_tables:
-        return [TableResponse(**table) for table in cached_tables]
+def get_tables(db: Session = Depends(get_db), restaurant_id: int = Depends(get_restaurant_id)):
+    tables = redis_client.get_tables(restaurant_id, lambda: table_state.load_tables(db, restaurant_id))
+    return [TableResponse(**table) for table in tables]
 
-    tables = db.query(models.Table).order_by(models.Table.number).all()
-    tables_data = [{"id": t.id, "number": t.number, "is_available": t.is_available, "current_order_id": t.current_order_id} for t in tables]
 
-    redis_client.cache_tables(tables_data)
-    
-    return tables
+@app.get("/tables/available", response_model=List[TableResponse])
+def get_available_tables(db: Session = Depends(get_db), restaurant_id: int = Depends(get_restaurant_id)):
+    tables = redis_client.get_available_tables(
+        restaurant_id, lambda: table_state.load_tables(db, restaurant_id, available_only=True)
+    )
+    return [TableResponse(**table) for table in tables]
+
+
+def rebuild_free_tables(db: Session, restaurant_id: int) -> List[int]:
+    """Строит карту свободных столов из БД; без Redis ответ дает сам запрос.
+
+    Поколение карты читается до запроса: если воркер успел изменить карту,
+    перестроенная по более старому снимку БД карта не записывается.
+    """
+    generation = redis_client.free_tables_generation(restaurant_id)
+    numbers = [number for (number,) in db.query(models.Table.number).filter(
+        models.Table.restaurant_id == restaurant_id,
+        models.Table.is_available == True
+    )]
+    if generation is not None:
+        redis_client.replace_free_tables(restaurant_id, numbers, generation)
+    return numbers
+
+
+@app.get("/tables/free/first")
+def get_first_free_table(db: Session = Depends(get_db), restaurant_id: int = Depends(get_restaurant_id)):
+    number = redis_client.first_free_table(restaurant_id)
+    if number is None:
+        number = min(rebuild_free_tables(db, restaurant_id), default=-1)
+    if number < 0:
+        raise HTTPException(status_code=404, detail="No free tables")
+    return {"number": number}
+
+
+@app.get("/tables/{number}/available")
+def is_table_available(number: int, db: Session = Depends(get_db), restaurant_id: int = Depends(get_restaurant_id)):
+    if number < 1:
+        raise HTTPException(status_code=400, detail="Table number must be positive")
+    available = redis_client.is_table_free(restaurant_id, number)
+    if available is None:
+        available = number in rebuild_free_tables(db, restaurant_id)
+    return {"number": number, "is_available": available}
+
+
+@app.put("/tables/{number}/seats", response_model=TableResponse)
+def update_table_seats(number: int, update: TableSeatsUpdate, db: Session = Depends(get_db),
+                       current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only administrators can change table seats")
 
+    table = db.query(models.Table).filter(
+        models.Table.restaurant_id == current_user.restaurant_id,
+        models.Table.number == number
+    ).first()
+    if not table:
+        raise HTTPException(status_code=404, detail="Table not found")
 
-@app.get("/tables/available", response_model=List[TableResponse])
-def get_available_tables(db: Session = Depends(get_db)):
-    cached_tables = redis_client.get_cached_available_tables()
-    if cached_tables:
-        return [TableResponse(**table) for table in cached_tables]
+    table.seats = update.seats
+    outbox.enqueue(db, "invalidate_tables", restaurant_id=table.restaurant_id)
+    db.commit()
+    db.refresh(table)
+    return table
+
+
+# Брони читаются с реплики: после собственной записи клиента запросы
+# к ним уходят на primary (read_your_writes), а саму бронь проверяет primary
+@app.get("/tables/free", response_model=List[FreeTableResponse])
+def get_free_tables_for_interval(starts_at: datetime, ends_at: datetime, guests: int = 1,
+                                 db: Session = Depends(get_read_db),
+                                 current_user: models.User = Depends(get_current_user)):
+    """Столы без броней на интервал, вмещающие guests гостей; текущие заказы не учитываются"""
+    starts_at, ends_at = as_utc(starts_at), as_utc(ends_at)
+    if ends_at <= starts_at:
+        raise HTTPException(status_code=400, detail="ends_at must be after starts_at")
+    if guests < 1:
+        raise HTTPException(status_code=400, detail="guests must be positive")
+
+    return reservations.free_tables(db, current_user.restaurant_id, starts_at, ends_at, guests)
+
+
+@app.get("/reservations", response_model=List[ReservationResponse])
+def get_reservations(date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                     table_number: Optional[int] = None, db: Session = Depends(get_read_db),
+                     current_user: models.User = Depends(get_current_user)):
+    """Брони ресторана, пересекающиеся с периодом; по умолчанию - еще не закончившиеся"""
+    date_from = as_utc(date_from) if date_from else datetime.now(timezone.utc)
+    query = db.query(models.Reservation).filter(
+        models.Reservation.restaurant_id == current_user.restaurant_id,
+        models.Reservation.ends_at > date_from
+    )
+    if date_to:
+        query = query.filter(models.Reservation.starts_at < as_utc(date_to))
+    if table_number is not None:
+        query = query.filter(models.Reservation.table_number == table_number)
+    return query.order_by(models.Reservation.starts_at, models.Reservation.table_number).all()
+
+
+@app.post("/reservations", response_model=ReservationResponse)
+def create_reservation(reservation: ReservationCreate, db: Session = Depends(get_db),
+                       current_user: models.User = Depends(get_current_user)):
+    restaurant_id = current_user.restaurant_id
+    if reservation.ends_at <= datetime.now(timezone.utc):
+        raise HTTPException(status_code=400, detail="Reservation is in the past")
+
+    table = db.query(models.Table).filter(
+        models.Table.restaurant_id == restaurant_id,
+        models.Table.number == reservation.table_number
+    ).first()
+    if not table:
+        raise HTTPException(status_code=404, detail="Table not found")
+    if reservation.guests > table.seats:
+        raise HTTPException(status_code=400, detail=f"Table {table.number} seats only {table.seats} guests")
 
-    tables = db.query(models.Table).filter(models.Table.is_available == True).order_by(models.Table.number).all()
-    tables_data = [{"id": t.id, "number": t.number, "is_available": t.is_available, "current_order_id": t.current_order_id} for t in tables]
+    # В Postgres одновременные брони одного стола отсекает ограничение-исключение,
+    # проверка здесь дает понятный ответ в остальных случаях
+    if reservations.conflicting(db, restaurant_id, reservation.table_number,
+                                reservation.starts_at, reservation.ends_at):
+        raise HTTPException(status_code=409, detail="Table is already reserved for this time")
 
-    redis_client.cache_available_tables(tables_data)
-    
-    return tables
+    db_reservation = models.Reservation(restaurant_id=restaurant_id, **reservation.dict())
+    db.add(db_reservation)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Table is already reserved for this time")
+    db.refresh(db_reservation)
+    return db_reservation
+
+
+@app.delete("/reservations/{reservation_id}")
+def delete_reservation(reservation_id: int, db: Session = Depends(get_db),
+                       current_user: models.User = Depends(get_current_user)):
+    deleted = db.query(models.Reservation).filter(
+        models.Reservation.id == reservation_id,
+        models.Reservation.restaurant_id == current_user.restaurant_id
+    ).delete(synchronize_session=False)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    db.commit()
+    return {"message": "Reservation cancelled"}
 
 
 @app.put("/restaurant/config")
@@ -444,24 +652,27 @@ def update_restaurant_config(config: RestaurantConfigUpdate, db: Session = Depen
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Only administrators can update restaurant config")
 
-    if config.total_tables < 1 or config.total_tables > 100:
+    if config.total_tables < 1 or config.total_tables > models.MAX_TABLES:
         raise HTTPException(
             status_code=400,
-            detail="Количество столов должно быть от 1 до 100"
+            detail=f"Количество столов должно быть от 1 до {models.MAX_TABLES}"
         )
 
+    restaurant_id = current_user.restaurant_id
     try:
-        db_config = db.query(models.RestaurantConfig).first()
+        db_config = db.query(models.RestaurantConfig).filter(models.RestaurantConfig.restaurant_id == restaurant_id).first()
         if not db_config:
-            db_config = models.RestaurantConfig(total_tables=config.total_tables)
+            db_config = models.RestaurantConfig(restaurant_id=restaurant_id, total_tables=config.total_tables)
             db.add(db_config)
         else:
             db_config.total_tables = config.total_tables
 
-        existing_tables = db.query(models.Table).count()
+        tables = db.query(models.Table).filter(models.Table.restaurant_id == restaurant_id)
+        existing_tables = tables.count()
 
-        busy_tables = db.query(models.Table).filter(models.Table.is_available == False).all()
-        max_busy_number = max((t.number for t in busy_tables), default=0)
+        max_busy_number = tables.filter(models.Table.is_available == False).with_entities(
+            func.max(models.Table.number)
+        ).scalar() or 0
 
         if config.total_tables < max_busy_number:
             raise HTTPException(
@@ -469,23 +680,34 @@ def update_restaurant_config(config: RestaurantConfigUpdate, db: Session = Depen
                 detail=f"Невозможно уменьшить количество столов ниже номера последнего занятого стола (#{max_busy_number})"
             )
 
+        max_reserved_number = db.query(func.max(models.Reservation.table_number)).filter(
+            models.Reservation.restaurant_id == restaurant_id,
+            models.Reservation.ends_at > datetime.now(timezone.utc)
+        ).scalar() or 0
+
+        if config.total_tables < max_reserved_number:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Невозможно уменьшить количество столов ниже номера последнего забронированного стола (#{max_reserved_number})"
+            )
+
+        # Тысячи столов создаются и удаляются одним запросом, без ORM-объекта на стол
         if config.total_tables > existing_tables:
-            for i in range(existing_tables + 1, config.total_tables + 1):
-                new_table = models.Table(number=i, is_available=True)
-                db.add(new_table)
+            db.execute(insert(models.Table), [
+                {"restaurant_id": restaurant_id, "number": number, "is_available": True}
+                for number in range(existing_tables + 1, config.total_tables + 1)
+            ])
         elif config.total_tables < existing_tables:
-            tables_to_delete = db.query(models.Table).filter(
+            tables.filter(
                 models.Table.number > config.total_tables,
                 models.Table.is_available == True,
                 models.Table.current_order_id == None
-            ).all()
-            for table in tables_to_delete:
-                db.delete(table)
+            ).delete(synchronize_session=False)
 
+        outbox.enqueue(db, "invalidate_tables", restaurant_id=restaurant_id)
+        outbox.enqueue(db, "reset_free_tables", restaurant_id=restaurant_id)
         db.commit()
 
-        redis_client.invalidate_tables_cache()
-
         return {
             "message": f"Restaurant configuration updated successfully. Total tables: {config.total_tables}",
             "total_tables": config.total_tables
@@ -499,27 +721,52 @@ def update_restaurant_config(config: RestaurantConfigUpdate, db: Session = Depen
         raise HTTPException(status_code=500, detail="Internal server error while updating restaurant config")
 
 
-@app.get("/dishes", response_model=List[DishResponse])
-def get_dishes(db: Session = Depends(get_db)):
-    cached_dishes = redis_client.get_cached_dishes()
+def load_dishes_data(db: Session, restaurant_id: int) -> List[dict]:
+    cached_dishes = redis_client.get_cached_dishes(restaurant_id)
     if cached_dishes:
-        return [DishResponse(**dish) for dish in cached_dishes]
+        return cached_dishes
 
-    dishes = db.query(models.Dish).all()
+    dishes = db.query(models.Dish).filter(models.Dish.restaurant_id == restaurant_id).all()
     dishes_data = [
         {
             "id": dish.id,
             "name": dish.name,
             "description": dish.description,
             "price": float(dish.price),
-            "available": dish.available
+            "available": dish.available,
+            "station": dish.station
         }
         for dish in dishes
     ]
 
-    redis_client.cache_dishes(dishes_data)
-    
-    return dishes
+    redis_client.cache_dishes(restaurant_id, dishes_data)
+
+    return dishes_data
+
+
+def load_menu_for_search(restaurant_id: int) -> List[dict]:
+    # Индекс может перестраиваться в фоновом потоке, поэтому сессия своя
+    db = SessionLocal()
+    try:
+        return load_dishes_data(db, restaurant_id)
+    finally:
+        db.close()
+
+
+@app.get("/dishes", response_model=List[DishResponse])
+def get_dishes(db: Session = Depends(get_db), restaurant_id: int = Depends(get_restaurant_id)):
+    return [DishResponse(**dish) for dish in load_dishes_data(db, restaurant_id)]
+
+
+@app.get("/dishes/search", response_model=List[DishResponse])
+def search_dishes(q: str, limit: int = 20, restaurant_id: int = Depends(get_restaurant_id)):
+    if limit < 1 or limit > 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
+
+    menu_index = menu_indexes.get(restaurant_id)
+    menu_index.ensure_fresh(redis_client.get_dishes_version(restaurant_id),
+                            lambda: load_menu_for_search(restaurant_id))
+    return menu_index.search(q, limit)
 
 
 @app.post("/dishes", response_model=DishResponse)
@@ -531,12 +778,13 @@ def create_dish(dish: DishCreate, db: Session = Depends(get_db), current_user: m
         if dish.price <= 0:
             raise HTTPException(status_code=400, detail="Price must be greater than 0")
         
-        db_dish = models.Dish(**dish.dict())
+        db_dish = models.Dish(**dish.dict(), restaurant_id=current_user.restaurant_id)
         db.add(db_dish)
+        outbox.enqueue(db, "invalidate_dishes", restaurant_id=current_user.restaurant_id)
         db.commit()
         db.refresh(db_dish)
 
-        redis_client.invalidate_dishes_cache()
+        menu_indexes.invalidate(current_user.restaurant_id)
         
         return db_dish
     except HTTPException:
@@ -547,6 +795,122 @@ def create_dish(dish: DishCreate, db: Session = Depends(get_db), current_user: m
         raise HTTPException(status_code=500, detail="Error creating dish")
 
 
+@app.post("/dishes/import")
+async def import_dishes(request: Request, format: Optional[str] = None, db: Session = Depends(get_db),
+                        current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only administrators can import dishes")
+
+    try:
+        fmt = bulk_io.detect_format(format, request.headers.get("content-type"))
+    except bulk_io.ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    imported = 0
+    failed = 0
+    errors = []
+    chunk = []
+
+    def report(row_number: int, error: Exception):
+        nonlocal failed
+        failed += 1
+        if len(errors) < bulk_io.MAX_REPORTED_ERRORS:
+            errors.append({"row": row_number, "error": bulk_io.format_error(error)})
+
+    def insert_chunk(rows):
+        db.execute(insert(models.Dish), rows)
+
+    # Все пачки пишутся в одной транзакции, коммит и инвалидация кеша - один раз в конце
+    try:
+        async for row_number, record in bulk_io.iter_records(request.stream(), fmt):
+            if isinstance(record, Exception):
+                report(row_number, record)
+                continue
+            try:
+                dish = DishCreate(
+                    name=record.get("name"),
+                    description=record.get("description") or "",
+                    price=record.get("price"),
+                    station=record.get("station") or kitchen.DEFAULT_STATION,
+                )
+                available = bulk_io.parse_bool(record.get("available"))
+            except (ValidationError, ValueError, TypeError) as e:
+                report(row_number, e)
+                continue
+
+            chunk.append({**dish.dict(), "available": available, "restaurant_id": current_user.restaurant_id})
+            if len(chunk) >= bulk_io.IMPORT_CHUNK_SIZE:
+                await run_in_threadpool(insert_chunk, chunk)
+                imported += len(chunk)
+                chunk = []
+
+        if chunk:
+            await run_in_threadpool(insert_chunk, chunk)
+            imported += len(chunk)
+        if imported:
+            await run_in_threadpool(outbox.enqueue, db, "invalidate_dishes", restaurant_id=current_user.restaurant_id)
+        await run_in_threadpool(db.commit)
+    except bulk_io.ImportFormatError as e:
+        await run_in_threadpool(db.rollback)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        await run_in_threadpool(db.rollback)
+        print(f"Error importing dishes: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error importing dishes")
+
+    if imported:
+        menu_indexes.invalidate(current_user.restaurant_id)
+
+    return {"imported": imported, "failed": failed, "errors": errors}
+
+
+@app.get("/dishes/export")
+def export_dishes(format: str = "csv", current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only administrators can export dishes")
+    if format not in bulk_io.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(bulk_io.FORMATS)}")
+
+    return StreamingResponse(
+        bulk_io.stream_dishes(format, current_user.restaurant_id),
+        media_type=bulk_io.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="dishes.{format}"'},
+    )
+
+
+@app.get("/dishes/stock")
+def get_dishes_stock(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """Остатки учитываемых блюд: живые счетчики Redis, без него - данные Postgres"""
+    restaurant_id = current_user.restaurant_id
+    left = redis_client.get_stock(restaurant_id)
+    if left is None:
+        left = stock.tracked_stock(db, restaurant_id)
+    return [{"dish_id": dish_id, "stock": max(count, 0)} for dish_id, count in sorted(left.items())]
+
+
+@app.put("/dishes/{dish_id}/stock")
+def update_dish_stock(dish_id: int, update: DishStockUpdate, db: Session = Depends(get_db),
+                      current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only administrators can update dish stock")
+
+    restaurant_id = current_user.restaurant_id
+    db_dish = db.query(models.Dish).filter(
+        models.Dish.id == dish_id,
+        models.Dish.restaurant_id == restaurant_id
+    ).first()
+    if not db_dish:
+        raise HTTPException(status_code=404, detail="Dish not found")
+
+    delta = stock.set_stock(db, db_dish, update.stock)
+    outbox.enqueue(db, "set_stock", restaurant_id=restaurant_id, dish_id=dish_id, stock=update.stock, delta=delta)
+    outbox.enqueue(db, "invalidate_dishes", restaurant_id=restaurant_id)
+    db.commit()
+    menu_indexes.invalidate(restaurant_id)
+
+    return {"dish_id": dish_id, "stock": update.stock, "available": db_dish.available}
+
+
 @app.put("/dishes/{dish_id}", response_model=DishResponse)
 def update_dish(dish_id: int, dish: DishCreate, db: Session = Depends(get_db),
                 current_user: models.User = Depends(get_current_user)):
@@ -554,17 +918,22 @@ def update_dish(dish_id: int, dish: DishCreate, db: Session = Depends(get_db),
         raise HTTPException(status_code=403, detail="Only administrators can update dishes")
 
     try:
-        db_dish = db.query(models.Dish).filter(models.Dish.id == dish_id).first()
+        db_dish = db.query(models.Dish).filter(
+            models.Dish.id == dish_id,
+            models.Dish.restaurant_id == current_user.restaurant_id
+        ).first()
         if not db_dish:
             raise HTTPException(status_code=404, detail="Dish not found")
 
-        for key, value in dish.dict().items():
+        # Станцию, не переданную клиентом, не сбрасываем на значение по умолчанию
+        for key, value in dish.dict(exclude_unset=True).items():
             setattr(db_dish, key, value)
 
+        outbox.enqueue(db, "invalidate_dishes", restaurant_id=current_user.restaurant_id)
         db.commit()
         db.refresh(db_dish)
 
-        redis_client.invalidate_dishes_cache()
+        menu_indexes.invalidate(current_user.restaurant_id)
         
         return db_dish
     except HTTPException:
@@ -581,14 +950,18 @@ def delete_dish(dish_id: int, db: Session = Depends(get_db), current_user: model
         raise HTTPException(status_code=403, detail="Only administrators can delete dishes")
 
     try:
-        db_dish = db.query(models.Dish).filter(models.Dish.id == dish_id).first()
+        db_dish = db.query(models.Dish).filter(
+            models.Dish.id == dish_id,
+            models.Dish.restaurant_id == current_user.restaurant_id
+        ).first()
         if not db_dish:
             raise HTTPException(status_code=404, detail="Dish not found")
 
         db.delete(db_dish)
+        outbox.enqueue(db, "invalidate_dishes", restaurant_id=current_user.restaurant_id)
         db.commit()
 
-        redis_client.invalidate_dishes_cache()
+        menu_indexes.invalidate(current_user.restaurant_id)
         
         return {"message": "Dish deleted"}
     except HTTPException:
@@ -599,55 +972,98 @@ def delete_dish(dish_id: int, db: Session = Depends(get_db), current_user: model
         raise HTTPException(status_code=500, detail="Error deleting dish")
 
 
+@app.get("/stats/popular-dishes", response_model=List[PopularDishResponse])
+def get_popular_dishes(window: str = "day", limit: int = 10, db: Session = Depends(get_read_db),
+                       current_user: models.User = Depends(get_current_user)):
+    if window not in POPULAR_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"window must be one of: {', '.join(POPULAR_WINDOWS)}")
+    if limit < 1 or limit > 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
+
+    ranking = redis_client.get_popular_dishes(current_user.restaurant_id, window=window, limit=limit)
+    dish_ids = [dish_id for dish_id, _ in ranking]
+    names = {}
+    if dish_ids:
+        names = dict(db.query(models.Dish.id, models.Dish.name).filter(
+            models.Dish.id.in_(dish_ids),
+            models.Dish.restaurant_id == current_user.restaurant_id
+        ).all())
+
+    return [
+        PopularDishResponse(dish_id=dish_id, dish_name=names.get(dish_id, "Unknown"), quantity=quantity)
+        for dish_id, quantity in ranking
+    ]
+
+
 @app.post("/orders", response_model=OrderResponse)
 def create_order(order: OrderCreate, db: Session = Depends(get_db),
                  current_user: models.User = Depends(get_current_user)):
     if current_user.role != "waiter":
         raise HTTPException(status_code=403, detail="Only waiters can create orders")
 
-    table = db.query(models.Table).filter(models.Table.number == order.table_number).first()
+    table = db.query(models.Table).filter(
+        models.Table.restaurant_id == current_user.restaurant_id,
+        models.Table.number == order.table_number
+    ).first()
     if not table:
         raise HTTPException(status_code=404, detail="Table not found")
     if not table.is_available:
         raise HTTPException(status_code=400, detail="Table is not available")
+    check_reservations(db, table, order.reservation_id)
+    dishes = check_dishes(db, current_user.restaurant_id, order.items)
 
     if not current_user.id:
         raise HTTPException(status_code=400, detail="Invalid user session")
 
+    # Код подбирается до списания остатков: если свободного кода нет, возвращать нечего
+    code = generate_unique_order_code(db, current_user.restaurant_id)
+    taken, counted = take_stock(db, current_user.restaurant_id, count_dish_quantities(order.items), dishes)
     try:
-        db_order = models.Order(
-            table_number=order.table_number,
-            waiter_id=current_user.id  # Гарантируем, что waiter_id установлен
-        )
-
-        db_order.code = generate_unique_order_code(db)
-
-        db.add(db_order)
-        db.commit()
-        db.refresh(db_order)
-    except ValueError as e:
+        for _ in range(ORDER_CODE_ATTEMPTS):
+            db_order = models.Order(
+                restaurant_id=current_user.restaurant_id,
+                table_number=order.table_number,
+                waiter_id=current_user.id,  # Гарантируем, что waiter_id установлен
+                code=code,
+            )
+            # Заказ записывается одной транзакцией со списанием остатков. Одновременный заказ
+            # мог занять код после проверки: уникальный индекс отклонит вставку, откатится
+            # только она, и заказ получит другой код
+            try:
+                with db.begin_nested():
+                    db.add(db_order)
+                    db.flush()
+                break
+            except IntegrityError:
+                code = generate_unique_order_code(db, current_user.restaurant_id)
+        else:
+            raise HTTPException(status_code=503, detail="Could not allocate an order code, try again")
+    except HTTPException:
         db.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
+        stock.give_back(current_user.restaurant_id, taken, counted)
+        raise
+    db.refresh(db_order)
 
+    db_items = []
     for item in order.items:
-        db_item = models.OrderItem(order_id=db_order.id, **item.dict())
+        db_item = models.OrderItem(order_id=db_order.id, **item.dict(), **models.dish_snapshot(dishes[item.dish_id]))
         db.add(db_item)
+        db_items.append(db_item)
+    db_order.total_amount = sum(db_item.unit_price * db_item.quantity for db_item in db_items)
 
-    table.is_available = False
-    table.current_order_id = db_order.id
-
-    db.commit()
-    db.refresh(db_order)
-
-    redis_client.invalidate_tables_cache()
+    claim_table(db, table, db_order.id)
+    db.flush()
 
-    order_response = get_order_response(db, db_order.id)
+    outbox.enqueue(db, "invalidate_orders", restaurant_id=db_order.restaurant_id, order_ids=[db_order.id],
+                   waiter_ids=[current_user.id])
+    outbox.enqueue(db, "invalidate_tables", restaurant_id=db_order.restaurant_id)
+    outbox.enqueue(db, "record_dish_orders", restaurant_id=db_order.restaurant_id, hour=popular_hour(),
+                   quantities=count_dish_quantities(order.items))
+    outbox.enqueue(db, "kitchen_events", restaurant_id=db_order.restaurant_id,
+                   events=kitchen.build_events(db, db_order, [("queued", db_item) for db_item in db_items]))
+    commit_with_stock(db, db_order.restaurant_id, taken, counted)
 
-    if order_response:
-        order_dict = order_response.dict()
-        redis_client.cache_order(db_order.id, order_dict)
-    
-    return order_response
+    return get_order_response(db, db_order.restaurant_id, db_order.id)
 
 
 @app.post("/cleanup/fast-cleanup")
@@ -658,23 +1074,7 @@ def fast_cleanup(db: Session = Depends(get_db), current_user: models.User = Depe
 
     try:
 
-        null_orders = db.query(models.Order).filter(models.Order.waiter_id == None).all()
-        deleted_count = 0
-
-        for order in null_orders:
-
-            table = db.query(models.Table).filter(models.Table.current_order_id == order.id).first()
-            if table:
-                table.is_available = True
-                table.current_order_id = None
-
-
-            db.query(models.OrderItem).filter(models.OrderItem.order_id == order.id).delete()
-
-
-            db.delete(order)
-            deleted_count += 1
-
+        deleted_count = len(bulk_orders.delete_orphans(db, current_user.restaurant_id))
         db.commit()
 
         return {
@@ -686,189 +1086,582 @@ def fast_cleanup(db: Session = Depends(get_db), current_user: models.User = Depe
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Cleanup error: {str(e)}")
 
+# Заказы читаются через кеш Redis, промахи заполняют его из основной БД:
+# отстающая реплика записала бы в кеш устаревший заказ. Кеш сбрасывает outbox-воркер
+# после коммита, поэтому клиент, который только что писал (primary_pinned), читает
+# мимо кеша и не заполняет его
 @app.get("/orders", response_model=List[OrderResponse])
-def get_orders(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    if current_user.role == "admin":
-        orders = db.query(models.Order).all()
-    else:
-        orders = db.query(models.Order).filter(models.Order.waiter_id == current_user.id).all()
+def get_orders(request: Request, db: Session = Depends(get_db),
+               current_user: models.User = Depends(get_current_user)):
+    restaurant_id = current_user.restaurant_id
+    waiter_key = waiter_orders_cache_key(current_user.id)
+    use_cache = not primary_pinned(request)
+    if use_cache and current_user.role != "admin":
+        # Официант опрашивает свой список постоянно: пока заказы не менялись, Postgres не читается
+        cached = redis_client.get_cached_orders(restaurant_id, [waiter_key])[0]
+        if cached is not None:
+            return cached
+
+    query = db.query(models.Order.id).filter(models.Order.restaurant_id == restaurant_id)
+    if current_user.role != "admin":
+        query = query.filter(models.Order.waiter_id == current_user.id)
+    orders = load_orders(db, restaurant_id, [order_id for order_id, in query.order_by(models.Order.id)], use_cache)
+
+    if use_cache and current_user.role != "admin":
+        redis_client.cache_orders(restaurant_id, {waiter_key: orders})
+    return orders
+
+@app.get("/orders/export")
+def export_orders(format: str = "csv", date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                  include_archived: bool = False, current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only administrators can export orders")
+    if format not in bulk_io.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(bulk_io.FORMATS)}")
+
+    return StreamingResponse(
+        bulk_io.stream_orders(format, current_user.restaurant_id, date_from, date_to, include_archived),
+        media_type=bulk_io.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="orders.{format}"'},
+    )
+
+
+@app.get("/orders/history", response_model=List[OrderResponse])
+def get_order_history(date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                      limit: int = 50, offset: int = 0, db: Session = Depends(get_read_db),
+                      current_user: models.User = Depends(get_current_user)):
+    """Архив выполненных заказов, вынесенных архиватором из горячих таблиц"""
+    if limit < 1 or limit > 500:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 500")
+
+    query = db.query(models.ArchivedOrder).filter(models.ArchivedOrder.restaurant_id == current_user.restaurant_id)
+    if current_user.role != "admin":
+        query = query.filter(models.ArchivedOrder.waiter_id == current_user.id)
+    if date_from:
+        query = query.filter(models.ArchivedOrder.created_at >= date_from)
+    if date_to:
+        query = query.filter(models.ArchivedOrder.created_at < date_to)
+
+    orders = (
+        query.order_by(models.ArchivedOrder.created_at.desc(), models.ArchivedOrder.id.desc())
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
+
+    items_by_order = {}
+    if orders:
+        items = db.query(models.ArchivedOrderItem).filter(
+            models.ArchivedOrderItem.order_id.in_([order.id for order in orders])
+        ).all()
+        for item in items:
+            items_by_order.setdefault(item.order_id, []).append(OrderItemResponse(
+                id=item.id,
+                dish_id=item.dish_id,
+                dish_name=item.dish_name or "Unknown",
+                dish_price=models.from_minor_units(item.unit_price),
+                quantity=item.quantity
+            ))
+
+    return [
+        OrderResponse(
+            id=order.id,
+            code=order.code,
+            table_number=order.table_number,
+            status=order.status,
+            created_at=order.created_at,
+            waiter_id=order.waiter_id or 0,
+            waiter_name=order.waiter_name or "Unknown",
+            items=items_by_order.get(order.id, []),
+            total_amount=models.from_minor_units(order.total_amount),
+        )
+        for order in orders
+    ]
 
-    return [get_order_response(db, order.id) for order in orders]
 
 @app.get("/orders/{order_id}", response_model=OrderResponse)
-def get_order(order_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    db_order = db.query(models.Order).filter(models.Order.id == order_id).first()
-    if not db_order:
+def get_order(order_id: int, request: Request, db: Session = Depends(get_db),
+              current_user: models.User = Depends(get_current_user)):
+    orders = load_orders(db, current_user.restaurant_id, [order_id], use_cache=not primary_pinned(request))
+    if not orders:
         raise HTTPException(status_code=404, detail="Order not found")
 
 
-    if current_user.role == "waiter" and db_order.waiter_id != current_user.id:
+    if current_user.role != "admin" and orders[0]["waiter_id"] != current_user.id:
         raise HTTPException(status_code=403, detail="You can only view your own orders")
 
-    return get_order_response(db, order_id)
+    return orders[0]
 
 @app.delete("/orders/{order_id}")
 def delete_order(order_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Only administrators can delete orders")
 
-    db_order = db.query(models.Order).filter(models.Order.id == order_id).first()
+    db_order = db.query(models.Order).filter(
+        models.Order.id == order_id,
+        models.Order.restaurant_id == current_user.restaurant_id
+    ).first()
     if not db_order:
         raise HTTPException(status_code=404, detail="Order not found")
 
 
     table = db.query(models.Table).filter(models.Table.current_order_id == order_id).first()
-    if table:
-        table.is_available = True
-        table.current_order_id = None
-
+    release_table(db, table)
+
+    restaurant_id = db_order.restaurant_id
+    outbox.enqueue(db, "invalidate_orders", restaurant_id=restaurant_id, order_ids=[order_id],
+                   waiter_ids=[db_order.waiter_id])
+    outbox.enqueue(db, "invalidate_tables", restaurant_id=restaurant_id)
+    outbox.enqueue(db, "kitchen_events", restaurant_id=restaurant_id,
+                   events=kitchen.order_events(db, db_order, "removed"))
+    # Удаленный заказ (в том числе заказ синтетической проверки) не должен влиять на популярность
+    outbox.enqueue(db, "record_dish_orders", restaurant_id=restaurant_id, hour=popular_hour(db_order.created_at),
+                   quantities={dish_id: -quantity for dish_id, quantity in count_dish_quantities(db_order.items).items()})
+    if db_order.status != "completed":
+        bulk_orders.return_stock(db, restaurant_id, count_dish_quantities(db_order.items))
 
     db.delete(db_order)
     db.commit()
-    
-
-    redis_client.invalidate_order_cache(order_id)
-    redis_client.invalidate_tables_cache()
 
     return {"message": "Order deleted successfully"}
 
 @app.put("/orders/{order_id}", response_model=OrderResponse)
 def update_order(order_id: int, order_update: OrderUpdate, db: Session = Depends(get_db),
                  current_user: models.User = Depends(get_current_user)):
-    db_order = db.query(models.Order).filter(models.Order.id == order_id).first()
+    db_order = db.query(models.Order).filter(
+        models.Order.id == order_id,
+        models.Order.restaurant_id == current_user.restaurant_id
+    ).first()
     if not db_order:
         raise HTTPException(status_code=404, detail="Order not found")
 
 
-    if current_user.role == "waiter" and db_order.waiter_id != current_user.id:
+    if current_user.role != "admin" and db_order.waiter_id != current_user.id:
         raise HTTPException(status_code=403, detail="You can only update your own orders")
 
 
-    if order_update.table_number and order_update.table_number != db_order.table_number:
+    table_changed = bool(order_update.table_number and order_update.table_number != db_order.table_number)
+    if table_changed:
 
-        old_table = db.query(models.Table).filter(models.Table.number == db_order.table_number).first()
-        if old_table:
-            old_table.is_available = True
-            old_table.current_order_id = None
+        old_table = db.query(models.Table).filter(
+            models.Table.restaurant_id == db_order.restaurant_id,
+            models.Table.number == db_order.table_number
+        ).first()
+        release_table(db, old_table)
 
 
-        new_table = db.query(models.Table).filter(models.Table.number == order_update.table_number).first()
+        new_table = db.query(models.Table).filter(
+            models.Table.restaurant_id == db_order.restaurant_id,
+            models.Table.number == order_update.table_number
+        ).first()
         if not new_table:
             raise HTTPException(status_code=404, detail="Table not found")
         if not new_table.is_available and new_table.current_order_id != order_id:
             raise HTTPException(status_code=400, detail="Table is not available")
+        check_reservations(db, new_table)
 
-        new_table.is_available = False
-        new_table.current_order_id = order_id
+        claim_table(db, new_table, order_id)
         db_order.table_number = order_update.table_number
 
 
+    popularity_delta = {}
+    kitchen_events = []
+    if order_update.items is not None:
+        dishes = check_dishes(db, db_order.restaurant_id, order_update.items)
+        old_items = db.query(models.OrderItem).filter(models.OrderItem.order_id == order_id).all()
+        popularity_delta = count_dish_quantities(order_update.items)
+        for item in old_items:
+            popularity_delta[item.dish_id] = popularity_delta.get(item.dish_id, 0) - item.quantity
+
+        changes = kitchen.reconcile_items(db, order_id, order_update.items, dishes)
+        kitchen_events = kitchen.build_events(db, db_order, changes)
+        refresh_order_total(db, db_order)
+
+
     if order_update.status:
         db_order.status = order_update.status
 
         if order_update.status == "completed":
-            table = db.query(models.Table).filter(models.Table.number == db_order.table_number).first()
-            if table:
-                table.is_available = True
-                table.current_order_id = None
+            table = db.query(models.Table).filter(
+                models.Table.restaurant_id == db_order.restaurant_id,
+                models.Table.number == db_order.table_number
+            ).first()
+            release_table(db, table)
+            # Снятые правкой позиции тоже уходят с экранов, новые туда уже не попадают
+            kitchen_events = [event for event in kitchen_events if event[0] == "removed"]
+            kitchen_events += kitchen.order_events(db, db_order, "removed")
+
+    if table_changed and db_order.status != "completed":
+        # Номер стола есть в каждой позиции на экранах кухни
+        kitchen_events += kitchen.order_events(db, db_order, "updated")
+
+    restaurant_id = db_order.restaurant_id
+    # Добавленные порции списываются, снятые правкой - возвращаются
+    taken, counted = take_stock(db, restaurant_id, popularity_delta, dishes) if popularity_delta else ({}, True)
+    outbox.enqueue(db, "invalidate_orders", restaurant_id=restaurant_id, order_ids=[order_id],
+                   waiter_ids=[db_order.waiter_id])
+    outbox.enqueue(db, "invalidate_tables", restaurant_id=restaurant_id)
+    if popularity_delta:
+        outbox.enqueue(db, "record_dish_orders", restaurant_id=restaurant_id, hour=popular_hour(db_order.created_at),
+                       quantities=popularity_delta)
+    if kitchen_events:
+        outbox.enqueue(db, "kitchen_events", restaurant_id=restaurant_id, events=kitchen_events)
+    commit_with_stock(db, restaurant_id, taken, counted)
+
+    return get_order_response(db, restaurant_id, order_id)
 
 
-    if order_update.items is not None:
+@app.put("/orders/{order_id}/status")
+def update_order_status(order_id: int, status: str, db: Session = Depends(get_db),
+                        current_user: models.User = Depends(get_current_user)):
+    db_order = db.query(models.Order).filter(
+        models.Order.id == order_id,
+        models.Order.restaurant_id == current_user.restaurant_id
+    ).first()
+    if not db_order:
+        raise HTTPException(status_code=404, detail="Order not found")
 
-        db.query(models.OrderItem).filter(models.OrderItem.order_id == order_id).delete()
 
-        for item in order_update.items:
-            db_item = models.OrderItem(order_id=order_id, **item.dict())
-            db.add(db_item)
+    if current_user.role != "admin" and db_order.waiter_id != current_user.id:
+        raise HTTPException(status_code=403, detail="You can only update your own orders")
+
+    db_order.status = status
 
+    kitchen_events = []
+    if status == "completed":
+        table = db.query(models.Table).filter(
+            models.Table.restaurant_id == db_order.restaurant_id,
+            models.Table.number == db_order.table_number
+        ).first()
+        release_table(db, table)
+        kitchen_events = kitchen.order_events(db, db_order, "removed")
+
+    restaurant_id = db_order.restaurant_id
+    outbox.enqueue(db, "invalidate_orders", restaurant_id=restaurant_id, order_ids=[order_id],
+                   waiter_ids=[db_order.waiter_id])
+    outbox.enqueue(db, "invalidate_tables", restaurant_id=restaurant_id)
+    if kitchen_events:
+        outbox.enqueue(db, "kitchen_events", restaurant_id=restaurant_id, events=kitchen_events)
     db.commit()
     
+    return {"message": "Order status updated"}
 
-    redis_client.invalidate_order_cache(order_id)
-    redis_client.invalidate_tables_cache()
-    
-    order_response = get_order_response(db, order_id)
-    
 
-    if order_response:
-        order_dict = order_response.dict()
-        redis_client.cache_order(order_id, order_dict)
-    
-    return order_response
+@app.post("/orders/bulk-status")
+def bulk_update_order_status(bulk: OrderBulkStatus, db: Session = Depends(get_db),
+                             current_user: models.User = Depends(get_current_user)):
+    """Закрытие смены: статус многих заказов меняется одной транзакцией"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only administrators can update orders in bulk")
 
+    updated = bulk_orders.set_status(db, current_user.restaurant_id, bulk.order_ids, bulk.status)
+    db.commit()
 
-@app.put("/orders/{order_id}/status")
-def update_order_status(order_id: int, status: str, db: Session = Depends(get_db),
-                        current_user: models.User = Depends(get_current_user)):
-    db_order = db.query(models.Order).filter(models.Order.id == order_id).first()
-    if not db_order:
-        raise HTTPException(status_code=404, detail="Order not found")
+    return {
+        "message": f"Status of {len(updated)} orders updated",
+        "updated": updated,
+        "not_found": sorted(set(bulk.order_ids) - set(updated)),
+    }
 
 
-    if current_user.role == "waiter" and db_order.waiter_id != current_user.id:
-        raise HTTPException(status_code=403, detail="You can only update your own orders")
+@app.post("/orders/bulk-delete")
+def bulk_delete_orders(bulk: OrderBulkDelete, db: Session = Depends(get_db),
+                       current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only administrators can delete orders")
 
-    db_order.status = status
+    deleted = bulk_orders.delete_orders(db, current_user.restaurant_id, bulk.order_ids)
+    db.commit()
 
+    return {
+        "message": f"{len(deleted)} orders deleted",
+        "deleted": deleted,
+        "not_found": sorted(set(bulk.order_ids) - set(deleted)),
+    }
 
-    if status == "completed":
-        table = db.query(models.Table).filter(models.Table.number == db_order.table_number).first()
-        if table:
-            table.is_available = True
-            table.current_order_id = None
 
+def rebuild_kitchen_queue(restaurant_id: int) -> int:
+    db = SessionLocal()
+    try:
+        items = kitchen.active_items(db, restaurant_id)
+    finally:
+        db.close()
+    redis_client.replace_kitchen_queue(restaurant_id, items)
+    return len(items)
+
+
+# Кухонные экраны работают только с Redis: токен проверяется без запроса пользователя из БД
+@app.get("/kitchen/queue", response_model=KitchenQueueResponse)
+def get_kitchen_queue(station: Optional[str] = None, payload: dict = Depends(get_token_payload)):
+    queue = redis_client.get_kitchen_queue(token_restaurant_id(payload))
+    if queue is None:
+        raise HTTPException(status_code=503, detail="Kitchen queue is unavailable")
+
+    items, last_event_id = queue
+    return {"last_event_id": last_event_id, "stations": kitchen.group_by_station(items, station)}
+
+
+# Long-poll экрана держит поток пула синхронных эндпоинтов до block_ms: таких ожиданий не больше
+# KITCHEN_LONG_POLL_LIMIT, чтобы экраны не заняли весь пул
+KITCHEN_LONG_POLL_LIMIT = int(os.getenv("KITCHEN_LONG_POLL_LIMIT", "16"))
+kitchen_long_polls = threading.BoundedSemaphore(KITCHEN_LONG_POLL_LIMIT)
+
+
+@app.get("/kitchen/events", response_model=KitchenEventsResponse)
+def get_kitchen_events(screen: str, after: Optional[str] = None, count: int = 100, block_ms: int = 0,
+                       payload: dict = Depends(get_token_payload)):
+    """События очереди после last_event_id снимка; экран держит long-poll с block_ms"""
+    if count < 1 or count > 1000:
+        raise HTTPException(status_code=400, detail="count must be between 1 and 1000")
+    # Ожидание должно укладываться в socket_timeout клиента Redis (5 секунд)
+    if block_ms < 0 or block_ms > 4000:
+        raise HTTPException(status_code=400, detail="block_ms must be between 0 and 4000")
+    # Каждый экран - consumer group в Redis: произвольные имена плодили бы группы
+    if screen not in KITCHEN_STATIONS:
+        raise HTTPException(status_code=400, detail=f"screen must be one of: {', '.join(KITCHEN_STATIONS)}")
+
+    if block_ms and not kitchen_long_polls.acquire(blocking=False):
+        raise HTTPException(status_code=503, detail="Too many kitchen screens are waiting for events",
+                            headers={"Retry-After": "1"})
+    try:
+        events = redis_client.read_kitchen_events(token_restaurant_id(payload), screen, after, count, block_ms)
+    finally:
+        if block_ms:
+            kitchen_long_polls.release()
+    if events is None:
+        raise HTTPException(status_code=503, detail="Kitchen queue is unavailable")
+
+    return {
+        "last_event_id": events[-1][0] if events else (after or ""),
+        "events": [{"id": event_id, **event} for event_id, event in events],
+    }
+
+
+@app.put("/kitchen/items/{item_id}/status")
+def update_item_prep_status(item_id: int, status: str, db: Session = Depends(get_db),
+                            current_user: models.User = Depends(get_current_user)):
+    if current_user.role not in kitchen.PREP_STATUS_ROLES:
+        raise HTTPException(status_code=403, detail="Only kitchen staff and administrators can change cooking status")
+    if status not in kitchen.PREP_STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of: {', '.join(kitchen.PREP_STATUSES)}")
+
+    db_item = (
+        db.query(models.OrderItem)
+        .join(models.Order, models.Order.id == models.OrderItem.order_id)
+        .filter(models.OrderItem.id == item_id, models.Order.restaurant_id == current_user.restaurant_id)
+        .first()
+    )
+    if not db_item:
+        raise HTTPException(status_code=404, detail="Order item not found")
+
+    db_item.prep_status = status
+    db_order = db_item.order
+    outbox.enqueue(db, "invalidate_orders", restaurant_id=db_order.restaurant_id, order_ids=[db_order.id],
+                   waiter_ids=[db_order.waiter_id])
+    outbox.enqueue(db, "kitchen_events", restaurant_id=db_order.restaurant_id,
+                   events=kitchen.build_events(db, db_order, [("served" if status == "served" else "status", db_item)]))
     db.commit()
-    
 
-    redis_client.invalidate_order_cache(order_id)
-    redis_client.invalidate_tables_cache()
-    
-    return {"message": "Order status updated"}
+    return {"message": "Item status updated"}
 
 
-def get_order_response(db: Session, order_id: int):
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
-    if not order:
-        return None
+@app.post("/kitchen/rebuild")
+def rebuild_kitchen(current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only administrators can rebuild the kitchen queue")
+
+    if not redis_client.is_available():
+        raise HTTPException(status_code=503, detail="Kitchen queue is unavailable")
 
+    return {"message": "Kitchen queue rebuilt", "items": rebuild_kitchen_queue(current_user.restaurant_id)}
 
-    waiter = db.query(models.User).filter(models.User.id == order.waiter_id).first()
-    waiter_name = waiter.username if waiter else "Unknown"
 
+def build_order_responses(db: Session, restaurant_id: int, order_ids: List[int]) -> Dict[int, OrderResponse]:
+    """Ответы по заказам ресторана: три запроса на любой список, а не три на каждый заказ"""
+    if not order_ids:
+        return {}
+    orders = db.query(models.Order).filter(
+        models.Order.restaurant_id == restaurant_id,
+        models.Order.id.in_(order_ids)
+    ).all()
+    if not orders:
+        return {}
 
-    items = db.query(models.OrderItem).filter(models.OrderItem.order_id == order_id).all()
-    order_items = []
+    waiter_ids = {order.waiter_id for order in orders if order.waiter_id}
+    waiter_names = dict(
+        db.query(models.User.id, models.User.username).filter(models.User.id.in_(waiter_ids))
+    ) if waiter_ids else {}
+
+
+    # Название и цена берутся из снимка в позиции, таблица dishes не читается
+    items = (
+        db.query(models.OrderItem)
+        .filter(models.OrderItem.order_id.in_([order.id for order in orders]))
+        .order_by(models.OrderItem.id)
+    )
+    items_by_order: Dict[int, List[OrderItemResponse]] = {}
     for item in items:
-        dish = db.query(models.Dish).filter(models.Dish.id == item.dish_id).first()
-        order_items.append(OrderItemResponse(
+        items_by_order.setdefault(item.order_id, []).append(OrderItemResponse(
             id=item.id,
             dish_id=item.dish_id,
-            dish_name=dish.name if dish else "Unknown",
-            dish_price=dish.price if dish else 0,
-            quantity=item.quantity
+            dish_name=item.dish_name or "Unknown",
+            dish_price=models.from_minor_units(item.unit_price),
+            quantity=item.quantity,
+            prep_status=item.prep_status
         ))
 
-    return OrderResponse(
-        id=order.id,
-        code=order.code,
-        table_number=order.table_number,
-        status=order.status,
-        created_at=order.created_at,
-        waiter_id=order.waiter_id,
-        waiter_name=waiter_name,
-        items=order_items,
-    )
+    return {
+        order.id: OrderResponse(
+            id=order.id,
+            code=order.code,
+            table_number=order.table_number,
+            status=order.status,
+            created_at=order.created_at,
+            waiter_id=order.waiter_id,
+            waiter_name=waiter_names.get(order.waiter_id, "Unknown"),
+            items=items_by_order.get(order.id, []),
+            total_amount=models.from_minor_units(order.total_amount),
+        )
+        for order in orders
+    }
+
+
+def get_order_response(db: Session, restaurant_id: int, order_id: int) -> Optional[OrderResponse]:
+    return build_order_responses(db, restaurant_id, [order_id]).get(order_id)
+
+
+def load_orders(db: Session, restaurant_id: int, order_ids: List[int], use_cache: bool = True) -> List[dict]:
+    """Заказы в порядке order_ids из кеша order:{id}; промахи собираются из БД одной пачкой
+    и кешируются. Без use_cache все заказы читаются из БД, а кеш не трогается.
+    Удаленные заказы пропускаются"""
+    if use_cache:
+        cached = redis_client.get_cached_orders(restaurant_id, [order_cache_key(order_id) for order_id in order_ids])
+    else:
+        cached = [None] * len(order_ids)
+    orders = dict(zip(order_ids, cached))
+
+    missing = [order_id for order_id, order in orders.items() if order is None]
+    built = {
+        order_id: jsonable_encoder(response)
+        for order_id, response in build_order_responses(db, restaurant_id, missing).items()
+    }
+    if use_cache:
+        redis_client.cache_orders(restaurant_id, {order_cache_key(order_id): order for order_id, order in built.items()})
+    orders.update(built)
+
+    return [orders[order_id] for order_id in order_ids if orders[order_id] is not None]
 
 
-def generate_unique_order_code(db: Session) -> str:
-    cyrillic_letters = "АБВГДЕЖЗИЙКЛМНОПРСТУФХЦЧШЩЭЮЯ"
-    while True:
-        letter = random.choice(cyrillic_letters)
-        digits = "".join(random.choices(string.digits, k=3))
-        code = f"{letter}{digits}"
-        exists = db.query(models.Order).filter(models.Order.code == code).first()
-        if not exists:
-            return code
+def claim_table(db: Session, table: models.Table, order_id: int) -> None:
+    table.is_available = False
+    table.current_order_id = order_id
+    outbox.enqueue(db, "table_availability", restaurant_id=table.restaurant_id, tables={table.number: False})
+
+
+def release_table(db: Session, table: Optional[models.Table]) -> None:
+    if table is None:
+        return
+    table.is_available = True
+    table.current_order_id = None
+    outbox.enqueue(db, "table_availability", restaurant_id=table.restaurant_id, tables={table.number: True})
+
+
+def check_reservations(db: Session, table: models.Table, reservation_id: Optional[int] = None) -> None:
+    """Стол нельзя занять, если он забронирован сейчас или на ближайшее время (reservations.SEATING_MINUTES)"""
+    if reservation_id is not None:
+        seated = db.query(models.Reservation.id).filter(
+            models.Reservation.id == reservation_id,
+            models.Reservation.restaurant_id == table.restaurant_id,
+            models.Reservation.table_number == table.number
+        ).first()
+        if not seated:
+            raise HTTPException(status_code=400, detail="Reservation is not for this table")
+
+    reservation = reservations.blocking_order(db, table.restaurant_id, table.number, reservation_id)
+    if reservation:
+        raise HTTPException(status_code=400,
+                            detail=f"Table is reserved from {reservation.starts_at.isoformat()}")
+
+
+def take_stock(db: Session, restaurant_id: int, quantities: Dict[int, int],
+               dishes: Dict[int, models.Dish]) -> Tuple[Dict[int, int], bool]:
+    """Списывает остатки блюд заказа (stock.take); перенос списания в Postgres уходит в outbox"""
+    try:
+        taken, counted = stock.take(db, restaurant_id, quantities)
+    except stock.OutOfStock as e:
+        dish = dishes.get(e.dish_id)
+        name = dish.name if dish else f"#{e.dish_id}"
+        raise HTTPException(status_code=400, detail=f"Not enough '{name}' in stock: {max(e.left, 0)} left")
+    if taken:
+        outbox.enqueue(db, "reconcile_stock", restaurant_id=restaurant_id, quantities=taken)
+        if not counted:
+            outbox.enqueue(db, "take_stock", restaurant_id=restaurant_id, quantities=taken)
+    return taken, counted
+
+
+def commit_with_stock(db: Session, restaurant_id: int, taken: Dict[int, int], counted: bool) -> None:
+    # Незаписанный заказ возвращает списанные порции
+    try:
+        db.commit()
+    except Exception:
+        db.rollback()
+        stock.give_back(restaurant_id, taken, counted)
+        raise
+
+
+def check_dishes(db: Session, restaurant_id: int, items) -> Dict[int, models.Dish]:
+    """Блюда заказа должны быть из меню того же ресторана; возвращает их по id для снимков цен"""
+    dish_ids = {item.dish_id for item in items}
+    if not dish_ids:
+        return {}
+    dishes = {dish.id: dish for dish in db.query(models.Dish).filter(
+        models.Dish.id.in_(dish_ids),
+        models.Dish.restaurant_id == restaurant_id
+    )}
+    if len(dishes) != len(dish_ids):
+        raise HTTPException(status_code=404, detail="Dish not found")
+    return dishes
+
+
+def refresh_order_total(db: Session, order: models.Order) -> None:
+    db.flush()
+    order.total_amount = db.query(
+        func.coalesce(func.sum(models.OrderItem.unit_price * models.OrderItem.quantity), 0)
+    ).filter(models.OrderItem.order_id == order.id).scalar()
+
+
+def count_dish_quantities(items) -> dict:
+    quantities = {}
+    for item in items:
+        quantities[item.dish_id] = quantities.get(item.dish_id, 0) + item.quantity
+    return quantities
+
+
+ORDER_CODE_LETTERS = "АБВГДЕЖЗИЙКЛМНОПРСТУФХЦЧШЩЭЮЯ"
+# Каждая попытка проверяет пачку кандидатов одним запросом; если заняты все,
+# следующая попытка удлиняет код на цифру. Коды архивных заказов тоже заняты:
+# иначе в истории и экспорте два заказа получили бы один код
+ORDER_CODE_ATTEMPTS = 3
+ORDER_CODE_CANDIDATES = 20
+
+
+def generate_unique_order_code(db: Session, restaurant_id: int) -> str:
+    for attempt in range(ORDER_CODE_ATTEMPTS):
+        candidates = {
+            random.choice(ORDER_CODE_LETTERS) + "".join(random.choices(string.digits, k=3 + attempt))
+            for _ in range(ORDER_CODE_CANDIDATES)
+        }
+        taken = {code for code, in db.query(models.Order.code).filter(
+            models.Order.restaurant_id == restaurant_id,
+            models.Order.code.in_(candidates)
+        ).union(db.query(models.ArchivedOrder.code).filter(
+            models.ArchivedOrder.restaurant_id == restaurant_id,
+            models.ArchivedOrder.code.in_(candidates)
+        ))}
+        free = candidates - taken
+        if free:
+            return random.choice(sorted(free))
+    raise HTTPException(status_code=503, detail="Could not allocate an order code, try again")
 
 
 if __name__ == "__main__":
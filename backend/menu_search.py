@@ -0,0 +1,184 @@
+"""
+In-memory триграммный индекс меню для нечеткого поиска блюд по названию и описанию.
+Индекс строится из списка блюд и перестраивается, когда меняется версия меню
+в Redis (она увеличивается при каждой инвалидации кеша блюд)
+"""
+import heapq
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional, Set
+
+
+# Без Redis версия меню неизвестна: перестраиваем индекс не реже, чем раз в MAX_AGE секунд
+MAX_AGE_SECONDS = 60
+# Доля триграмм запроса, которая должна найтись в названии или описании
+MIN_SIMILARITY = 0.5
+DESCRIPTION_WEIGHT = 0.6
+# Запросы короче этого ищутся только по началу слов в названии
+MIN_DESCRIPTION_QUERY = 3
+
+_NON_WORD = re.compile(r"[^\w]+")
+
+
+def normalize(text: Optional[str]) -> str:
+    text = (text or "").lower().replace("ё", "е")
+    return _NON_WORD.sub(" ", text).strip()
+
+
+def trigrams(text: str, prefix: bool = False) -> Set[str]:
+    """Триграммы слов в стиле pg_trgm: слово дополняется двумя пробелами слева и одним справа.
+
+    Для запроса (prefix=True) правый пробел у последнего слова не ставится,
+    чтобы недописанное слово совпадало с началом названия, а у слов от трех букв
+    отбрасывается триграмма "  x": по одной первой букве совпадает половина меню.
+    """
+    words = text.split()
+    grams: Set[str] = set()
+    for position, word in enumerate(words):
+        left = " " if prefix and len(word) >= 3 else "  "
+        right = "" if prefix and position == len(words) - 1 else " "
+        padded = f"{left}{word}{right}"
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _build_postings(texts: List[str]) -> Dict[str, List[int]]:
+    postings: Dict[str, List[int]] = defaultdict(list)
+    # Слова в меню повторяются, поэтому триграммы считаем один раз на слово
+    word_grams: Dict[str, Set[str]] = {}
+    for doc, text in enumerate(texts):
+        grams: Set[str] = set()
+        for word in text.split():
+            cached = word_grams.get(word)
+            if cached is None:
+                cached = word_grams[word] = trigrams(word)
+            grams |= cached
+        for gram in grams:
+            postings[gram].append(doc)
+    return dict(postings)
+
+
+def _count_hits(postings: Dict[str, List[int]], grams: Set[str]) -> Counter:
+    hits: Counter = Counter()
+    for gram in grams:
+        docs = postings.get(gram)
+        if docs:
+            hits.update(docs)
+    return hits
+
+
+class _Snapshot:
+    def __init__(self, dishes: List[Dict]):
+        self.dishes = dishes
+        self.names = [normalize(dish.get("name")) for dish in dishes]
+        self.descriptions = [normalize(dish.get("description")) for dish in dishes]
+        self.name_postings = _build_postings(self.names)
+        self.description_postings = _build_postings(self.descriptions)
+
+
+class MenuSearchIndex:
+
+    def __init__(self):
+        self._snapshot: Optional[_Snapshot] = None
+        self._version: Optional[int] = None
+        self._built_at = 0.0
+        self._stale = False
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    def needs_rebuild(self, version: Optional[int]) -> bool:
+        if self._snapshot is None or self._stale:
+            return True
+        if version is None:
+            return time.monotonic() - self._built_at > MAX_AGE_SECONDS
+        return version != self._version
+
+    def build(self, dishes: List[Dict], version: Optional[int] = None) -> None:
+        snapshot = _Snapshot(dishes)
+        with self._lock:
+            # Поиск читает ссылку на снимок один раз, поэтому замена атомарна для читателей
+            self._snapshot = snapshot
+            self._version = version
+            self._built_at = time.monotonic()
+            self._stale = False
+
+    def ensure_fresh(self, version: Optional[int], load_dishes: Callable[[], List[Dict]]) -> None:
+        """Первый раз строит индекс синхронно, дальше перестраивает в фоне, отдавая старый снимок."""
+        if not self.needs_rebuild(version):
+            return
+        if self._snapshot is None:
+            self.build(load_dishes(), version)
+            return
+
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild, args=(version, load_dishes), daemon=True).start()
+
+    def _rebuild(self, version: Optional[int], load_dishes: Callable[[], List[Dict]]) -> None:
+        try:
+            self.build(load_dishes(), version)
+        except Exception as e:
+            print(f"Ошибка перестроения индекса поиска по меню: {e}")
+        finally:
+            self._rebuilding = False
+
+    def invalidate(self) -> None:
+        self._stale = True
+
+    def search(self, query: str, limit: int = 20) -> List[Dict]:
+        snapshot = self._snapshot
+        text = normalize(query)
+        if snapshot is None or not text:
+            return []
+
+        grams = trigrams(text, prefix=True)
+        total = len(grams)
+        required = total * MIN_SIMILARITY
+
+        name_hits = _count_hits(snapshot.name_postings, grams)
+        description_hits: Counter = Counter()
+        if len(text) >= MIN_DESCRIPTION_QUERY:
+            description_hits = _count_hits(snapshot.description_postings, grams)
+
+        candidates = {doc for doc, hits in name_hits.items() if hits >= required}
+        candidates.update(doc for doc, hits in description_hits.items() if hits >= required)
+
+        scored = []
+        for doc in candidates:
+            name = snapshot.names[doc]
+            score = max(name_hits[doc] / total, description_hits[doc] / total * DESCRIPTION_WEIGHT)
+            if name.startswith(text):
+                score += 1.0
+            elif f" {text}" in f" {name}":
+                score += 0.7
+            elif text in name:
+                score += 0.5
+            elif text in snapshot.descriptions[doc]:
+                score += 0.3
+            scored.append((score, -doc))
+
+        return [snapshot.dishes[-negated_doc] for _, negated_doc in heapq.nlargest(limit, scored)]
+
+
+class TenantMenuIndexes:
+    """Индексы меню по ресторанам: правка меню одного ресторана не перестраивает индексы других."""
+
+    def __init__(self):
+        self._indexes: Dict[int, MenuSearchIndex] = {}
+        self._lock = threading.Lock()
+
+    def get(self, restaurant_id: int) -> MenuSearchIndex:
+        index = self._indexes.get(restaurant_id)
+        if index is None:
+            with self._lock:
+                index = self._indexes.setdefault(restaurant_id, MenuSearchIndex())
+        return index
+
+    def invalidate(self, restaurant_id: int) -> None:
+        index = self._indexes.get(restaurant_id)
+        if index is not None:
+            index.invalidate()
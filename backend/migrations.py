@@ -0,0 +1,141 @@
+"""
+Досоздание колонок, добавленных в модели после первого запуска.
+create_all создает только отсутствующие таблицы, поэтому в уже развернутой
+базе новые колонки и индексы добавляются здесь при старте сервиса
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateIndex
+
+from database import Base
+
+
+# (таблица, колонка, определение колонки)
+COLUMNS = [
+    ("dishes", "station", "VARCHAR(20) NOT NULL DEFAULT 'hot'"),
+    ("order_items", "prep_status", "VARCHAR(20) NOT NULL DEFAULT 'queued'"),
+    ("order_items", "created_at", "TIMESTAMP WITH TIME ZONE DEFAULT now()"),
+    # Существующие данные принадлежат ресторану по умолчанию (models.DEFAULT_RESTAURANT_ID)
+    ("users", "restaurant_id", "INTEGER NOT NULL DEFAULT 1"),
+    ("restaurant_config", "restaurant_id", "INTEGER NOT NULL DEFAULT 1"),
+    ("tables", "restaurant_id", "INTEGER NOT NULL DEFAULT 1"),
+    ("dishes", "restaurant_id", "INTEGER NOT NULL DEFAULT 1"),
+    ("orders", "restaurant_id", "INTEGER NOT NULL DEFAULT 1"),
+    ("orders_archive", "restaurant_id", "INTEGER NOT NULL DEFAULT 1"),
+    # Снимок цены и названия блюда в позиции, суммы заказов в копейках
+    ("order_items", "dish_name", "VARCHAR(100)"),
+    ("order_items", "unit_price", "INTEGER"),
+    ("orders", "total_amount", "INTEGER NOT NULL DEFAULT 0"),
+    # Архив хранит цену в копейках; прежняя колонка dish_price (рубли, float) больше не пишется
+    ("order_items_archive", "unit_price", "INTEGER"),
+    ("orders_archive", "total_amount", "INTEGER NOT NULL DEFAULT 0"),
+    # Вместимость столов для бронирования (models.DEFAULT_TABLE_SEATS)
+    ("tables", "seats", "INTEGER NOT NULL DEFAULT 4"),
+    # Остатки блюд: существующие блюда не учитываются
+    ("dishes", "stock", "INTEGER"),
+    ("dishes", "sold_out", "BOOLEAN NOT NULL DEFAULT FALSE"),
+]
+
+# Заполнение только что добавленной колонки по уже существующим строкам.
+# Подзапросы вместо UPDATE ... FROM, чтобы работало и в SQLite
+BACKFILLS = {
+    ("order_items", "dish_name"):
+        "UPDATE order_items SET dish_name = (SELECT name FROM dishes WHERE dishes.id = order_items.dish_id)",
+    ("order_items", "unit_price"):
+        "UPDATE order_items SET unit_price = "
+        "(SELECT CAST(ROUND(price * 100) AS INTEGER) FROM dishes WHERE dishes.id = order_items.dish_id)",
+    ("orders", "total_amount"):
+        "UPDATE orders SET total_amount = COALESCE("
+        "(SELECT SUM(unit_price * quantity) FROM order_items WHERE order_items.order_id = orders.id), 0)",
+    ("order_items_archive", "unit_price"):
+        "UPDATE order_items_archive SET unit_price = CAST(ROUND(dish_price * 100) AS INTEGER)",
+    ("orders_archive", "total_amount"):
+        "UPDATE orders_archive SET total_amount = COALESCE((SELECT SUM(unit_price * quantity) "
+        "FROM order_items_archive WHERE order_items_archive.order_id = orders_archive.id), 0)",
+    # Закончившиеся блюда, снятые с продажи до появления признака
+    ("dishes", "sold_out"):
+        "UPDATE dishes SET sold_out = TRUE WHERE stock IS NOT NULL AND stock <= 0 AND available = FALSE",
+}
+
+# Индексы, замененные другими: номер стола и код заказа теперь уникальны только внутри ресторана,
+# а заказы официанта ищутся по ix_orders_waiter
+DROPPED_INDEXES = ["ix_tables_number", "ix_orders_code", "ix_orders_restaurant_waiter"]
+
+# Ключ advisory-блокировки построения индексов: индексы строит одна реплика, остальные не ждут
+INDEX_BUILD_LOCK = 4242001
+
+# Недостроенные индексы: прерванный CREATE INDEX CONCURRENTLY оставляет индекс INVALID,
+# который IF NOT EXISTS считал бы существующим
+INVALID_INDEXES = """
+SELECT index_class.relname FROM pg_index
+JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid
+JOIN pg_namespace ON pg_namespace.oid = index_class.relnamespace
+WHERE NOT pg_index.indisvalid AND pg_namespace.nspname = current_schema()
+"""
+
+
+def run_migrations(engine: Engine) -> None:
+    inspector = inspect(engine)
+    # Несколько реплик стартуют одновременно: IF NOT EXISTS делает повторное добавление безопасным
+    if_not_exists = "IF NOT EXISTS " if engine.dialect.name == "postgresql" else ""
+
+    # Колонки читаются до транзакции: в SQLite инспектор берет то же соединение из пула
+    # и откатывал бы уже добавленные колонки
+    existing = {table: {c["name"] for c in inspector.get_columns(table)}
+                for table in {table for table, _, _ in COLUMNS} if inspector.has_table(table)}
+
+    with engine.begin() as conn:
+        for table, column, definition in COLUMNS:
+            if table not in existing or column in existing[table]:
+                continue
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {if_not_exists}{column} {definition}"))
+            print(f" Добавлена колонка {table}.{column}")
+            if (table, column) in BACKFILLS:
+                conn.execute(text(BACKFILLS[(table, column)]))
+
+        for name in DROPPED_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+    if engine.dialect.name == "postgresql":
+        create_indexes_concurrently(engine)
+    else:
+        with engine.begin() as conn:
+            create_indexes(conn, lambda index: index.create(conn, checkfirst=True))
+
+
+def create_indexes(conn: Connection, create) -> None:
+    """Создает индексы моделей, которых еще нет в базе"""
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspect(conn).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                create(index)
+                print(f" Создан индекс {index.name}")
+
+
+def create_indexes_concurrently(engine: Engine) -> None:
+    """Индексы в Postgres строятся CONCURRENTLY: обычный CREATE INDEX на orders держит
+    блокировку записи на все время построения, и заказы не принимаются.
+
+    CONCURRENTLY не работает внутри транзакции, поэтому каждый индекс создается
+    отдельной командой в autocommit. Пока одна реплика строит индексы под advisory-блокировкой,
+    остальные пропускают этот шаг.
+    """
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": INDEX_BUILD_LOCK}).scalar():
+            print(" Индексы строит другая реплика")
+            return
+        try:
+            # Под блокировкой чужих построений нет: INVALID-индекс остался от прерванного
+            for (name,) in conn.execute(text(INVALID_INDEXES)).all():
+                conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+                print(f" Удален недостроенный индекс {name}")
+
+            def create(index):
+                statement = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+                conn.exec_driver_sql(statement.replace(" INDEX ", " INDEX CONCURRENTLY ", 1))
+
+            create_indexes(conn, create)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": INDEX_BUILD_LOCK})
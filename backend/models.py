@@ -1,8 +1,42 @@
 # models.py
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, DateTime, Text
+from sqlalchemy import Boolean, Column, DDL, ForeignKey, Integer, String, Float, DateTime, Text, Index, event, false, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Optional
+
+# Ресторан, к которому относятся данные, созданные до появления нескольких ресторанов
+DEFAULT_RESTAURANT_ID = 1
+# Верхняя граница числа столов ресторана (банкетные залы, фудкорты)
+MAX_TABLES = 5000
+# Мест за столом, пока администратор не указал другое
+DEFAULT_TABLE_SEATS = 4
+
+
+def restaurant_column():
+    # Индексы по ресторану составные и объявлены в __table_args__ с ним в первой колонке
+    return Column(Integer, nullable=False, default=DEFAULT_RESTAURANT_ID,
+                  server_default=str(DEFAULT_RESTAURANT_ID))
+
+
+def to_minor_units(amount: float) -> int:
+    """Цена в рублях -> целые копейки; через str, чтобы 0.29 не стало 28 копейками"""
+    return int((Decimal(str(amount)) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+def from_minor_units(amount: Optional[int]) -> float:
+    return (amount or 0) / 100
+
+
+def dish_snapshot(dish) -> dict:
+    """Поля OrderItem, копируемые из блюда при добавлении в заказ"""
+    return {"dish_name": dish.name, "unit_price": to_minor_units(dish.price)}
+
+
+def partial_index(name: str, *columns: str, where: str) -> Index:
+    # Частичный индекс в Postgres и SQLite: в индекс попадают только строки, которые ищут горячие запросы
+    return Index(name, *columns, postgresql_where=text(where), sqlite_where=text(where))
 
 class User(Base):
     __tablename__ = "users"
@@ -11,41 +45,81 @@ class User(Base):
     username = Column(String(50), unique=True, index=True, nullable=False)
     password = Column(String(255), nullable=False)
     role = Column(String(20), nullable=False)
+    restaurant_id = restaurant_column()
 
     orders = relationship("Order", back_populates="waiter")
 
 class RestaurantConfig(Base):
     __tablename__ = "restaurant_config"
+    __table_args__ = (
+        Index("uq_restaurant_config_restaurant", "restaurant_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    restaurant_id = restaurant_column()
     total_tables = Column(Integer, default=10)
 
 class Table(Base):
     __tablename__ = "tables"
+    __table_args__ = (
+        # Номера столов уникальны в пределах ресторана
+        Index("uq_tables_restaurant_number", "restaurant_id", "number", unique=True),
+        # Свободные столы ресторана (/tables/available, карта свободных столов)
+        partial_index("ix_tables_restaurant_free", "restaurant_id", "number", where="is_available"),
+        # Поиск стола по заказу при закрытии и удалении заказа; свободные столы не индексируются
+        partial_index("ix_tables_current_order", "current_order_id", where="current_order_id IS NOT NULL"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    number = Column(Integer, unique=True, index=True, nullable=False)
+    restaurant_id = restaurant_column()
+    number = Column(Integer, nullable=False)
     is_available = Column(Boolean, default=True)
     current_order_id = Column(Integer, ForeignKey("orders.id"), nullable=True)
+    seats = Column(Integer, nullable=False, default=DEFAULT_TABLE_SEATS, server_default=str(DEFAULT_TABLE_SEATS))
 
 class Dish(Base):
     __tablename__ = "dishes"
+    __table_args__ = (
+        Index("ix_dishes_restaurant_available", "restaurant_id", "available"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    restaurant_id = restaurant_column()
     name = Column(String(100), nullable=False)
     description = Column(Text)
     price = Column(Float, nullable=False)
     available = Column(Boolean, default=True)
+    # Участок кухни, на экран которого попадают позиции с этим блюдом
+    station = Column(String(20), nullable=False, default="hot", server_default="hot")
+    # Остаток порций по данным Postgres (живой счетчик - в Redis, см. stock.py); NULL - не учитывается
+    stock = Column(Integer, nullable=True)
+    # Блюдо снято с продажи, потому что закончилось: вернется в продажу, когда остаток снова станет больше 0
+    sold_out = Column(Boolean, nullable=False, default=False, server_default=false())
 
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        # Коды заказов уникальны в пределах ресторана
+        Index("uq_orders_restaurant_code", "restaurant_id", "code", unique=True),
+        Index("ix_orders_restaurant_created", "restaurant_id", "created_at"),
+        # Официант работает в одном ресторане, поэтому restaurant_id в индексе не нужен,
+        # а без него индексом пользуются и переназначение заказов при удалении пользователя
+        Index("ix_orders_waiter", "waiter_id"),
+        # Активные заказы - малая часть таблицы (перестроение очереди кухни)
+        partial_index("ix_orders_restaurant_active", "restaurant_id", where="status <> 'completed'"),
+        # Кандидаты архиватора
+        partial_index("ix_orders_completed_created", "created_at", where="status = 'completed'"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    code = Column(String(20), unique=True, index=True, nullable=True)
+    restaurant_id = restaurant_column()
+    code = Column(String(20), nullable=True)
     table_number = Column(Integer, nullable=False)
     status = Column(String(20), default="pending")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     waiter_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # Сумма позиций в копейках по ценам на момент заказа; пересчитывается при изменении позиций
+    total_amount = Column(Integer, nullable=False, default=0, server_default="0")
 
     waiter = relationship("User", back_populates="orders")
     items = relationship("OrderItem", back_populates="order", cascade="all, delete-orphan")
@@ -54,9 +128,92 @@ class OrderItem(Base):
     __tablename__ = "order_items"
 
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
+    order_id = Column(Integer, ForeignKey("orders.id"), index=True, nullable=False)
     dish_id = Column(Integer, ForeignKey("dishes.id"), nullable=False)
     quantity = Column(Integer, nullable=False, default=1)
+    prep_status = Column(String(20), nullable=False, default="queued", server_default="queued")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Снимок блюда на момент заказа: смена цены или удаление блюда не меняют прошлые заказы
+    dish_name = Column(String(100), nullable=True)
+    unit_price = Column(Integer, nullable=True)  # копейки
 
     order = relationship("Order", back_populates="items")
-    dish = relationship("Dish")
\ No newline at end of file
+    dish = relationship("Dish")
+
+# Бронь стола на полуинтервал [starts_at, ends_at): бронь до 21:00 и бронь с 21:00 не пересекаются
+class Reservation(Base):
+    __tablename__ = "reservations"
+    __table_args__ = (
+        # Брони стола, которые еще не закончились: поиск свободных столов и проверка пересечений
+        # читают по столу только его будущие брони, сколько бы прошлых ни накопилось
+        Index("ix_reservations_table_ends", "restaurant_id", "table_number", "ends_at"),
+        Index("ix_reservations_restaurant_starts", "restaurant_id", "starts_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    restaurant_id = restaurant_column()
+    table_number = Column(Integer, nullable=False)
+    guest_name = Column(String(100), nullable=False)
+    guests = Column(Integer, nullable=False)
+    starts_at = Column(DateTime(timezone=True), nullable=False)
+    ends_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+# В Postgres пересекающиеся брони одного стола запрещает сама база, в том числе при
+# одновременном бронировании. Равенство ресторана и стола сравнивается как равенство
+# одноточечных диапазонов: GiST умеет это без расширения btree_gist
+event.listen(Reservation.__table__, "after_create", DDL(
+    "ALTER TABLE reservations ADD CONSTRAINT ex_reservations_table_time EXCLUDE USING gist ("
+    "int4range(restaurant_id, restaurant_id, '[]') WITH =, "
+    "int4range(table_number, table_number, '[]') WITH =, "
+    "tstzrange(starts_at, ends_at) WITH &&)"
+).execute_if(dialect="postgresql"))
+
+# Архив выполненных заказов: холодная история, которую фоновый архиватор
+# выносит из горячих orders/order_items. Имя официанта и блюда/цены сохраняются
+# снимком, поэтому история не зависит от удаления пользователей и блюд.
+class ArchivedOrder(Base):
+    __tablename__ = "orders_archive"
+    __table_args__ = (
+        Index("ix_orders_archive_restaurant_created", "restaurant_id", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    restaurant_id = restaurant_column()
+    code = Column(String(20), index=True, nullable=True)
+    table_number = Column(Integer, nullable=False)
+    status = Column(String(20), nullable=False)
+    created_at = Column(DateTime(timezone=True), index=True)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+    waiter_id = Column(Integer, index=True, nullable=True)
+    waiter_name = Column(String(50), nullable=True)
+    total_amount = Column(Integer, nullable=False, default=0, server_default="0")  # копейки
+
+    items = relationship("ArchivedOrderItem", back_populates="order", cascade="all, delete-orphan")
+
+class ArchivedOrderItem(Base):
+    __tablename__ = "order_items_archive"
+
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("orders_archive.id", ondelete="CASCADE"), index=True, nullable=False)
+    dish_id = Column(Integer, nullable=False)
+    dish_name = Column(String(100), nullable=True)
+    unit_price = Column(Integer, nullable=True)  # копейки, как в OrderItem
+    quantity = Column(Integer, nullable=False)
+
+    order = relationship("ArchivedOrder", back_populates="items")
+
+# Outbox побочных эффектов запросов (инвалидация кеша, статистика, события кухни):
+# пишется в той же транзакции, что и изменение данных, и разбирается фоновым воркером
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    event_type = Column(String(50), nullable=False)
+    payload = Column(Text, nullable=False, default="{}")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    attempts = Column(Integer, nullable=False, default=0)
+    # NULL - событие можно обрабатывать сразу, иначе время следующей попытки
+    available_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(Text, nullable=True)
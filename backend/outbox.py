@@ -0,0 +1,254 @@
+"""
+Transactional outbox: побочные эффекты запросов записываются в outbox_events
+в той же транзакции, что и само изменение, и выполняются воркером (worker.py) пачками.
+Обработчик получает payload всех событий своего типа из пачки, поэтому
+повторяющиеся инвалидации схлопываются в одну команду Redis
+"""
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, or_, select, text
+from sqlalchemy.orm import Session
+
+import models
+import stock
+import table_state
+from database import init_restaurant_config
+from redis_client import redis_client
+
+
+OUTBOX_CHANNEL = "outbox"
+MAX_ATTEMPTS = 10
+RETRY_BASE_SECONDS = 2
+RETRY_MAX_SECONDS = 300
+
+HANDLERS: Dict[str, Callable[..., bool]] = {}
+
+
+def handler(event_type: str, with_ids: bool = False, with_session: bool = False):
+    """with_ids: обработчик получает пары (id события, payload) - по id он не применяет
+    повторно событие, уже выполненное в прошлой доставке.
+    with_session: обработчик первым аргументом получает сессию пачки, и его изменения в БД
+    коммитятся вместе с удалением событий"""
+    def register(func: Callable[..., bool]):
+        func.with_ids = with_ids
+        func.with_session = with_session
+        HANDLERS[event_type] = func
+        return func
+    return register
+
+
+def enqueue(db: Session, event_type: str, **payload) -> None:
+    """Добавляет событие в текущую транзакцию; воркер увидит его только после коммита."""
+    if event_type not in HANDLERS:
+        raise ValueError(f"Unknown outbox event type '{event_type}'")
+
+    db.add(models.OutboxEvent(event_type=event_type, payload=json.dumps(payload, default=str)))
+    if db.get_bind().dialect.name == "postgresql":
+        # NOTIFY доставляется при коммите, одинаковые уведомления транзакции склеиваются
+        db.execute(text("SELECT pg_notify(:channel, '')"), {"channel": OUTBOX_CHANNEL})
+
+
+def by_restaurant(payloads: List[Dict]) -> Dict[int, List[Dict]]:
+    # События, записанные до появления нескольких ресторанов, относятся к ресторану по умолчанию
+    grouped: Dict[int, List[Dict]] = {}
+    for payload in payloads:
+        grouped.setdefault(payload.get("restaurant_id", models.DEFAULT_RESTAURANT_ID), []).append(payload)
+    return grouped
+
+
+def events_by_restaurant(events: List[Tuple[int, Dict]]) -> Dict[int, Dict[int, Dict]]:
+    """by_restaurant для обработчиков with_ids: {ресторан: {id события: payload}}"""
+    grouped: Dict[int, Dict[int, Dict]] = {}
+    for event_id, payload in events:
+        grouped.setdefault(payload.get("restaurant_id", models.DEFAULT_RESTAURANT_ID), {})[event_id] = payload
+    return grouped
+
+
+def sum_quantities(group: List[Dict]) -> Dict[int, int]:
+    quantities: Dict[int, int] = {}
+    for payload in group:
+        # Ключи JSON - строки
+        for dish_id, quantity in payload["quantities"].items():
+            quantities[int(dish_id)] = quantities.get(int(dish_id), 0) + quantity
+    return quantities
+
+
+@handler("invalidate_tables")
+def _refresh_tables(payloads: List[Dict]) -> bool:
+    # Кеш столов не удаляется, а перезаписывается состоянием из БД: одно чтение на ресторан за пачку
+    return all([table_state.publish_tables(restaurant_id) for restaurant_id in by_restaurant(payloads)])
+
+
+@handler("table_availability")
+def _update_free_tables(payloads: List[Dict]) -> bool:
+    results = []
+    for restaurant_id, group in by_restaurant(payloads).items():
+        # Позднее событие по тому же столу перекрывает раннее
+        tables: Dict[int, bool] = {}
+        for payload in group:
+            tables.update({int(number): free for number, free in payload["tables"].items()})
+        results.append(redis_client.set_tables_free(restaurant_id, tables))
+    return all(results)
+
+
+@handler("reset_free_tables")
+def _reset_free_tables(payloads: List[Dict]) -> bool:
+    # Карта перестроится из БД при первом чтении
+    return all([redis_client.reset_free_tables(restaurant_id) for restaurant_id in by_restaurant(payloads)])
+
+
+@handler("invalidate_dishes")
+def _invalidate_dishes(payloads: List[Dict]) -> bool:
+    return all([redis_client.invalidate_dishes_cache(restaurant_id) for restaurant_id in by_restaurant(payloads)])
+
+
+@handler("invalidate_orders")
+def _invalidate_orders(payloads: List[Dict]) -> bool:
+    results = []
+    for restaurant_id, group in by_restaurant(payloads).items():
+        order_ids = sorted({order_id for payload in group for order_id in payload["order_ids"]})
+        # Списки официантов: владельцы заказов до и после изменения (у заказа без официанта - None)
+        waiter_ids = sorted({waiter_id for payload in group for waiter_id in payload.get("waiter_ids", [])
+                             if waiter_id is not None})
+        results.append(redis_client.invalidate_orders_cache(restaurant_id, order_ids, waiter_ids))
+    return all(results)
+
+
+@handler("invalidate_all_orders")
+def _invalidate_all_orders(payloads: List[Dict]) -> bool:
+    return all([redis_client.invalidate_all_orders_cache(restaurant_id) for restaurant_id in by_restaurant(payloads)])
+
+
+@handler("init_restaurant")
+def _init_restaurants(payloads: List[Dict]) -> bool:
+    # Ресторан, зарегистрированный через сервис авторизации; повторный вызов ничего не создает
+    for restaurant_id in by_restaurant(payloads):
+        init_restaurant_config(restaurant_id)
+    return True
+
+
+@handler("record_dish_orders", with_ids=True)
+def _record_dish_orders(events: List[Tuple[int, Dict]]) -> bool:
+    # Количества попадают в бакет часа заказа: правка вчерашнего заказа меняет вчерашний бакет.
+    # У событий, записанных до появления hour, - текущий час
+    results = []
+    for restaurant_id, group in events_by_restaurant(events).items():
+        by_hour: Dict[Optional[int], Dict[int, Dict[int, int]]] = {}
+        for event_id, payload in group.items():
+            by_hour.setdefault(payload.get("hour"), {})[event_id] = sum_quantities([payload])
+        results += [redis_client.record_dish_orders(restaurant_id, orders, hour) for hour, orders in by_hour.items()]
+    return all(results)
+
+
+@handler("reconcile_stock", with_session=True)
+def _reconcile_stock(db: Session, payloads: List[Dict]) -> bool:
+    # Транзакция пачки: UPDATE остатков коммитится вместе с удалением событий, поэтому
+    # stock.seed не увидит списание и в dishes.stock, и в outbox. Закончившиеся и снова
+    # появившиеся блюда меняют доступность вместе с записью инвалидации меню, которую
+    # выполнит следующая пачка
+    for restaurant_id, group in by_restaurant(payloads).items():
+        if stock.reconcile(db, restaurant_id, sum_quantities(group)):
+            enqueue(db, "invalidate_dishes", restaurant_id=restaurant_id)
+    return True
+
+
+@handler("take_stock", with_ids=True)
+def _take_stock(events: List[Tuple[int, Dict]]) -> bool:
+    # Списания, записанные, пока Redis был недоступен, и возвраты порций удаленных заказов
+    # (отрицательные). Событие применяется один раз: повторная доставка и события, уже учтенные
+    # заполнением счетчиков из Postgres (stock.seed), пропускаются
+    return all([
+        redis_client.catch_up_stock(restaurant_id, {
+            event_id: sum_quantities([payload]) for event_id, payload in group.items()
+        })
+        for restaurant_id, group in events_by_restaurant(events).items()
+    ])
+
+
+@handler("set_stock", with_ids=True)
+def _set_stock(events: List[Tuple[int, Dict]]) -> bool:
+    # Новый остаток от администратора попадает в счетчик только после коммита в Postgres.
+    # Как и take_stock, событие применяется один раз
+    return all([
+        redis_client.set_stock(restaurant_id, {
+            event_id: (payload["dish_id"], payload["stock"], payload["delta"]) for event_id, payload in group.items()
+        })
+        for restaurant_id, group in events_by_restaurant(events).items()
+    ])
+
+
+@handler("kitchen_events")
+def _publish_kitchen_events(payloads: List[Dict]) -> bool:
+    # Порядок событий кухни важен: пачка идет по возрастанию id, группировка его сохраняет
+    results = []
+    for restaurant_id, group in by_restaurant(payloads).items():
+        events = [(event_type, item) for payload in group for event_type, item in payload["events"]]
+        results.append(redis_client.publish_kitchen_events(restaurant_id, events))
+    return all(results)
+
+
+def process_batch(db: Session, batch_size: int) -> int:
+    """Выполняет одну пачку событий в одной транзакции и возвращает ее размер.
+
+    SKIP LOCKED позволяет запускать несколько воркеров. Неудавшиеся события
+    остаются в таблице с экспоненциальной задержкой до следующей попытки.
+    """
+    now = datetime.now(timezone.utc)
+    events = list(db.execute(
+        select(models.OutboxEvent)
+        .where(or_(models.OutboxEvent.available_at.is_(None), models.OutboxEvent.available_at <= now))
+        .order_by(models.OutboxEvent.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).scalars())
+    if not events:
+        return 0
+
+    by_type: Dict[str, List[models.OutboxEvent]] = {}
+    for event in events:
+        by_type.setdefault(event.event_type, []).append(event)
+
+    done = []
+    for event_type, group in by_type.items():
+        error = None
+        try:
+            func = HANDLERS.get(event_type)
+            if func is None:
+                error = f"Unknown event type '{event_type}'"
+            else:
+                payloads = [json.loads(event.payload) for event in group]
+                if getattr(func, "with_ids", False):
+                    payloads = list(zip([event.id for event in group], payloads))
+                if getattr(func, "with_session", False):
+                    # Точка сохранения: неудача обработчика откатывает только его изменения
+                    with db.begin_nested() as savepoint:
+                        succeeded = func(db, payloads)
+                        if not succeeded:
+                            savepoint.rollback()
+                else:
+                    succeeded = func(payloads)
+                if not succeeded:
+                    error = "Handler reported failure"
+        except Exception as e:
+            error = str(e)
+
+        if error is None:
+            done.extend(event.id for event in group)
+            continue
+
+        for event in group:
+            event.attempts += 1
+            event.last_error = error
+            if event.attempts >= MAX_ATTEMPTS:
+                print(f"Событие outbox {event.id} ({event_type}) отброшено после {event.attempts} попыток: {error}")
+                done.append(event.id)
+            else:
+                delay = min(RETRY_BASE_SECONDS * 2 ** (event.attempts - 1), RETRY_MAX_SECONDS)
+                event.available_at = now + timedelta(seconds=delay)
+
+    if done:
+        db.execute(delete(models.OutboxEvent).where(models.OutboxEvent.id.in_(done)))
+    db.commit()
+    return len(events)
@@ -0,0 +1,113 @@
+"""
+Локальный бенчмарк nginx перед API: сравнивает прямые запросы к backend-api
+с запросами через nginx - анонимными (микрокеш) и с токеном (мимо кеша, но через
+keepalive-пул) - и показывает, сколько байт экономит gzip.
+
+    docker compose up -d
+    python proxy_benchmark.py --nginx http://localhost --backend http://localhost:8000 \\
+        --username admin --password secret
+
+Чтобы увидеть вклад конфигурации, запустите его до и после изменения nginx.conf
+"""
+import argparse
+import math
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def make_session(concurrency: int) -> requests.Session:
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency))
+    return session
+
+
+def run_scenario(name: str, url: str, headers: Dict[str, str], total: int, concurrency: int) -> Dict:
+    session = make_session(concurrency)
+    latencies: List[float] = []
+    cache_statuses: Counter = Counter()
+    errors = 0
+
+    def one_request(_):
+        started = time.perf_counter()
+        response = session.get(url, headers=headers, timeout=10)
+        return (time.perf_counter() - started) * 1000, response.status_code, response.headers.get("X-Cache-Status")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for latency, status, cache_status in pool.map(one_request, range(total)):
+            latencies.append(latency)
+            if status != 200:
+                errors += 1
+            if cache_status:
+                cache_statuses[cache_status] += 1
+    elapsed = time.perf_counter() - started
+
+    return {
+        "scenario": name,
+        "rps": total / elapsed,
+        "p50_ms": percentile(latencies, 0.5),
+        "p95_ms": percentile(latencies, 0.95),
+        "errors": errors,
+        "cache": dict(cache_statuses),
+    }
+
+
+def transferred_bytes(url: str, encoding: str) -> int:
+    response = requests.get(url, headers={"Accept-Encoding": encoding}, stream=True, timeout=10)
+    return len(response.raw.read(decode_content=False))
+
+
+def login(base_url: str, username: str, password: str) -> Optional[str]:
+    response = requests.post(f"{base_url}/login", json={"username": username, "password": password}, timeout=10)
+    if not response.ok:
+        print(f"Не удалось войти как {username}: HTTP {response.status_code}")
+        return None
+    return response.json()["access_token"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк проксирования API через nginx")
+    parser.add_argument("--nginx", default="http://localhost")
+    parser.add_argument("--backend", default="http://localhost:8000")
+    parser.add_argument("--path", default="/dishes")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    args = parser.parse_args()
+
+    token = login(args.backend, args.username, args.password) if args.username and args.password else None
+
+    scenarios = [
+        ("direct backend", f"{args.backend}{args.path}", {}),
+        ("nginx anonymous (micro-cache)", f"{args.nginx}/api{args.path}", {}),
+    ]
+    if token:
+        scenarios.append(("nginx with token (keepalive)", f"{args.nginx}/api{args.path}",
+                          {"Authorization": f"Bearer {token}"}))
+
+    print(f"{args.requests} GET {args.path}, concurrency {args.concurrency}")
+    print(f"{'scenario':<32}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}  cache")
+    for name, url, headers in scenarios:
+        result = run_scenario(name, url, headers, args.requests, args.concurrency)
+        print(f"{result['scenario']:<32}{result['rps']:>10.0f}{result['p50_ms']:>10.1f}"
+              f"{result['p95_ms']:>10.1f}{result['errors']:>8}  {result['cache'] or '-'}")
+
+    plain = transferred_bytes(f"{args.nginx}/api{args.path}", "identity")
+    compressed = transferred_bytes(f"{args.nginx}/api{args.path}", "gzip")
+    print(f"response size: {plain} bytes plain, {compressed} bytes gzip "
+          f"({100 * (1 - compressed / max(plain, 1)):.0f}% smaller)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Чтение своих записей: после успешного изменяющего запроса клиент получает cookie
+primary_until (и заголовок X-Primary-Until для клиентов без cookie) с меткой времени.
+Пока метка не истекла, get_read_db отправляет его чтения в основную БД, а не на реплику,
+которая могла еще не догнать запись, а заказы читаются мимо кеша Redis, который
+outbox-воркер сбрасывает уже после коммита
+"""
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from database import PRIMARY_STICKY_COOKIE, PRIMARY_STICKY_SECONDS
+
+
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def sticky_headers(now: float) -> list:
+    until = f"{now + PRIMARY_STICKY_SECONDS:.3f}"
+    cookie = (f"{PRIMARY_STICKY_COOKIE}={until}; Max-Age={max(1, int(PRIMARY_STICKY_SECONDS))}; "
+              f"Path=/; HttpOnly; SameSite=Lax")
+    return [(b"set-cookie", cookie.encode()), (b"x-primary-until", until.encode())]
+
+
+class ReadYourWritesMiddleware:
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # Метка нужна и без реплик: кеш заказов отстает от записи так же, как реплика
+        if scope["type"] != "http" or scope["method"] in READ_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_stickiness(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                message = {**message, "headers": [*message.get("headers", []), *sticky_headers(time.time())]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_stickiness)
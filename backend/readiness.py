@@ -0,0 +1,113 @@
+"""
+Готовность пода для Kubernetes: фоновый поток раз в READINESS_INTERVAL_SECONDS
+проверяет Postgres (через пул приложения) и Redis, а /ready отдает сохраненный
+результат без обращения к зависимостям. Если поток перестал обновлять результат
+(например, завис на исчерпанном пуле), вердикт считается устаревшим и под - не готовым
+"""
+import os
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.pool import QueuePool
+
+
+READINESS_INTERVAL_SECONDS = float(os.getenv("READINESS_INTERVAL_SECONDS", "5"))
+# Redis общий для всех подов: если считать его обязательным, его падение выведет
+# из балансировки весь API, хотя без кеша эндпоинты продолжают работать через Postgres
+READINESS_REQUIRE_REDIS = os.getenv("READINESS_REQUIRE_REDIS", "false").lower() == "true"
+
+
+def pool_stats(engine) -> Dict:
+    pool = engine.pool
+    # У пулов SQLite этих счетчиков нет
+    if not isinstance(pool, QueuePool):
+        return {}
+    return {"size": pool.size(), "checkedout": pool.checkedout(), "overflow": pool.overflow()}
+
+
+class Readiness:
+
+    def __init__(self, engine, redis_client=None, interval: float = READINESS_INTERVAL_SECONDS,
+                 require_redis: bool = READINESS_REQUIRE_REDIS, required_tables: Sequence[str] = ()):
+        self.engine = engine
+        self.redis_client = redis_client
+        # Таблицы, без которых сервис не работает: сервис, который сам не создает схему,
+        # не готов, пока ее не создал backend-api
+        self.required_tables = required_tables
+        self.interval = interval
+        self.require_redis = require_redis
+        self.ready = False
+        self.verdict: Dict = {"status": "starting"}
+        self.checked_at: Optional[float] = None
+        self.stopping = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def check_database(self) -> Dict:
+        started = time.perf_counter()
+        try:
+            with self.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+                inspector = inspect(conn)
+                missing = [table for table in self.required_tables if not inspector.has_table(table)]
+            result = {"ok": True} if not missing else {"ok": False, "error": f"missing tables: {', '.join(missing)}"}
+        except Exception as e:
+            result = {"ok": False, "error": str(e)[:200]}
+        result["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        result["pool"] = pool_stats(self.engine)
+        return result
+
+    def check_redis(self) -> Dict:
+        started = time.perf_counter()
+        ok = self.redis_client.is_available()
+        return {"ok": ok, "required": self.require_redis,
+                "latency_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+    def refresh(self) -> None:
+        verdict = {"database": self.check_database()}
+        # Сервису авторизации Redis не нужен, его проверка не выполняется
+        if self.redis_client is not None:
+            verdict["redis"] = self.check_redis()
+        ready = all(check["ok"] for check in verdict.values() if check.get("required", True))
+        degraded = not all(check["ok"] for check in verdict.values())
+        if self.stopping.is_set():
+            return
+        self.verdict = {"status": ("degraded" if degraded else "ok") if ready else "unavailable", **verdict}
+        self.checked_at = time.time()
+        self.ready = ready
+
+    def snapshot(self) -> Tuple[bool, Dict]:
+        """Сохраненный вердикт; не обращается ни к БД, ни к Redis."""
+        if self.stopping.is_set():
+            return False, {"status": "shutting down"}
+        if self.checked_at is None:
+            return False, self.verdict
+        age = time.time() - self.checked_at
+        verdict = {**self.verdict, "checked_seconds_ago": round(age, 1)}
+        if age > 3 * self.interval:
+            return False, {**verdict, "status": "stale"}
+        return self.ready, verdict
+
+    def _run(self) -> None:
+        while not self.stopping.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Ошибка проверки готовности: {e}")
+
+    def start(self) -> None:
+        if self.thread is not None:
+            return
+        self.stopping.clear()
+        # Первый вердикт считаем сразу, чтобы под стал готов без ожидания интервала
+        self.refresh()
+        self.thread = threading.Thread(target=self._run, name="readiness", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        # С этого момента /ready отвечает 503, и балансировщик снимает под до остановки
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.interval)
+            self.thread = None
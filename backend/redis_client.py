@@ -4,10 +4,242 @@
 import os
 import json
 import redis
-from typing import Optional, List, Dict, Any, Tuple
+from typing import Optional, List, Dict, Any, Callable, Tuple, Union
 from functools import wraps
 from fastapi import HTTPException, status
 import time
+import uuid
+from datetime import datetime, timezone
+
+
+# Окна статистики популярности блюд в часах
+POPULAR_WINDOWS = {"hour": 1, "day": 24, "week": 24 * 7}
+# Почасовой бакет живет чуть дольше самого длинного окна
+POPULAR_BUCKET_TTL = (POPULAR_WINDOWS["week"] + 1) * 3600
+POPULAR_UNION_TTL = 60
+# Outbox доставляет события хотя бы раз: id учтенных событий хранятся дольше всех повторов
+# события (около 15 минут), и повторно доставленная пачка счетчики не меняет
+APPLIED_EVENTS_SECONDS = 3600
+
+# Учет пачки заказов в бакете популярности: ARGV - TTL бакета, текущее время, срок хранения
+# учтенных событий, затем по каждому событию outbox его id, число блюд и пары (id блюда, количество).
+# KEYS[2] - sorted set учтенных событий со временем учета: уже учтенное событие пропускается
+RECORD_DISH_ORDERS_SCRIPT = """
+local now = tonumber(ARGV[2])
+local i = 4
+while i <= #ARGV do
+    local last = i + 1 + 2 * tonumber(ARGV[i + 1])
+    if redis.call('ZADD', KEYS[2], 'NX', now, ARGV[i]) == 1 then
+        for j = i + 2, last, 2 do
+            redis.call('ZINCRBY', KEYS[1], ARGV[j + 1], ARGV[j])
+        end
+    end
+    i = last + 1
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now - tonumber(ARGV[3]))
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return 0
+"""
+
+# Поток событий кухни и его проекция: текущие позиции очереди по item_id
+KITCHEN_EVENTS_STREAM = "kitchen:events"
+KITCHEN_ITEMS_KEY = "kitchen:items"
+KITCHEN_STREAM_MAXLEN = 10000
+# Позиция с такими событиями уходит с кухонных экранов
+KITCHEN_REMOVAL_EVENTS = ("removed", "served")
+
+# Битовая карта свободных столов ресторана: бит N - стол N свободен.
+# Бит 0 (столов с номером 0 нет) отмечает построенную карту: без него карту нужно
+# перестроить из БД, поэтому частично записанная SETBIT-ами карта не принимается за полную
+FREE_TABLES_KEY = "tables:free"
+# Поколение карты: каждое изменение карты (SETBIT, сброс) увеличивает его. Перестроение
+# из БД записывает карту, только если поколение не изменилось с момента до чтения БД,
+# иначе полный SET затер бы более новые биты
+FREE_TABLES_GENERATION_KEY = "tables:free:gen"
+
+# Запись перестроенной карты: KEYS - карта и поколение, ARGV - карта и поколение до чтения БД.
+# Возвращает 0, если карту успели изменить, и перестроение отброшено
+REPLACE_FREE_TABLES_SCRIPT = """
+if (tonumber(redis.call('GET', KEYS[2])) or 0) ~= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1])
+return 1
+"""
+
+# Single-flight перезаполнение кеша: пока один процесс читает БД под блокировкой,
+# остальные отдают устаревшие данные (до CACHE_STALE_SECONDS после истечения свежести)
+CACHE_STALE_SECONDS = 60
+CACHE_LOCK_TTL_MS = 2000
+CACHE_WAIT_POLL_SECONDS = 0.02
+# Столы обновляются записью из outbox-воркера, TTL лишь страхует от пропущенного события
+TABLES_CACHE_TTL = 60
+# Версия кеша столов ресторана: воркер увеличивает ее перед чтением БД. Запись в кеш
+# помечена версией, прочитанной до запроса к БД, и принимается, только пока версия
+# не изменилась: снимок, прочитанный до более нового изменения, не затирает его
+TABLES_VERSION_KEY = "tables:version"
+
+# Запись конверта кеша: KEYS - ключ и ключ версии, ARGV - конверт, срок жизни и версия
+# снимка. Возвращает 0, если версия успела измениться, и запись отброшена
+STORE_FRESH_SCRIPT = """
+if (tonumber(redis.call('GET', KEYS[2])) or 0) ~= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+# Ответы GET /orders/{id} и списки заказов официантов. Инвалидация не удаляет ключ,
+# а на несколько секунд записывает метку, поверх которой промах не кешируется
+ORDER_CACHE_TTL = 180
+ORDER_CACHE_TOMBSTONE = "-"
+ORDER_CACHE_TOMBSTONE_SECONDS = 5
+
+# Блокировка Idempotency-Key на время выполнения первого запроса
+IDEMPOTENCY_LOCK_TTL = 30
+
+# Остатки блюд ресторана: поле - id блюда, значение - сколько порций осталось; блюда без
+# поля не учитываются. Поле STOCK_LOADED_FIELD отмечает хеш, заполненный из БД целиком
+STOCK_KEY = "stock"
+STOCK_LOADED_FIELD = "loaded"
+STOCK_NOT_LOADED = -1
+# События take_stock, уже учтенные в счетчиках (sorted set id события -> время учета)
+STOCK_APPLIED_KEY = "stock:applied"
+
+# Списание сразу по всем блюдам заказа: ARGV - force и пары (id блюда, количество).
+# Без force при нехватке любого блюда ничего не списывается и возвращается {id, остаток}.
+# Отрицательное количество возвращает порции. -1 - хеш еще не заполнен из БД
+TAKE_STOCK_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], ARGV[2]) == 0 then
+    return -1
+end
+if ARGV[1] ~= '1' then
+    for i = 3, #ARGV, 2 do
+        local left = redis.call('HGET', KEYS[1], ARGV[i])
+        local quantity = tonumber(ARGV[i + 1])
+        if left and quantity > 0 and tonumber(left) < quantity then
+            return {tonumber(ARGV[i]), tonumber(left)}
+        end
+    end
+end
+for i = 3, #ARGV, 2 do
+    if redis.call('HEXISTS', KEYS[1], ARGV[i]) == 1 then
+        redis.call('HINCRBY', KEYS[1], ARGV[i], -tonumber(ARGV[i + 1]))
+    end
+end
+return 0
+"""
+
+# Догоняющее списание событий take_stock: KEYS - хеш остатков и учтенные события, ARGV - поле
+# заполненного хеша, текущее время, срок хранения учтенных событий, затем по каждому событию
+# его id, число блюд и пары (id блюда, количество). Учтенное событие пропускается; -1 - хеш
+# еще не заполнен из БД, и списания войдут в заполнение
+CATCH_UP_STOCK_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+    return -1
+end
+local now = tonumber(ARGV[2])
+local i = 4
+while i <= #ARGV do
+    local last = i + 1 + 2 * tonumber(ARGV[i + 1])
+    if redis.call('ZADD', KEYS[2], 'NX', now, ARGV[i]) == 1 then
+        for j = i + 2, last, 2 do
+            if redis.call('HEXISTS', KEYS[1], ARGV[j]) == 1 then
+                redis.call('HINCRBY', KEYS[1], ARGV[j], -tonumber(ARGV[j + 1]))
+            end
+        end
+    end
+    i = last + 1
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now - tonumber(ARGV[3]))
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return 0
+"""
+
+# Заполнение счетчиков из БД: KEYS - как у CATCH_UP_STOCK_SCRIPT, ARGV - поле заполненного
+# хеша, текущее время, срок хранения учтенных событий, число блюд, пары (id блюда, остаток)
+# и id событий take_stock, уже учтенных в этих остатках. Если хеш успели заполнить, ничего
+# не меняется и возвращается 0: события отмечаются учтенными, только если остатки записаны
+SEED_STOCK_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+    return 0
+end
+local now = tonumber(ARGV[2])
+local last = 4 + 2 * tonumber(ARGV[4])
+for i = 5, last, 2 do
+    redis.call('HSETNX', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('HSET', KEYS[1], ARGV[1], 1)
+for i = last + 1, #ARGV do
+    redis.call('ZADD', KEYS[2], now, ARGV[i])
+end
+if #ARGV > last then
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now - tonumber(ARGV[3]))
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+end
+return 1
+"""
+
+# Новые остатки от администратора, по одному на событие outbox set_stock: KEYS - как у
+# CATCH_UP_STOCK_SCRIPT, ARGV - поле заполненного хеша, текущее время, срок хранения учтенных
+# событий, затем четверки (id события, id блюда, остаток, разница). Учитываемый счетчик
+# меняется на разницу: она коммутирует со списаниями, сделанными после коммита нового остатка.
+# Пустой остаток - блюдо больше не учитывается
+SET_STOCK_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+    return -1
+end
+local now = tonumber(ARGV[2])
+for i = 4, #ARGV, 4 do
+    if redis.call('ZADD', KEYS[2], 'NX', now, ARGV[i]) == 1 then
+        if ARGV[i + 2] == '' then
+            redis.call('HDEL', KEYS[1], ARGV[i + 1])
+        elseif redis.call('HEXISTS', KEYS[1], ARGV[i + 1]) == 1 then
+            redis.call('HINCRBY', KEYS[1], ARGV[i + 1], ARGV[i + 3])
+        else
+            redis.call('HSET', KEYS[1], ARGV[i + 1], ARGV[i + 2])
+        end
+    end
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now - tonumber(ARGV[3]))
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return 0
+"""
+
+
+def _current_hour() -> int:
+    return int(time.time() // 3600)
+
+
+def popular_hour(moment: Optional[datetime] = None) -> int:
+    """Час бакета популярности для момента заказа (время без зоны - UTC); без момента - текущий"""
+    if moment is None:
+        return _current_hour()
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() // 3600)
+
+
+def tenant_key(restaurant_id: int, key: str) -> str:
+    """Ключ ресторана: инвалидация одного ресторана не задевает ключи других.
+
+    Hash tag {id} держит все ключи ресторана в одном слоте Redis Cluster,
+    поэтому транзакции над очередью кухни остаются допустимыми.
+    """
+    return f"r:{{{restaurant_id}}}:{key}"
+
+
+def order_cache_key(order_id: int) -> str:
+    return f"order:{order_id}"
+
+
+def waiter_orders_cache_key(waiter_id: int) -> str:
+    return f"order:waiter:{waiter_id}"
+
+
+def _popular_bucket_key(restaurant_id: int, hour: int) -> str:
+    return tenant_key(restaurant_id, f"stats:popular:{hour}")
 
 
 class RedisClient:
@@ -40,136 +272,321 @@ class RedisClient:
             return False
 
     
-    def cache_dishes(self, dishes: List[Dict], ttl: int = 300) -> bool:
+    def _delete_pattern(self, pattern: str) -> None:
+        # SCAN вместо KEYS: не блокирует Redis на время обхода всех ключей
+        keys = list(self.client.scan_iter(match=pattern, count=500))
+        if keys:
+            self.client.delete(*keys)
+
+    def cache_dishes(self, restaurant_id: int, dishes: List[Dict], ttl: int = 300) -> bool:
         if not self.is_available():
             return False
         try:
             dishes_json = json.dumps(dishes, default=str)
-            self.client.setex("dishes:all", ttl, dishes_json)
+            self.client.setex(tenant_key(restaurant_id, "dishes:all"), ttl, dishes_json)
             return True
         except Exception as e:
             print(f"Ошибка кеширования блюд: {e}")
             return False
     
-    def get_cached_dishes(self) -> Optional[List[Dict]]:
+    def get_cached_dishes(self, restaurant_id: int) -> Optional[List[Dict]]:
         if not self.is_available():
             return None
         try:
-            cached = self.client.get("dishes:all")
+            cached = self.client.get(tenant_key(restaurant_id, "dishes:all"))
             if cached:
                 return json.loads(cached)
         except Exception as e:
             print(f"Ошибка получения блюд из кеша: {e}")
         return None
     
-    def invalidate_dishes_cache(self) -> bool:
+    def invalidate_dishes_cache(self, restaurant_id: int) -> bool:
         if not self.is_available():
             return False
         try:
-            self.client.delete("dishes:all")
+            # Версия меню сигнализирует всем процессам, что in-memory индекс поиска устарел
+            pipe = self.client.pipeline()
+            pipe.delete(tenant_key(restaurant_id, "dishes:all"))
+            pipe.incr(tenant_key(restaurant_id, "menu:version"))
+            pipe.execute()
             return True
         except Exception as e:
             print(f"Ошибка инвалидации кеша блюд: {e}")
             return False
 
     
-    def cache_tables(self, tables: List[Dict], ttl: int = 60) -> bool:
+    def get_dishes_version(self, restaurant_id: int) -> Optional[int]:
         if not self.is_available():
-            return False
+            return None
         try:
-            tables_json = json.dumps(tables, default=str)
-            self.client.setex("tables:all", ttl, tables_json)
-            return True
+            return int(self.client.get(tenant_key(restaurant_id, "menu:version")) or 0)
         except Exception as e:
-            print(f"Ошибка кеширования столов: {e}")
-            return False
+            print(f"Ошибка получения версии меню: {e}")
+            return None
+
     
-    def get_cached_tables(self) -> Optional[List[Dict]]:
+    def _read_envelope(self, key: str) -> Optional[Dict]:
+        try:
+            cached = self.client.get(key)
+            return json.loads(cached) if cached else None
+        except Exception as e:
+            print(f"Ошибка чтения кеша {key}: {e}")
+            return None
+
+    def cache_version(self, version_key: str) -> Optional[int]:
         if not self.is_available():
             return None
         try:
-            cached = self.client.get("tables:all")
-            if cached:
-                return json.loads(cached)
+            return int(self.client.get(version_key) or 0)
         except Exception as e:
-            print(f"Ошибка получения столов из кеша: {e}")
-        return None
-    
-    def cache_available_tables(self, tables: List[Dict], ttl: int = 30) -> bool:
+            print(f"Ошибка чтения версии кеша {version_key}: {e}")
+            return None
 
+    def bump_cache_version(self, version_key: str) -> Optional[int]:
+        """Новая версия кеша; записи по снимкам, прочитанным раньше, больше не принимаются"""
+        if not self.is_available():
+            return None
+        try:
+            return int(self.client.incr(version_key))
+        except Exception as e:
+            print(f"Ошибка обновления версии кеша {version_key}: {e}")
+            return None
+
+    def store_fresh(self, key: str, data: Any, ttl: int, stale_ttl: int = CACHE_STALE_SECONDS,
+                    version_key: Optional[str] = None, version: int = 0) -> bool:
+        """Кладет данные свежими на ttl секунд; еще stale_ttl секунд их можно отдавать, пока идет перезаполнение.
+
+        С version_key данные записываются, только если версия не изменилась с version; отброшенная
+        запись не ошибка - кеш заполнит тот, кто изменил версию. False только при ошибке Redis.
+        """
         if not self.is_available():
             return False
         try:
-            tables_json = json.dumps(tables, default=str)
-            self.client.setex("tables:available", ttl, tables_json)
+            envelope = json.dumps({"fresh_until": time.time() + ttl, "data": data}, default=str)
+            if version_key is None:
+                self.client.set(key, envelope, ex=ttl + stale_ttl)
+            else:
+                self.client.register_script(STORE_FRESH_SCRIPT)(
+                    keys=[key, version_key], args=[envelope, ttl + stale_ttl, version]
+                )
             return True
         except Exception as e:
-            print(f"Ошибка кеширования доступных столов: {e}")
+            print(f"Ошибка записи кеша {key}: {e}")
             return False
-    
-    def get_cached_available_tables(self) -> Optional[List[Dict]]:
 
+    def get_or_load(self, key: str, loader: Callable[[], Any], ttl: int,
+                    stale_ttl: int = CACHE_STALE_SECONDS, version_key: Optional[str] = None) -> Any:
+        """Single-flight чтение кеша: при промахе или устаревании БД читает только владелец
+        короткой блокировки. Остальные получают устаревшие данные, а при пустом кеше
+        недолго ждут, пока владелец их положит. Без Redis данные читаются напрямую.
+
+        С version_key версия читается до запроса к БД, и кеш заполняется, только если
+        за время чтения ее никто не увеличил (см. store_fresh)."""
+        if not self.is_available():
+            return loader()
+
+        envelope = self._read_envelope(key)
+        if envelope and envelope["fresh_until"] > time.time():
+            return envelope["data"]
+
+        lock_key = f"{key}:lock"
+        token = uuid.uuid4().hex
+        try:
+            locked = bool(self.client.set(lock_key, token, nx=True, px=CACHE_LOCK_TTL_MS))
+        except Exception as e:
+            print(f"Ошибка блокировки кеша {key}: {e}")
+            return loader()
+
+        if not locked:
+            if envelope:
+                return envelope["data"]
+            deadline = time.monotonic() + CACHE_LOCK_TTL_MS / 1000
+            while time.monotonic() < deadline:
+                time.sleep(CACHE_WAIT_POLL_SECONDS)
+                envelope = self._read_envelope(key)
+                if envelope:
+                    return envelope["data"]
+            # Владелец блокировки не успел: читаем сами, но кеш не трогаем
+            return loader()
+
+        try:
+            version = self.cache_version(version_key) if version_key else 0
+            data = loader()
+            if version is not None:
+                self.store_fresh(key, data, ttl, stale_ttl, version_key, version)
+            return data
+        finally:
+            try:
+                # Блокировка могла истечь и достаться другому процессу - чужую не снимаем
+                if self.client.get(lock_key) == token:
+                    self.client.delete(lock_key)
+            except Exception as e:
+                print(f"Ошибка снятия блокировки кеша {key}: {e}")
+
+    def get_tables(self, restaurant_id: int, loader: Callable[[], List[Dict]]) -> List[Dict]:
+        return self.get_or_load(tenant_key(restaurant_id, "tables:all"), loader, TABLES_CACHE_TTL,
+                                version_key=tenant_key(restaurant_id, TABLES_VERSION_KEY))
+
+    def get_available_tables(self, restaurant_id: int, loader: Callable[[], List[Dict]]) -> List[Dict]:
+        return self.get_or_load(tenant_key(restaurant_id, "tables:available"), loader, TABLES_CACHE_TTL,
+                                version_key=tenant_key(restaurant_id, TABLES_VERSION_KEY))
+
+    def bump_tables_version(self, restaurant_id: int) -> Optional[int]:
+        return self.bump_cache_version(tenant_key(restaurant_id, TABLES_VERSION_KEY))
+
+    def publish_tables(self, restaurant_id: int, tables: List[Dict], version: int) -> bool:
+        """Write-through после изменения столов: свежее состояние заменяет кеш, а не удаляет его.
+
+        version - результат bump_tables_version до чтения tables из БД.
+        """
+        available = [table for table in tables if table["is_available"]]
+        version_key = tenant_key(restaurant_id, TABLES_VERSION_KEY)
+        return all([
+            self.store_fresh(tenant_key(restaurant_id, "tables:all"), tables, TABLES_CACHE_TTL,
+                             version_key=version_key, version=version),
+            self.store_fresh(tenant_key(restaurant_id, "tables:available"), available, TABLES_CACHE_TTL,
+                             version_key=version_key, version=version),
+        ])
+
+    def free_tables_generation(self, restaurant_id: int) -> Optional[int]:
+        """Поколение карты свободных столов; читается до запроса к БД при перестроении."""
         if not self.is_available():
             return None
         try:
-            cached = self.client.get("tables:available")
-            if cached:
-                return json.loads(cached)
+            return int(self.client.get(tenant_key(restaurant_id, FREE_TABLES_GENERATION_KEY)) or 0)
         except Exception as e:
-            print(f"Ошибка получения доступных столов из кеша: {e}")
-        return None
-    
-    def invalidate_tables_cache(self) -> bool:
+            print(f"Ошибка чтения поколения карты свободных столов: {e}")
+            return None
 
+    def replace_free_tables(self, restaurant_id: int, free_numbers: List[int], generation: int) -> bool:
+        """Записывает карту свободных столов целиком, если с generation ее никто не менял."""
         if not self.is_available():
             return False
         try:
-            self.client.delete("tables:all", "tables:available")
+            bitmap = bytearray(max(free_numbers, default=0) // 8 + 1)
+            for number in [0, *free_numbers]:
+                bitmap[number // 8] |= 0x80 >> (number % 8)
+            return bool(self.client.register_script(REPLACE_FREE_TABLES_SCRIPT)(
+                keys=[tenant_key(restaurant_id, FREE_TABLES_KEY),
+                      tenant_key(restaurant_id, FREE_TABLES_GENERATION_KEY)],
+                args=[bytes(bitmap), generation],
+            ))
+        except Exception as e:
+            print(f"Ошибка записи карты свободных столов: {e}")
+            return False
+
+    def set_tables_free(self, restaurant_id: int, tables: Dict[int, bool]) -> bool:
+        if not tables:
+            return True
+        if not self.is_available():
+            return False
+        try:
+            key = tenant_key(restaurant_id, FREE_TABLES_KEY)
+            pipe = self.client.pipeline(transaction=True)
+            for number, free in tables.items():
+                pipe.setbit(key, number, 1 if free else 0)
+            pipe.incr(tenant_key(restaurant_id, FREE_TABLES_GENERATION_KEY))
+            pipe.execute()
             return True
         except Exception as e:
-            print(f"Ошибка инвалидации кеша столов: {e}")
+            print(f"Ошибка обновления карты свободных столов: {e}")
             return False
 
-    
-    def cache_order(self, order_id: int, order_data: Dict, ttl: int = 180) -> bool:
+    def reset_free_tables(self, restaurant_id: int) -> bool:
         if not self.is_available():
             return False
         try:
-            order_json = json.dumps(order_data, default=str)
-            self.client.setex(f"order:{order_id}", ttl, order_json)
+            pipe = self.client.pipeline(transaction=True)
+            pipe.delete(tenant_key(restaurant_id, FREE_TABLES_KEY))
+            pipe.incr(tenant_key(restaurant_id, FREE_TABLES_GENERATION_KEY))
+            pipe.execute()
             return True
         except Exception as e:
-            print(f"Ошибка кеширования заказа {order_id}: {e}")
+            print(f"Ошибка сброса карты свободных столов: {e}")
             return False
-    
-    def get_cached_order(self, order_id: int) -> Optional[Dict]:
+
+    def is_table_free(self, restaurant_id: int, number: int) -> Optional[bool]:
+        """Свободен ли стол; None, если карта не построена или Redis недоступен."""
         if not self.is_available():
             return None
         try:
-            cached = self.client.get(f"order:{order_id}")
-            if cached:
-                return json.loads(cached)
+            built, free = (
+                self.client.bitfield(tenant_key(restaurant_id, FREE_TABLES_KEY))
+                .get("u1", 0)
+                .get("u1", number)
+                .execute()
+            )
+            return bool(free) if built else None
         except Exception as e:
-            print(f"Ошибка получения заказа {order_id} из кеша: {e}")
-        return None
-    
-    def invalidate_order_cache(self, order_id: int) -> bool:
+            print(f"Ошибка чтения карты свободных столов: {e}")
+            return None
+
+    def first_free_table(self, restaurant_id: int) -> Optional[int]:
+        """Номер первого свободного стола, -1 если свободных нет, None если карта не построена."""
+        if not self.is_available():
+            return None
+        try:
+            key = tenant_key(restaurant_id, FREE_TABLES_KEY)
+            pipe = self.client.pipeline(transaction=False)
+            pipe.getbit(key, 0)
+            pipe.bitpos(key, 1, 1, -1, "BIT")
+            built, number = pipe.execute()
+            return number if built else None
+        except Exception as e:
+            print(f"Ошибка чтения карты свободных столов: {e}")
+            return None
+
+    def get_cached_orders(self, restaurant_id: int, keys: List[str]) -> List[Optional[Any]]:
+        """Значения ключей кеша заказов по порядку; промах и метка инвалидации дают None"""
+        if not keys or not self.is_available():
+            return [None] * len(keys)
+        try:
+            values = self.client.mget([tenant_key(restaurant_id, key) for key in keys])
+            return [json.loads(value) if value and value != ORDER_CACHE_TOMBSTONE else None for value in values]
+        except Exception as e:
+            print(f"Ошибка получения заказов из кеша: {e}")
+            return [None] * len(keys)
+
+    def cache_orders(self, restaurant_id: int, entries: Dict[str, Any], ttl: int = ORDER_CACHE_TTL) -> bool:
+        """Заполняет промахи. SET NX не перезаписывает метку инвалидации: ответ,
+        собранный из БД до коммита изменения, не попадет в кеш после его инвалидации"""
+        if not entries:
+            return True
         if not self.is_available():
             return False
         try:
-            self.client.delete(f"order:{order_id}")
+            pipe = self.client.pipeline(transaction=False)
+            for key, data in entries.items():
+                pipe.set(tenant_key(restaurant_id, key), json.dumps(data, default=str), nx=True, ex=ttl)
+            pipe.execute()
             return True
         except Exception as e:
-            print(f"Ошибка инвалидации кеша заказа {order_id}: {e}")
+            print(f"Ошибка кеширования заказов: {e}")
             return False
-    
-    def invalidate_all_orders_cache(self) -> bool:
+
+    def invalidate_orders_cache(self, restaurant_id: int, order_ids: List[int], waiter_ids: List[int] = ()) -> bool:
+        keys = [order_cache_key(order_id) for order_id in order_ids]
+        keys += [waiter_orders_cache_key(waiter_id) for waiter_id in waiter_ids]
+        if not keys:
+            return True
+        if not self.is_available():
+            return False
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for key in keys:
+                pipe.set(tenant_key(restaurant_id, key), ORDER_CACHE_TOMBSTONE, ex=ORDER_CACHE_TOMBSTONE_SECONDS)
+            pipe.execute()
+            return True
+        except Exception as e:
+            print(f"Ошибка инвалидации кеша заказов: {e}")
+            return False
+
+    def invalidate_all_orders_cache(self, restaurant_id: int) -> bool:
         if not self.is_available():
             return False
         try:
-            keys = self.client.keys("order:*")
-            if keys:
-                self.client.delete(*keys)
+            # Под шаблон попадают и списки заказов официантов
+            self._delete_pattern(tenant_key(restaurant_id, "order:*"))
             return True
         except Exception as e:
             print(f"Ошибка инвалидации кеша всех заказов: {e}")
@@ -192,70 +609,349 @@ class RedisClient:
             print(f"Ошибка проверки rate limit: {e}")
             return True, max_requests
 
-    def increment_dish_views(self, dish_id: int) -> bool:
+    def record_dish_orders(self, restaurant_id: int, orders: Dict[int, Dict[int, int]],
+                           hour: Optional[int] = None) -> bool:
+        """Учитывает заказанные количества блюд в бакете часа заказа (по умолчанию текущего).
+
+        orders - количества по id событий outbox (RECORD_DISH_ORDERS_SCRIPT): событие,
+        учтенное в прошлой доставке, второй раз не прибавляется. Правка или удаление заказа
+        меняет бакет часа, в котором заказ учтен; час старше самого длинного окна пропускается.
+        """
+        current_hour = _current_hour()
+        if hour is None:
+            hour = current_hour
+        orders = {event_id: {dish_id: quantity for dish_id, quantity in quantities.items() if quantity}
+                  for event_id, quantities in orders.items()}
+        if not any(orders.values()) or hour <= current_hour - POPULAR_WINDOWS["week"]:
+            return True
         if not self.is_available():
             return False
         try:
-            self.client.incr(f"stats:dish:{dish_id}:views")
+            # Бакет прошлого часа живет столько же, сколько прожил бы, если бы писался в свой час
+            ttl = POPULAR_BUCKET_TTL - (current_hour - hour) * 3600
+            args = [ttl, int(time.time()), APPLIED_EVENTS_SECONDS]
+            for event_id, quantities in orders.items():
+                args += [event_id, len(quantities)]
+                for dish_id, quantity in quantities.items():
+                    args += [dish_id, quantity]
+            self.client.register_script(RECORD_DISH_ORDERS_SCRIPT)(
+                keys=[_popular_bucket_key(restaurant_id, hour),
+                      tenant_key(restaurant_id, "stats:popular:applied")],
+                args=args,
+            )
             return True
         except Exception as e:
-            print(f"Ошибка увеличения счетчика просмотров блюда {dish_id}: {e}")
+            print(f"Ошибка учета популярности блюд: {e}")
             return False
-    
-    def get_dish_views(self, dish_id: int) -> int:
-        if not self.is_available():
-            return 0
-        try:
-            views = self.client.get(f"stats:dish:{dish_id}:views")
-            return int(views) if views else 0
-        except:
-            return 0
-    
-    def get_popular_dishes(self, limit: int = 10) -> List[Tuple[int, int]]:
+
+    def get_popular_dishes(self, restaurant_id: int, window: str = "day", limit: int = 10) -> List[Tuple[int, int]]:
+        """Top-K блюд за окно: объединение почасовых бакетов через ZUNIONSTORE.
+
+        Объединенный набор кешируется на POPULAR_UNION_TTL секунд, поэтому
+        повторные запросы обходятся одним ZREVRANGE.
+        """
         if not self.is_available():
             return []
         try:
-            keys = self.client.keys("stats:dish:*:views")
-            dishes = []
-            for key in keys:
-                dish_id = int(key.split(":")[2])
-                views = int(self.client.get(key) or 0)
-                dishes.append((dish_id, views))
-
-            dishes.sort(key=lambda x: x[1], reverse=True)
-            return dishes[:limit]
+            hours = POPULAR_WINDOWS[window]
+            current_hour = _current_hour()
+            union_key = tenant_key(restaurant_id, f"stats:popular:{window}:{current_hour}")
+            if not self.client.exists(union_key):
+                buckets = [_popular_bucket_key(restaurant_id, h) for h in range(current_hour - hours + 1, current_hour + 1)]
+                pipe = self.client.pipeline()
+                pipe.zunionstore(union_key, buckets)
+                # Правки заказов вносят отрицательные дельты, нулевые и меньше не показываем
+                pipe.zremrangebyscore(union_key, "-inf", 0)
+                pipe.expire(union_key, POPULAR_UNION_TTL)
+                pipe.execute()
+            ranking = self.client.zrevrange(union_key, 0, limit - 1, withscores=True)
+            return [(int(dish_id), int(score)) for dish_id, score in ranking]
         except Exception as e:
             print(f"Ошибка получения популярных блюд: {e}")
             return []
 
+    def get_idempotent_response(self, key: str) -> Optional[Dict]:
+        if not self.is_available():
+            return None
+        try:
+            cached = self.client.get(f"idem:{key}")
+            if cached:
+                return json.loads(cached)
+        except Exception as e:
+            print(f"Ошибка получения сохраненного ответа {key}: {e}")
+        return None
+
+    def acquire_idempotency_lock(self, key: str) -> Optional[bool]:
+        """True - ключ захвачен, False - запрос с этим ключом уже выполняется, None - Redis недоступен."""
+        if not self.is_available():
+            return None
+        try:
+            return bool(self.client.set(f"idem:{key}:lock", 1, nx=True, ex=IDEMPOTENCY_LOCK_TTL))
+        except Exception as e:
+            print(f"Ошибка блокировки ключа идемпотентности {key}: {e}")
+            return None
+
+    def store_idempotent_response(self, key: str, response: Dict, ttl: int) -> bool:
+        if not self.is_available():
+            return False
+        try:
+            pipe = self.client.pipeline()
+            pipe.setex(f"idem:{key}", ttl, json.dumps(response))
+            pipe.delete(f"idem:{key}:lock")
+            pipe.execute()
+            return True
+        except Exception as e:
+            print(f"Ошибка сохранения ответа {key}: {e}")
+            return False
+
+    def release_idempotency_lock(self, key: str) -> bool:
+        if not self.is_available():
+            return False
+        try:
+            self.client.delete(f"idem:{key}:lock")
+            return True
+        except Exception as e:
+            print(f"Ошибка снятия блокировки ключа идемпотентности {key}: {e}")
+            return False
+
+    def publish_kitchen_events(self, restaurant_id: int, events: List[Tuple[str, Dict]]) -> bool:
+        """Добавляет события в поток кухни и обновляет проекцию очереди одной транзакцией."""
+        if not events:
+            return True
+        if not self.is_available():
+            return False
+        try:
+            items_key = tenant_key(restaurant_id, KITCHEN_ITEMS_KEY)
+            pipe = self.client.pipeline()
+            for event_type, item in events:
+                item_json = json.dumps(item, default=str)
+                if event_type in KITCHEN_REMOVAL_EVENTS:
+                    pipe.hdel(items_key, item["item_id"])
+                else:
+                    pipe.hset(items_key, item["item_id"], item_json)
+                pipe.xadd(
+                    tenant_key(restaurant_id, KITCHEN_EVENTS_STREAM),
+                    {"type": event_type, "item": item_json},
+                    maxlen=KITCHEN_STREAM_MAXLEN,
+                    approximate=True,
+                )
+            pipe.execute()
+            return True
+        except Exception as e:
+            print(f"Ошибка публикации событий кухни: {e}")
+            return False
+
+    def replace_kitchen_queue(self, restaurant_id: int, items: List[Dict]) -> bool:
+        """Перестраивает проекцию очереди целиком; экраны получают событие reset."""
+        if not self.is_available():
+            return False
+        try:
+            items_key = tenant_key(restaurant_id, KITCHEN_ITEMS_KEY)
+            pipe = self.client.pipeline()
+            pipe.delete(items_key)
+            if items:
+                pipe.hset(items_key, mapping={
+                    item["item_id"]: json.dumps(item, default=str) for item in items
+                })
+            pipe.xadd(tenant_key(restaurant_id, KITCHEN_EVENTS_STREAM), {"type": "reset"},
+                      maxlen=KITCHEN_STREAM_MAXLEN, approximate=True)
+            pipe.execute()
+            return True
+        except Exception as e:
+            print(f"Ошибка перестроения очереди кухни: {e}")
+            return False
+
+    def has_kitchen_queue(self, restaurant_id: int) -> bool:
+        if not self.is_available():
+            return False
+        try:
+            return bool(self.client.exists(tenant_key(restaurant_id, KITCHEN_ITEMS_KEY),
+                                           tenant_key(restaurant_id, KITCHEN_EVENTS_STREAM)))
+        except Exception as e:
+            print(f"Ошибка проверки очереди кухни: {e}")
+            return False
+
+    def get_kitchen_queue(self, restaurant_id: int) -> Optional[Tuple[List[Dict], str]]:
+        """Снимок очереди и id последнего события, прочитанные атомарно.
+
+        Экран применяет события после этого id поверх снимка и не пропускает изменений.
+        """
+        if not self.is_available():
+            return None
+        try:
+            pipe = self.client.pipeline()
+            pipe.hvals(tenant_key(restaurant_id, KITCHEN_ITEMS_KEY))
+            pipe.xrevrange(tenant_key(restaurant_id, KITCHEN_EVENTS_STREAM), count=1)
+            items_json, last = pipe.execute()
+            last_event_id = last[0][0] if last else "0-0"
+            return [json.loads(item) for item in items_json], last_event_id
+        except Exception as e:
+            print(f"Ошибка получения очереди кухни: {e}")
+            return None
+
+    def read_kitchen_events(self, restaurant_id: int, screen: str, after: Optional[str] = None, count: int = 100,
+                            block_ms: int = 0) -> Optional[List[Tuple[str, Dict]]]:
+        """Читает новые события для экрана через его consumer group.
+
+        Группа хранит позицию экрана в потоке, поэтому переподключившийся экран
+        продолжает с того места, где остановился; after (last_event_id снимка очереди)
+        переставляет позицию. NOACK: повторная доставка не нужна, после сбоя экран
+        перечитывает снимок очереди.
+        """
+        if not self.is_available():
+            return None
+        stream = tenant_key(restaurant_id, KITCHEN_EVENTS_STREAM)
+        group = f"screen:{screen}"
+        try:
+            try:
+                self.client.xgroup_create(stream, group, id=after or "$", mkstream=True)
+            except redis.ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+                if after:
+                    self.client.xgroup_setid(stream, group, id=after)
+            response = self.client.xreadgroup(
+                group, screen, {stream: ">"},
+                count=count, block=block_ms or None, noack=True,
+            )
+            events = []
+            for _, entries in response or []:
+                for event_id, fields in entries:
+                    item = fields.get("item")
+                    events.append((event_id, {"type": fields.get("type"), "item": json.loads(item) if item else None}))
+            return events
+        except Exception as e:
+            print(f"Ошибка чтения событий кухни для экрана {screen}: {e}")
+            return None
+
     
-    def clear_all_cache(self) -> bool:
+    def take_stock(self, restaurant_id: int, quantities: Dict[int, int],
+                   force: bool = False) -> Optional[Union[int, Tuple[int, int]]]:
+        """Атомарно списывает порции блюд (TAKE_STOCK_SCRIPT). 0 - списано,
+        (id блюда, остаток) - не хватило, STOCK_NOT_LOADED - счетчики не заполнены, None - Redis недоступен"""
+        if not self.is_available():
+            return None
+        try:
+            args = ["1" if force else "0", STOCK_LOADED_FIELD]
+            for dish_id, quantity in quantities.items():
+                args += [dish_id, quantity]
+            result = self.client.register_script(TAKE_STOCK_SCRIPT)(
+                keys=[tenant_key(restaurant_id, STOCK_KEY)], args=args
+            )
+            return tuple(int(value) for value in result) if isinstance(result, list) else int(result)
+        except Exception as e:
+            print(f"Ошибка списания остатков блюд: {e}")
+            return None
+
+    def catch_up_stock(self, restaurant_id: int, takes: Dict[int, Dict[int, int]]) -> bool:
+        """Применяет списания, записанные без Redis (CATCH_UP_STOCK_SCRIPT).
+
+        takes - количества по id событий outbox take_stock: событие, примененное в прошлой
+        доставке или уже учтенное заполнением счетчиков (seed_stock), не списывается повторно.
+        """
+        if not takes:
+            return True
+        if not self.is_available():
+            return False
+        try:
+            args = [STOCK_LOADED_FIELD, int(time.time()), APPLIED_EVENTS_SECONDS]
+            for event_id, quantities in takes.items():
+                args += [event_id, len(quantities)]
+                for dish_id, quantity in quantities.items():
+                    args += [dish_id, quantity]
+            self.client.register_script(CATCH_UP_STOCK_SCRIPT)(
+                keys=[tenant_key(restaurant_id, STOCK_KEY), tenant_key(restaurant_id, STOCK_APPLIED_KEY)],
+                args=args,
+            )
+            return True
+        except Exception as e:
+            print(f"Ошибка догоняющего списания остатков: {e}")
+            return False
+
+    def seed_stock(self, restaurant_id: int, stock: Dict[int, int], applied_event_ids: List[int] = ()) -> bool:
+        """Заполняет счетчики остатков из БД, если их еще никто не заполнил (SEED_STOCK_SCRIPT).
+
+        applied_event_ids - события take_stock, списания которых уже вошли в stock.
+        """
+        if not self.is_available():
+            return False
+        try:
+            args = [STOCK_LOADED_FIELD, int(time.time()), APPLIED_EVENTS_SECONDS, len(stock)]
+            for dish_id, left in stock.items():
+                args += [dish_id, left]
+            self.client.register_script(SEED_STOCK_SCRIPT)(
+                keys=[tenant_key(restaurant_id, STOCK_KEY), tenant_key(restaurant_id, STOCK_APPLIED_KEY)],
+                args=[*args, *applied_event_ids],
+            )
+            return True
+        except Exception as e:
+            print(f"Ошибка заполнения остатков блюд: {e}")
+            return False
+
+    def set_stock(self, restaurant_id: int, stocks: Dict[int, Tuple[int, Optional[int], int]]) -> bool:
+        """Применяет новые остатки блюд (SET_STOCK_SCRIPT).
+
+        stocks - (id блюда, остаток, разница) по id событий outbox set_stock: как и в
+        catch_up_stock, событие применяется один раз. Незаполненные счетчики не меняются -
+        заполнение из Postgres уже возьмет новый остаток.
+        """
+        if not stocks:
+            return True
+        if not self.is_available():
+            return False
+        try:
+            args = [STOCK_LOADED_FIELD, int(time.time()), APPLIED_EVENTS_SECONDS]
+            for event_id, (dish_id, stock, delta) in stocks.items():
+                args += [event_id, dish_id, "" if stock is None else stock, delta]
+            self.client.register_script(SET_STOCK_SCRIPT)(
+                keys=[tenant_key(restaurant_id, STOCK_KEY), tenant_key(restaurant_id, STOCK_APPLIED_KEY)],
+                args=args,
+            )
+            return True
+        except Exception as e:
+            print(f"Ошибка установки остатка блюда: {e}")
+            return False
+
+    def get_stock(self, restaurant_id: int) -> Optional[Dict[int, int]]:
+        """Текущие остатки учитываемых блюд; None - счетчики не заполнены или Redis недоступен"""
+        if not self.is_available():
+            return None
+        try:
+            stock = self.client.hgetall(tenant_key(restaurant_id, STOCK_KEY))
+            if STOCK_LOADED_FIELD not in stock:
+                return None
+            return {int(dish_id): int(left) for dish_id, left in stock.items() if dish_id != STOCK_LOADED_FIELD}
+        except Exception as e:
+            print(f"Ошибка чтения остатков блюд: {e}")
+            return None
+
+    def clear_all_cache(self, restaurant_id: int) -> bool:
         if not self.is_available():
             return False
         try:
-            # Удаляем только наши ключи, не трогая системные
-            patterns = ["dishes:*", "tables:*", "order:*", "stats:*"]
-            for pattern in patterns:
-                keys = self.client.keys(pattern)
-                if keys:
-                    self.client.delete(*keys)
+            # Удаляем только кеши ресторана, не трогая системные ключи и другие рестораны
+            for pattern in ["dishes:*", "tables:*", "order:*", "stats:*"]:
+                self._delete_pattern(tenant_key(restaurant_id, pattern))
             return True
         except Exception as e:
             print(f"Ошибка очистки кеша: {e}")
             return False
     
-    def get_cache_info(self) -> Dict[str, Any]:
+    def get_cache_info(self, restaurant_id: int) -> Dict[str, Any]:
         if not self.is_available():
             return {"status": "unavailable"}
         
         try:
             info = {
                 "status": "available",
-                "dishes_cached": self.client.exists("dishes:all"),
-                "tables_cached": self.client.exists("tables:all"),
-                "available_tables_cached": self.client.exists("tables:available"),
-                "cached_orders_count": len(self.client.keys("order:*")),
-                "stats_keys_count": len(self.client.keys("stats:*"))
+                "dishes_cached": self.client.exists(tenant_key(restaurant_id, "dishes:all")),
+                "tables_cached": self.client.exists(tenant_key(restaurant_id, "tables:all")),
+                "available_tables_cached": self.client.exists(tenant_key(restaurant_id, "tables:available")),
+                "cached_orders_count": sum(1 for _ in self.client.scan_iter(match=tenant_key(restaurant_id, "order:[0-9]*"))),
+                "cached_waiter_lists_count": sum(
+                    1 for _ in self.client.scan_iter(match=tenant_key(restaurant_id, "order:waiter:*"))
+                ),
+                "stats_keys_count": sum(1 for _ in self.client.scan_iter(match=tenant_key(restaurant_id, "stats:*")))
             }
             return info
         except Exception as e:
@@ -0,0 +1,67 @@
+"""
+Бронирование столов. Бронь занимает стол на полуинтервал [starts_at, ends_at), а
+свободные на интервал столы ищутся одним запросом: столы ресторана нужной вместимости
+без пересекающейся брони (NOT EXISTS по индексу ix_reservations_table_ends, который
+читает только еще не закончившиеся брони стола). В Postgres пересечения броней одного
+стола дополнительно запрещает ограничение-исключение ex_reservations_table_time
+"""
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import exists, select
+from sqlalchemy.orm import Session
+
+import models
+
+
+Reservation, Table = models.Reservation, models.Table
+
+# Сколько обычно занимает стол гость без брони: стол нельзя занять заказом,
+# если на него есть бронь, начинающаяся раньше
+SEATING_MINUTES = 90
+
+
+def overlapping(starts_at: datetime, ends_at: datetime):
+    """Условие пересечения брони с полуинтервалом [starts_at, ends_at)"""
+    return Reservation.starts_at < ends_at, Reservation.ends_at > starts_at
+
+
+def free_tables_query(restaurant_id: int, starts_at: datetime, ends_at: datetime, guests: int = 1):
+    """Столы ресторана не меньше чем на guests мест без броней на интервал, меньшие столы первыми"""
+    booked = exists().where(
+        Reservation.restaurant_id == Table.restaurant_id,
+        Reservation.table_number == Table.number,
+        *overlapping(starts_at, ends_at),
+    )
+    return (
+        select(Table)
+        .where(Table.restaurant_id == restaurant_id, Table.seats >= guests, ~booked)
+        .order_by(Table.seats, Table.number)
+    )
+
+
+def free_tables(db: Session, restaurant_id: int, starts_at: datetime, ends_at: datetime,
+                guests: int = 1) -> List[Table]:
+    return list(db.scalars(free_tables_query(restaurant_id, starts_at, ends_at, guests)))
+
+
+def conflicting(db: Session, restaurant_id: int, table_number: int, starts_at: datetime, ends_at: datetime,
+                ignore_id: Optional[int] = None) -> Optional[Reservation]:
+    """Первая бронь стола, пересекающаяся с интервалом"""
+    query = select(Reservation).where(
+        Reservation.restaurant_id == restaurant_id,
+        Reservation.table_number == table_number,
+        *overlapping(starts_at, ends_at),
+    )
+    if ignore_id is not None:
+        query = query.where(Reservation.id != ignore_id)
+    return db.scalars(query.order_by(Reservation.starts_at).limit(1)).first()
+
+
+def blocking_order(db: Session, restaurant_id: int, table_number: int, reservation_id: Optional[int] = None,
+                   now: Optional[datetime] = None) -> Optional[Reservation]:
+    """Бронь, из-за которой стол нельзя занять новым заказом сейчас: идущая или начинающаяся
+    в ближайшие SEATING_MINUTES. Бронь reservation_id не мешает - это ее гости пришли"""
+    now = now or datetime.now(timezone.utc)
+    return conflicting(db, restaurant_id, table_number, now, now + timedelta(minutes=SEATING_MINUTES),
+                       ignore_id=reservation_id)
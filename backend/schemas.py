@@ -1,13 +1,35 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from typing import List, Optional
 
 from pydantic import BaseModel, validator
 
+from models import DEFAULT_TABLE_SEATS, MAX_TABLES
+
+
+# Сколько заказов можно закрыть или удалить одним групповым запросом
+MAX_BULK_ORDERS = 1000
+# Самый большой стол (банкетный) и самая длинная бронь
+MAX_TABLE_SEATS = 100
+MAX_RESERVATION_HOURS = 12
+
+
+USER_ROLES = ["admin", "waiter", "kitchen"]
+# Участки кухни; кухонный экран называется по своему участку
+KITCHEN_STATIONS = ["hot", "cold", "grill", "bar", "dessert"]
+
+
+def validate_user_role(v: str) -> str:
+    if v not in USER_ROLES:
+        raise ValueError("Role must be one of 'admin', 'waiter' or 'kitchen'")
+    return v
+
 
 class UserCreate(BaseModel):
+    """Ресторан пользователя задает токен администратора или приглашение, а не тело запроса"""
     username: str
     password: str
-    role: str
+    role: str = "waiter"
+    invite: Optional[str] = None
 
     @validator("username")
     def validate_username(cls, v: str) -> str:
@@ -27,23 +49,46 @@ class UserCreate(BaseModel):
             raise ValueError("Password must be at least 4 characters")
         return v
 
-    @validator("role")
-    def validate_role(cls, v: str) -> str:
-        if v not in ["admin", "waiter"]:
-            raise ValueError("Role must be either 'admin' or 'waiter'")
-        return v
+    _validate_role = validator("role", allow_reuse=True)(validate_user_role)
 
 
 class UserResponse(BaseModel):
     id: int
     username: str
     role: str
+    restaurant_id: int = 1
+
+
+class InviteCreate(BaseModel):
+    role: str = "waiter"
+
+    _validate_role = validator("role", allow_reuse=True)(validate_user_role)
+
+
+class InviteResponse(BaseModel):
+    invite: str
+    role: str
+    expires_at: datetime
+
+
+class RestaurantCreate(BaseModel):
+    """Новый ресторан и его первый администратор (роль в admin не учитывается);
+    id по умолчанию - следующий свободный"""
+    admin: UserCreate
+    restaurant_id: Optional[int] = None
+
+    @validator("restaurant_id")
+    def validate_restaurant_id(cls, v: Optional[int]) -> Optional[int]:
+        if v is not None and v < 1:
+            raise ValueError("Restaurant id must be positive")
+        return v
 
 
 class DishCreate(BaseModel):
     name: str
     description: str
     price: float
+    station: str = "hot"
 
     @validator("name")
     def validate_name(cls, v: str) -> str:
@@ -61,6 +106,23 @@ class DishCreate(BaseModel):
             raise ValueError("Price is too high")
         return round(v, 2)
 
+    @validator("station")
+    def validate_station(cls, v: str) -> str:
+        if v not in KITCHEN_STATIONS:
+            raise ValueError(f"Station must be one of: {', '.join(KITCHEN_STATIONS)}")
+        return v
+
+
+class DishStockUpdate(BaseModel):
+    # None - остаток блюда больше не учитывается
+    stock: Optional[int] = None
+
+    @validator("stock")
+    def validate_stock(cls, v: Optional[int]) -> Optional[int]:
+        if v is not None and v < 0:
+            raise ValueError("Stock cannot be negative")
+        return v
+
 
 class DishResponse(BaseModel):
     id: int
@@ -68,6 +130,7 @@ class DishResponse(BaseModel):
     description: str
     price: float
     available: bool
+    station: str = "hot"
 
 
 class OrderItemCreate(BaseModel):
@@ -89,11 +152,20 @@ class OrderItemResponse(BaseModel):
     dish_name: str
     dish_price: float
     quantity: int
+    prep_status: str = "queued"
+
+
+class PopularDishResponse(BaseModel):
+    dish_id: int
+    dish_name: str
+    quantity: int
 
 
 class OrderCreate(BaseModel):
     table_number: int
     items: List[OrderItemCreate]
+    # Гости пришли по этой брони: она не мешает занять стол
+    reservation_id: Optional[int] = None
 
 
 class OrderResponse(BaseModel):
@@ -105,6 +177,42 @@ class OrderResponse(BaseModel):
     waiter_id: int
     waiter_name: str
     items: List[OrderItemResponse]
+    # Рубли; хранится в копейках (Order.total_amount)
+    total_amount: float = 0
+
+
+class KitchenItemResponse(BaseModel):
+    item_id: int
+    order_id: int
+    order_code: Optional[str] = None
+    table_number: int
+    dish_id: int
+    dish_name: str
+    station: str
+    quantity: int
+    status: str
+    queued_at: Optional[datetime] = None
+
+
+class KitchenStationResponse(BaseModel):
+    station: str
+    items: List[KitchenItemResponse]
+
+
+class KitchenQueueResponse(BaseModel):
+    last_event_id: str
+    stations: List[KitchenStationResponse]
+
+
+class KitchenEventResponse(BaseModel):
+    id: str
+    type: str
+    item: Optional[KitchenItemResponse] = None
+
+
+class KitchenEventsResponse(BaseModel):
+    last_event_id: str
+    events: List[KitchenEventResponse]
 
 
 class OrderUpdate(BaseModel):
@@ -113,11 +221,109 @@ class OrderUpdate(BaseModel):
     items: Optional[List[OrderItemCreate]] = None
 
 
+class OrderBulkDelete(BaseModel):
+    order_ids: List[int]
+
+    @validator("order_ids")
+    def validate_order_ids(cls, v: List[int]) -> List[int]:
+        if not v:
+            raise ValueError("order_ids cannot be empty")
+        if len(v) > MAX_BULK_ORDERS:
+            raise ValueError(f"order_ids cannot exceed {MAX_BULK_ORDERS} orders")
+        return sorted(set(v))
+
+
+class OrderBulkStatus(OrderBulkDelete):
+    status: str
+
+    @validator("status")
+    def validate_status(cls, v: str) -> str:
+        if not v or len(v.strip()) == 0:
+            raise ValueError("Status cannot be empty")
+        if len(v) > 20:
+            raise ValueError("Status cannot exceed 20 characters")
+        return v.strip()
+
+
 class TableResponse(BaseModel):
     id: int
     number: int
     is_available: bool
     current_order_id: Optional[int]
+    # Значение по умолчанию - для записей кеша, сохраненных до появления вместимости
+    seats: int = DEFAULT_TABLE_SEATS
+
+
+class TableSeatsUpdate(BaseModel):
+    seats: int
+
+    @validator("seats")
+    def validate_seats(cls, v: int) -> int:
+        if v < 1:
+            raise ValueError("Seats must be positive")
+        if v > MAX_TABLE_SEATS:
+            raise ValueError(f"Seats cannot exceed {MAX_TABLE_SEATS}")
+        return v
+
+
+class FreeTableResponse(BaseModel):
+    number: int
+    seats: int
+
+
+def as_utc(value: datetime) -> datetime:
+    # Время без зоны считается UTC: в SQLite брони хранятся без зоны и сравниваются как строки
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+class ReservationCreate(BaseModel):
+    table_number: int
+    guest_name: str
+    guests: int
+    starts_at: datetime
+    ends_at: datetime
+
+    @validator("guest_name")
+    def validate_guest_name(cls, v: str) -> str:
+        if not v or len(v.strip()) == 0:
+            raise ValueError("Guest name cannot be empty")
+        if len(v) > 100:
+            raise ValueError("Guest name cannot exceed 100 characters")
+        return v.strip()
+
+    @validator("guests")
+    def validate_guests(cls, v: int) -> int:
+        if v < 1:
+            raise ValueError("Guests must be positive")
+        if v > MAX_TABLE_SEATS:
+            raise ValueError(f"Guests cannot exceed {MAX_TABLE_SEATS}")
+        return v
+
+    @validator("starts_at")
+    def validate_starts_at(cls, v: datetime) -> datetime:
+        return as_utc(v)
+
+    @validator("ends_at")
+    def validate_ends_at(cls, v: datetime, values) -> datetime:
+        v = as_utc(v)
+        starts_at = values.get("starts_at")
+        if starts_at is not None:
+            if v <= starts_at:
+                raise ValueError("Reservation must end after it starts")
+            if v - starts_at > timedelta(hours=MAX_RESERVATION_HOURS):
+                raise ValueError(f"Reservation cannot exceed {MAX_RESERVATION_HOURS} hours")
+        return v
+
+
+class ReservationResponse(BaseModel):
+    id: int
+    table_number: int
+    guest_name: str
+    guests: int
+    starts_at: datetime
+    ends_at: datetime
 
 
 class RestaurantConfigUpdate(BaseModel):
@@ -127,8 +333,8 @@ class RestaurantConfigUpdate(BaseModel):
     def validate_total_tables(cls, v: int) -> int:
         if v < 1:
             raise ValueError("количество столов не может быть меньше 1")
-        if v > 100:
-            raise ValueError("Количество столов не может превышать 100")
+        if v > MAX_TABLES:
+            raise ValueError(f"Количество столов не может превышать {MAX_TABLES}")
         return v
 
 
@@ -0,0 +1,69 @@
+"""
+Продакшен-запуск API: несколько процессов uvicorn под одним супервизором.
+Число воркеров берется из квоты CPU контейнера (cgroup v2 или v1), а не из
+числа ядер узла, которое видит os.cpu_count(). Воркеры запускаются через spawn
+и импортируют приложение заново, поэтому соединения с Postgres и Redis у каждого свои.
+
+    python serve.py main:app            # backend-api
+    python serve.py auth_service:app    # backend-auth
+
+SIGHUP перезапускает воркеры по одному (каждый сначала дорабатывает текущие запросы),
+SIGTERM завершает все с тем же ожиданием
+"""
+import math
+import os
+import sys
+from pathlib import Path
+from typing import Optional
+
+import uvicorn
+
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+GRACEFUL_TIMEOUT_SECONDS = int(os.getenv("GRACEFUL_TIMEOUT_SECONDS", "20"))
+
+
+def cgroup_cpu_limit(root: Path = Path("/sys/fs/cgroup")) -> Optional[float]:
+    """Квота CPU контейнера в ядрах или None, если она не задана."""
+    try:
+        # cgroup v2: "<quota> <period>" или "max <period>"
+        quota, period = (root / "cpu.max").read_text().split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        quota = int((root / "cpu" / "cpu.cfs_quota_us").read_text())
+        period = int((root / "cpu" / "cpu.cfs_period_us").read_text())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus(root: Path = Path("/sys/fs/cgroup")) -> int:
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    limit = cgroup_cpu_limit(root)
+    if limit is not None:
+        # Дробная квота округляется вниз: лишний воркер только упирается в троттлинг
+        cpus = min(cpus, math.floor(limit))
+    return max(1, cpus)
+
+
+def worker_count() -> int:
+    configured = os.getenv("WEB_CONCURRENCY")
+    return max(1, int(configured)) if configured else available_cpus()
+
+
+if __name__ == "__main__":
+    app = sys.argv[1] if len(sys.argv) > 1 else "main:app"
+    workers = worker_count()
+    # Воркеры наследуют окружение: database.py делит по нему пул соединений
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    print(f"Запуск {app}: {workers} воркеров на порту {PORT}")
+    uvicorn.run(
+        app,
+        host=HOST,
+        port=PORT,
+        workers=workers,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT_SECONDS,
+    )
@@ -0,0 +1,156 @@
+"""
+Остатки блюд. Живой счетчик - поле хеша Redis r:{id}:stock: заказ списывает порции
+Lua-скриптом сразу по всем своим блюдам (хватает всех или не списывается ничего), поэтому
+запрос заказа не блокирует строки dishes. Списания записываются в outbox, и воркер переносит
+их в dishes.stock пачками, снимая с продажи закончившиеся блюда. Разницы остатков коммутируют,
+поэтому порядок событий в пачке не важен. Блюдо с stock = NULL не учитывается
+"""
+import json
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case, update
+from sqlalchemy.orm import Session
+
+import models
+from redis_client import redis_client, STOCK_NOT_LOADED
+
+
+Dish = models.Dish
+
+
+class OutOfStock(ValueError):
+    """Не хватает порций блюда на заказ"""
+
+    def __init__(self, dish_id: int, left: int):
+        super().__init__(f"Dish {dish_id} is out of stock: {max(left, 0)} left")
+        self.dish_id = dish_id
+        self.left = left
+
+
+def tracked_stock(db: Session, restaurant_id: int, dish_ids=None) -> Dict[int, int]:
+    """Остатки учитываемых блюд ресторана по данным Postgres"""
+    query = db.query(Dish.id, Dish.stock).filter(Dish.restaurant_id == restaurant_id, Dish.stock.isnot(None))
+    if dish_ids is not None:
+        query = query.filter(Dish.id.in_(dish_ids))
+    return dict(query.all())
+
+
+def pending_events(db: Session, restaurant_id: int) -> Tuple[Dict[int, int], List[int]]:
+    """Списания из outbox, которые воркер еще не перенес в dishes.stock, и id событий take_stock
+    и set_stock, еще не примененных к счетчикам Redis. Одним запросом: оба списка - из одного
+    снимка outbox"""
+    pending: Dict[int, int] = {}
+    caught_up: List[int] = []
+    for event_id, event_type, payload in db.query(
+        models.OutboxEvent.id, models.OutboxEvent.event_type, models.OutboxEvent.payload
+    ).filter(models.OutboxEvent.event_type.in_(["reconcile_stock", "take_stock", "set_stock"])):
+        payload = json.loads(payload)
+        if payload.get("restaurant_id", models.DEFAULT_RESTAURANT_ID) != restaurant_id:
+            continue
+        if event_type != "reconcile_stock":
+            caught_up.append(event_id)
+            continue
+        for dish_id, quantity in payload["quantities"].items():
+            pending[int(dish_id)] = pending.get(int(dish_id), 0) + quantity
+    return pending, caught_up
+
+
+def seed(db: Session, restaurant_id: int) -> bool:
+    """Заполняет счетчики Redis (после перезапуска Redis): остатки Postgres за вычетом
+    еще не перенесенных списаний. Outbox читается раньше dishes, поэтому событие, перенесенное
+    между чтениями, вычтется дважды: счетчик может оказаться меньше настоящего, но не больше.
+
+    Списание заказа без Redis (take_stock) уже входит в эти остатки - через dishes.stock или
+    через свое событие reconcile_stock, - как и новый остаток от администратора (set_stock),
+    поэтому такие ожидающие события отмечаются учтенными вместе с заполнением, и воркер не
+    применит их второй раз"""
+    pending, caught_up = pending_events(db, restaurant_id)
+    return redis_client.seed_stock(restaurant_id, {
+        dish_id: left - pending.get(dish_id, 0) for dish_id, left in tracked_stock(db, restaurant_id).items()
+    }, caught_up)
+
+
+def take(db: Session, restaurant_id: int, quantities: Dict[int, int]) -> Tuple[Dict[int, int], bool]:
+    """Списывает порции учитываемых блюд (отрицательное количество возвращает порции).
+    Возвращает списанное и признак, что оно уже учтено в Redis; при нехватке - OutOfStock"""
+    stock = tracked_stock(db, restaurant_id, [dish_id for dish_id, quantity in quantities.items() if quantity])
+    taken = {dish_id: quantities[dish_id] for dish_id in stock}
+    if not taken:
+        return {}, True
+
+    result = redis_client.take_stock(restaurant_id, taken)
+    if result == STOCK_NOT_LOADED:
+        seed(db, restaurant_id)
+        result = redis_client.take_stock(restaurant_id, taken)
+    if isinstance(result, tuple):
+        raise OutOfStock(*result)
+    if result == 0:
+        return taken, True
+
+    # Без Redis остатки проверяются по Postgres (без блокировки строк): воркер перенесет
+    # списание в счетчики, когда Redis вернется
+    for dish_id, quantity in taken.items():
+        if quantity > 0 and stock[dish_id] < quantity:
+            raise OutOfStock(dish_id, stock[dish_id])
+    return taken, False
+
+
+def give_back(restaurant_id: int, taken: Dict[int, int], counted: bool) -> None:
+    """Возвращает списанное в Redis, если заказ не записался"""
+    if taken and counted:
+        redis_client.take_stock(restaurant_id, {dish_id: -quantity for dish_id, quantity in taken.items()},
+                                force=True)
+
+
+def set_stock(db: Session, dish: models.Dish, value: Optional[int]) -> int:
+    """Задает остаток блюда (None - перестать учитывать); блюдо с остатком снова в продаже.
+    Возвращает разницу для живого счетчика: его меняет событие outbox set_stock после коммита.
+    Не коммитит"""
+    # Строка блюда заблокирована до коммита: воркер не перенесет списание между чтением outbox
+    # и записью остатка
+    db.refresh(dish, with_for_update=True)
+    delta = 0
+    if value is None or dish.stock is None:
+        dish.stock = value
+    else:
+        # Списания, которые воркер еще не перенес в Postgres, уже вычтены из живого остатка:
+        # после переноса dishes.stock станет value, а не value минус они
+        pending = pending_events(db, dish.restaurant_id)[0].get(dish.id, 0)
+        delta = value - (dish.stock - pending)
+        dish.stock = value + pending
+    if value is not None:
+        dish.available = value > 0
+    dish.sold_out = value is not None and value <= 0
+    return delta
+
+
+def reconcile(db: Session, restaurant_id: int, quantities: Dict[int, int]) -> List[int]:
+    """Переносит списания пачки в dishes.stock одним UPDATE, снимает с продажи закончившиеся
+    блюда и возвращает в продажу снятые так блюда, которым возвраты снова дали остаток.
+    Возвращает id блюд, у которых изменилась доступность; не коммитит"""
+    if not quantities:
+        return []
+    db.execute(
+        update(Dish)
+        .where(Dish.restaurant_id == restaurant_id, Dish.id.in_(quantities), Dish.stock.isnot(None))
+        .values(stock=Dish.stock - case(quantities, value=Dish.id, else_=0))
+        .execution_options(synchronize_session=False)
+    )
+    changed = db.execute(
+        update(Dish)
+        .where(Dish.restaurant_id == restaurant_id, Dish.id.in_(quantities), Dish.stock <= 0,
+               Dish.available == True)
+        .values(available=False, sold_out=True)
+        .returning(Dish.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    # Блюда, снятые с продажи не остатком (например, импортом меню), не трогаются
+    changed += db.execute(
+        update(Dish)
+        .where(Dish.restaurant_id == restaurant_id, Dish.id.in_(quantities), Dish.stock > 0,
+               Dish.sold_out == True)
+        .values(available=True, sold_out=False)
+        .returning(Dish.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    return sorted(changed)
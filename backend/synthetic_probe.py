@@ -0,0 +1,120 @@
+"""
+Синтетическая проверка: проходит путь официанта через тот же API, что и фронтенд -
+вход, меню, создание заказа, правка позиций, завершение - и удаляет заказ за собой.
+Каждый шаг замеряется отдельно; результат записывает и сверяет с SLO health_monitor
+"""
+import time
+from typing import Dict, Optional
+
+import requests
+
+
+PROBE_STEPS = ["login", "load_menu", "create_order", "update_items", "complete_order", "delete_order"]
+
+
+class ProbeError(Exception):
+
+    def __init__(self, step: str, message: str, timings: Dict[str, float]):
+        super().__init__(f"{step}: {message}")
+        self.step = step
+        self.timings = timings
+
+
+class OrderProbe:
+    """Один прогон жизненного цикла заказа от имени служебного официанта.
+
+    Удалять заказы может только администратор, поэтому уборка идет от отдельной
+    служебной учетной записи администратора. Обе учетные записи заводит администратор
+    ресторана заранее: проба их не регистрирует, а неверный пароль - ошибка шага login.
+    """
+
+    def __init__(self, session: requests.Session, base_url: str, waiter: Dict[str, str],
+                 admin: Dict[str, str], timeout: float = 5.0):
+        self.session = session
+        self.base_url = base_url.rstrip("/")
+        self.waiter = waiter
+        self.admin = admin
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, token: Optional[str] = None, **kwargs) -> requests.Response:
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        return self.session.request(method, f"{self.base_url}{path}", headers=headers, timeout=self.timeout, **kwargs)
+
+    def _login(self, account: Dict[str, str], role: str) -> str:
+        credentials = {"username": account["username"], "password": account["password"]}
+        response = self._request("POST", "/login", json=credentials)
+        if response.status_code == 401:
+            raise RuntimeError(f"{role} account '{account['username']}' is not provisioned or its password is wrong")
+        response.raise_for_status()
+        return response.json()["access_token"]
+
+    def run(self) -> Dict[str, float]:
+        """Возвращает время шагов в миллисекундах или бросает ProbeError с уже замеренными шагами."""
+        timings: Dict[str, float] = {}
+        order_id = None
+        deleted = False
+        step = PROBE_STEPS[0]
+
+        def timed(name: str, func):
+            nonlocal step
+            step = name
+            started = time.perf_counter()
+            result = func()
+            timings[name] = round((time.perf_counter() - started) * 1000, 2)
+            return result
+
+        def checked(response: requests.Response) -> requests.Response:
+            if not response.ok:
+                raise ProbeError(step, f"HTTP {response.status_code} {response.text[:200]}", timings)
+            return response
+
+        try:
+            token = timed("login", lambda: self._login(self.waiter, "waiter"))
+
+            def load_menu():
+                dishes = checked(self._request("GET", "/dishes", token)).json()
+                tables = checked(self._request("GET", "/tables/available", token)).json()
+                return [d for d in dishes if d.get("available")], tables
+
+            dishes, tables = timed("load_menu", load_menu)
+            if not dishes or not tables:
+                raise ProbeError(step, "no available dishes or free tables", timings)
+
+            # Последний свободный стол реже всего нужен залу
+            table_number = max(table["number"] for table in tables)
+            dish_id = dishes[0]["id"]
+
+            order = timed("create_order", lambda: checked(self._request(
+                "POST", "/orders", token,
+                json={"table_number": table_number, "items": [{"dish_id": dish_id, "quantity": 1}]},
+            )).json())
+            order_id = order["id"]
+
+            timed("update_items", lambda: checked(self._request(
+                "PUT", f"/orders/{order_id}", token, json={"items": [{"dish_id": dish_id, "quantity": 2}]},
+            )))
+            timed("complete_order", lambda: checked(self._request(
+                "PUT", f"/orders/{order_id}/status", token, params={"status": "completed"},
+            )))
+
+            # Вход администратора не замеряется, но его ошибка относится к удалению
+            step = "delete_order"
+            admin_token = self._login(self.admin, "admin")
+            timed("delete_order", lambda: checked(self._request("DELETE", f"/orders/{order_id}", admin_token)))
+            deleted = True
+            return timings
+        except ProbeError:
+            raise
+        except Exception as e:
+            raise ProbeError(step, str(e), timings)
+        finally:
+            if order_id is not None and not deleted:
+                self._cleanup(order_id)
+
+    def _cleanup(self, order_id: int) -> None:
+        try:
+            admin_token = self._login(self.admin, "admin")
+            self._request("DELETE", f"/orders/{order_id}", admin_token)
+        except Exception:
+            # Следующий прогон не зависит от этого заказа; он останется видимым администратору
+            pass
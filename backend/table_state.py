@@ -0,0 +1,37 @@
+"""
+Состояние столов ресторана в том виде, в каком его кеширует Redis и отдают
+/tables и /tables/available. После изменения столов outbox-воркер читает его
+из БД один раз и записывает в кеш (write-through), поэтому опросы реплик API
+не уходят в Postgres одновременно после каждой инвалидации
+"""
+from typing import Dict, List
+
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+from redis_client import redis_client
+
+
+def load_tables(db: Session, restaurant_id: int, available_only: bool = False) -> List[Dict]:
+    query = db.query(models.Table).filter(models.Table.restaurant_id == restaurant_id)
+    if available_only:
+        query = query.filter(models.Table.is_available == True)
+    return [
+        {"id": t.id, "number": t.number, "is_available": t.is_available, "current_order_id": t.current_order_id,
+         "seats": t.seats}
+        for t in query.order_by(models.Table.number)
+    ]
+
+
+def publish_tables(restaurant_id: int) -> bool:
+    # Версия увеличивается до чтения БД: заполнения кеша по более старым снимкам отбрасываются
+    version = redis_client.bump_tables_version(restaurant_id)
+    if version is None:
+        return False
+    db = SessionLocal()
+    try:
+        tables = load_tables(db, restaurant_id)
+    finally:
+        db.close()
+    return redis_client.publish_tables(restaurant_id, tables, version)
@@ -0,0 +1,212 @@
+"""
+Нагрузочный тест нескольких ресторанов на одном развертывании: каждый ресторан
+гоняет жизненный цикл заказа (те же шаги, что у synthetic_probe) в своем потоке.
+Вход выполняется один раз при подготовке, чтобы замерялись запросы к данным, а не bcrypt.
+Сначала прогон одного ресторана как базовая линия, затем всех сразу - задержки шагов
+не должны расти с числом ресторанов. В конце проверяется изоляция меню и кешей.
+
+    PROVISIONING_KEY=<ключ> python tenant_load_test.py --base-url http://localhost:8000 --tenants 50 --rounds 5
+
+Рестораны заводятся через POST /restaurants (ключ оператора, как у backend-api) с id
+от --first-restaurant-id, чтобы не трогать настоящие
+"""
+import argparse
+import math
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+
+DISHES_PER_RESTAURANT = 5
+LIFECYCLE_STEPS = ["load_menu", "create_order", "update_items", "complete_order", "delete_order"]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)] if ordered else 0.0
+
+
+def make_session(concurrency: int) -> requests.Session:
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency))
+    return session
+
+
+def accounts(restaurant_id: int, password: str) -> Dict[str, Dict]:
+    return {
+        role: {"username": f"load-{role}-{restaurant_id}", "password": password}
+        for role in ("waiter", "admin")
+    }
+
+
+def api(session: requests.Session, base_url: str, method: str, path: str, token: str, **kwargs) -> requests.Response:
+    response = session.request(method, f"{base_url}{path}", headers={"Authorization": f"Bearer {token}"},
+                                timeout=30, **kwargs)
+    response.raise_for_status()
+    return response
+
+
+def login(session: requests.Session, base_url: str, account: Dict) -> requests.Response:
+    return session.post(f"{base_url}/login", json=account, timeout=30)
+
+
+def login_or_create(session: requests.Session, base_url: str, account: Dict, create) -> str:
+    response = login(session, base_url, account)
+    if response.status_code == 401:
+        create().raise_for_status()
+        response = login(session, base_url, account)
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def dish_name(restaurant_id: int, number: int) -> str:
+    return f"Блюдо {restaurant_id}-{number}"
+
+
+def seed_restaurant(session: requests.Session, base_url: str, restaurant_id: int, password: str,
+                    provisioning_key: str) -> Dict[str, str]:
+    """Заводит ресторан с администратором и официанта, меню и возвращает токены."""
+    account = accounts(restaurant_id, password)
+    admin_token = login_or_create(session, base_url, account["admin"], lambda: session.post(
+        f"{base_url}/restaurants", json={"restaurant_id": restaurant_id, "admin": account["admin"]},
+        headers={"X-Provisioning-Key": provisioning_key}, timeout=30,
+    ))
+    waiter_token = login_or_create(session, base_url, account["waiter"], lambda: session.post(
+        f"{base_url}/register", json={**account["waiter"], "role": "waiter"},
+        headers={"Authorization": f"Bearer {admin_token}"}, timeout=30,
+    ))
+
+    existing = api(session, base_url, "GET", "/dishes", admin_token).json()
+    for number in range(len(existing) + 1, DISHES_PER_RESTAURANT + 1):
+        api(session, base_url, "POST", "/dishes", admin_token, json={
+            "name": dish_name(restaurant_id, number), "description": "", "price": 100,
+        })
+    return {"waiter": waiter_token, "admin": admin_token}
+
+
+def order_lifecycle(session: requests.Session, base_url: str, tokens: Dict[str, str],
+                    timings: Dict[str, List[float]]) -> None:
+    def timed(step: str, method: str, path: str, token: str, **kwargs) -> requests.Response:
+        started = time.perf_counter()
+        try:
+            return api(session, base_url, method, path, token, **kwargs)
+        finally:
+            timings[step].append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    dishes = timed("load_menu", "GET", "/dishes", tokens["waiter"]).json()
+    tables = api(session, base_url, "GET", "/tables/available", tokens["waiter"]).json()
+    dish_id, table_number = dishes[0]["id"], max(table["number"] for table in tables)
+
+    order_id = timed("create_order", "POST", "/orders", tokens["waiter"], json={
+        "table_number": table_number, "items": [{"dish_id": dish_id, "quantity": 1}],
+    }).json()["id"]
+    try:
+        timed("update_items", "PUT", f"/orders/{order_id}", tokens["waiter"],
+              json={"items": [{"dish_id": dish_id, "quantity": 2}]})
+        timed("complete_order", "PUT", f"/orders/{order_id}/status", tokens["waiter"], params={"status": "completed"})
+    finally:
+        timed("delete_order", "DELETE", f"/orders/{order_id}", tokens["admin"])
+    timings["total"].append((time.perf_counter() - started) * 1000)
+
+
+def run_phase(session: requests.Session, base_url: str, tokens: Dict[int, Dict[str, str]], rounds: int) -> Dict:
+    timings: Dict[str, List[float]] = defaultdict(list)
+    errors: List[str] = []
+
+    def restaurant_worker(restaurant_id: int) -> None:
+        for _ in range(rounds):
+            try:
+                order_lifecycle(session, base_url, tokens[restaurant_id], timings)
+            except Exception as e:
+                errors.append(f"{restaurant_id}: {e}")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(tokens)) as pool:
+        list(pool.map(restaurant_worker, tokens))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "lifecycles_per_second": (len(tokens) * rounds - len(errors)) / elapsed,
+        "steps": {step: (percentile(values, 0.5), percentile(values, 0.95)) for step, values in timings.items()},
+        "errors": errors,
+    }
+
+
+def check_isolation(session: requests.Session, base_url: str, tokens: Dict[int, Dict[str, str]]) -> List[str]:
+    """Меню ресторана содержит только его блюда; инвалидация меню одного ресторана не трогает кеш другого."""
+    problems = []
+    restaurant_ids = list(tokens)
+    for restaurant_id in restaurant_ids:
+        names = {dish["name"] for dish in session.get(f"{base_url}/dishes",
+                                                      params={"restaurant_id": restaurant_id}, timeout=10).json()}
+        foreign = {name for name in names if not name.startswith(f"Блюдо {restaurant_id}-")}
+        if foreign:
+            problems.append(f"restaurant {restaurant_id} sees foreign dishes: {sorted(foreign)[:3]}")
+
+    if len(restaurant_ids) > 1:
+        first, second = restaurant_ids[:2]
+        admin_token = tokens[first]["admin"]
+        # Прогрев кеша меню второго ресторана анонимным запросом, как у фронтенда
+        session.get(f"{base_url}/dishes", params={"restaurant_id": second}, timeout=10)
+        dish = api(session, base_url, "GET", "/dishes", admin_token).json()[0]
+        api(session, base_url, "PUT", f"/dishes/{dish['id']}", admin_token, json={
+            "name": dish["name"], "description": "изменено", "price": dish["price"],
+        })
+        # Инвалидацию выполняет outbox-воркер; кеш второго ресторана должен остаться на месте
+        time.sleep(2)
+        info = session.get(f"{base_url}/cache/info", params={"restaurant_id": second}, timeout=10).json()
+        if info.get("status") == "available" and not info.get("dishes_cached"):
+            problems.append(f"menu change in restaurant {first} evicted the menu cache of restaurant {second}")
+    return problems
+
+
+def print_phase(title: str, result: Dict) -> None:
+    print(f"\n{title}: {result['lifecycles_per_second']:.1f} lifecycles/s, {len(result['errors'])} errors")
+    for error in result["errors"][:5]:
+        print(f"  {error}")
+    print(f"{'step':<16}{'p50 ms':>10}{'p95 ms':>10}")
+    for step in LIFECYCLE_STEPS + ["total"]:
+        if step in result["steps"]:
+            p50, p95 = result["steps"][step]
+            print(f"{step:<16}{p50:>10.1f}{p95:>10.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест нескольких ресторанов")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--tenants", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--first-restaurant-id", type=int, default=1000)
+    parser.add_argument("--password", default="load-test")
+    parser.add_argument("--provisioning-key", default=os.getenv("PROVISIONING_KEY", ""))
+    args = parser.parse_args()
+
+    base_url = args.base_url.rstrip("/")
+    restaurant_ids = list(range(args.first_restaurant_id, args.first_restaurant_id + args.tenants))
+    session = make_session(args.tenants)
+
+    print(f"Подготовка {args.tenants} ресторанов...")
+    with ThreadPoolExecutor(max_workers=min(args.tenants, 10)) as pool:
+        tokens = dict(zip(restaurant_ids, pool.map(
+            lambda restaurant_id: seed_restaurant(session, base_url, restaurant_id, args.password,
+                                                  args.provisioning_key),
+            restaurant_ids,
+        )))
+
+    first = restaurant_ids[0]
+    print_phase("1 restaurant", run_phase(session, base_url, {first: tokens[first]}, args.rounds))
+    print_phase(f"{args.tenants} restaurants", run_phase(session, base_url, tokens, args.rounds))
+
+    problems = check_isolation(session, base_url, tokens)
+    print("\nisolation: " + ("ok" if not problems else "; ".join(problems)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+import os
+import sys
+from pathlib import Path
+
+# Модули backend импортируют друг друга по плоским именам (models, database, ...),
+# поэтому каталог backend должен быть в sys.path независимо от того, откуда запущен pytest.
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+# Без поднятого Redis клиент должен сразу получить отказ, а не ждать DNS-таймаута
+os.environ.setdefault("REDIS_HOST", "127.0.0.1")
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import archiver
+import models
+
+
+def make_session():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)()
+
+
+def test_archive_batch_moves_only_old_completed_orders():
+    """В архив уходят только старые выполненные заказы, не привязанные к столу."""
+    db = make_session()
+    old = datetime.now(timezone.utc) - timedelta(days=10)
+
+    waiter = models.User(username="waiter", password="x", role="waiter")
+    dish = models.Dish(name="Борщ", description="", price=5.5)
+    db.add_all([waiter, dish])
+    db.flush()
+
+    old_completed = models.Order(code="А001", table_number=1, status="completed", created_at=old, waiter_id=waiter.id)
+    old_pending = models.Order(code="А002", table_number=2, status="pending", created_at=old, waiter_id=waiter.id)
+    fresh_completed = models.Order(code="А003", table_number=3, status="completed", waiter_id=waiter.id)
+    still_on_table = models.Order(code="А004", table_number=4, status="completed", created_at=old, waiter_id=waiter.id)
+    db.add_all([old_completed, old_pending, fresh_completed, still_on_table])
+    db.flush()
+    old_completed.total_amount = 1100
+    db.add(models.OrderItem(order_id=old_completed.id, dish_id=dish.id, quantity=2, **models.dish_snapshot(dish)))
+    # В архив попадает цена на момент заказа, а не текущая
+    dish.price = 7.0
+    db.add(models.Table(number=4, is_available=False, current_order_id=still_on_table.id))
+    db.commit()
+    old_completed_id = old_completed.id
+
+    cutoff = datetime.now(timezone.utc) - timedelta(days=1)
+    archived = archiver.archive_batch(db, cutoff, batch_size=10)
+
+    assert archived == [old_completed_id]
+    assert {o.code for o in db.query(models.Order)} == {"А002", "А003", "А004"}
+    assert db.query(models.OrderItem).count() == 0
+
+    archived_order = db.query(models.ArchivedOrder).one()
+    assert archived_order.code == "А001"
+    assert archived_order.waiter_name == "waiter"
+    assert archived_order.total_amount == 1100
+    archived_item = db.query(models.ArchivedOrderItem).one()
+    assert (archived_item.dish_name, archived_item.unit_price, archived_item.quantity) == ("Борщ", 550, 2)
+
+    assert archiver.archive_batch(db, cutoff, batch_size=10) == []
@@ -0,0 +1,64 @@
+"""
+Сервис авторизации масштабируется отдельно от API на всплесках входов, поэтому его
+импорт должен оставаться легче: без модулей заказов, Redis, миграций и passlib.
+Время импорта и пиковый RSS обоих приложений печатаются (pytest -s)
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import BACKEND_DIR
+
+pytest.importorskip("resource")
+
+PROBE = """
+import importlib, json, resource, sys, time
+started = time.perf_counter()
+importlib.import_module(sys.argv[1])
+elapsed = time.perf_counter() - started
+try:
+    # ru_maxrss в Linux переживает exec и у дочернего процесса не меньше пика pytest, а VmHWM - нет
+    with open("/proc/self/status") as status:
+        rss = next(int(line.split()[1]) for line in status if line.startswith("VmHWM")) / 1024
+except OSError:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+print(json.dumps({"seconds": elapsed, "rss_mb": rss, "modules": sorted(sys.modules)}))
+"""
+
+# Модули, которые сервису авторизации при импорте не нужны
+API_ONLY_MODULES = {"redis", "redis_client", "passlib", "outbox", "bulk_orders", "kitchen", "migrations",
+                    "menu_search", "bulk_io", "table_state", "reservations", "stock"}
+
+
+def footprint(module: str, runs: int = 2) -> dict:
+    """Лучший из нескольких запусков: чистый процесс на каждый импорт"""
+    results = []
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, "-c", PROBE, module], cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+            env={**os.environ, "SECRET_KEY": os.environ.get("SECRET_KEY", "footprint-test")},
+        )
+        # Модули печатают при импорте свои сообщения, замер - последняя строка
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return min(results, key=lambda result: result["seconds"])
+
+
+def test_auth_service_imports_only_what_users_need():
+    auth_service = footprint("auth_service", runs=1)
+    assert API_ONLY_MODULES.isdisjoint(auth_service["modules"]), \
+        sorted(API_ONLY_MODULES.intersection(auth_service["modules"]))
+
+
+def test_auth_service_starts_lighter_than_api():
+    auth_service, api = footprint("auth_service"), footprint("main")
+    print(f"\nauth_service: {auth_service['seconds'] * 1000:.0f} ms, {auth_service['rss_mb']:.1f} MB RSS, "
+          f"{len(auth_service['modules'])} modules")
+    print(f"main:         {api['seconds'] * 1000:.0f} ms, {api['rss_mb']:.1f} MB RSS, {len(api['modules'])} modules")
+
+    # Время импорта на общих CI-машинах шумит сильнее разницы, поэтому оно только печатается,
+    # а сравниваются набор модулей и память
+    assert set(auth_service["modules"]) - {"auth_service"} < set(api["modules"])
+    assert auth_service["rss_mb"] < api["rss_mb"]
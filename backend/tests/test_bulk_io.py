@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+import bulk_io
+
+
+def collect(chunks, fmt):
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+
+    async def run():
+        return [record async for record in bulk_io.iter_records(stream(), fmt)]
+
+    return asyncio.run(run())
+
+
+def test_csv_records_survive_chunk_boundaries_and_quoted_newlines():
+    """Строка, разрезанная между чанками, и перевод строки в кавычках разбираются корректно."""
+    chunks = [
+        "﻿Name,Description,Price\n".encode(),
+        'Борщ,"Суп,\nсо сметаной",5.5\nБл'.encode(),
+        "ины,,3".encode(),
+    ]
+    records = collect(chunks, "csv")
+
+    assert records == [
+        (1, {"name": "Борщ", "description": "Суп,\nсо сметаной", "price": "5.5"}),
+        (2, {"name": "Блины", "description": "", "price": "3"}),
+    ]
+
+
+def test_ndjson_reports_broken_rows_without_stopping():
+    """Битая строка NDJSON превращается в ошибку строки, остальные строки читаются дальше."""
+    chunks = [b'{"name": "A", "price": 1}\nnot json\n', b'\n[1]\n{"name": "B", "price": 2}']
+    records = collect(chunks, "ndjson")
+
+    assert [number for number, _ in records] == [1, 2, 3, 4]
+    assert records[0][1] == {"name": "A", "price": 1}
+    assert isinstance(records[1][1], ValueError)
+    assert isinstance(records[2][1], ValueError)
+    assert records[3][1] == {"name": "B", "price": 2}
+
+
+def test_csv_without_required_columns_is_rejected():
+    with pytest.raises(bulk_io.ImportFormatError):
+        collect([b"foo,bar\n1,2\n"], "csv")
+
+
+def test_stream_rows_batches_output():
+    rows = [(i, f"dish {i}") for i in range(5)]
+    chunks = list(bulk_io.stream_rows("csv", ["id", "name"], rows, batch_size=2))
+
+    assert len(chunks) == 3
+    assert "".join(chunks).splitlines() == ["id,name"] + [f"{i},dish {i}" for i in range(5)]
@@ -0,0 +1,132 @@
+import json
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import bulk_orders
+import models
+from redis_client import popular_hour
+
+
+def make_session():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)()
+
+
+def seed(db):
+    """Два занятых стола ресторана 1 и заказ чужого ресторана с тем же номером стола."""
+    waiter = models.User(username="waiter", password="x", role="waiter")
+    other = models.User(username="other", password="x", role="waiter", restaurant_id=2)
+    soup = models.Dish(name="Борщ", description="", price=5.5)
+    tea = models.Dish(name="Чай", description="", price=0.29)
+    db.add_all([waiter, other, soup, tea])
+    db.flush()
+
+    orders = [
+        models.Order(code="Б001", table_number=1, waiter_id=waiter.id),
+        models.Order(code="Б002", table_number=2, waiter_id=waiter.id),
+        models.Order(code="Б003", table_number=1, waiter_id=other.id, restaurant_id=2),
+    ]
+    db.add_all(orders)
+    db.flush()
+    db.add_all([
+        models.OrderItem(order_id=orders[0].id, dish_id=soup.id, quantity=2, **models.dish_snapshot(soup)),
+        models.OrderItem(order_id=orders[0].id, dish_id=tea.id, quantity=1, prep_status="served",
+                         **models.dish_snapshot(tea)),
+        models.OrderItem(order_id=orders[1].id, dish_id=soup.id, quantity=1, **models.dish_snapshot(soup)),
+        models.OrderItem(order_id=orders[2].id, dish_id=soup.id, quantity=4, **models.dish_snapshot(soup)),
+        models.Table(number=1, is_available=False, current_order_id=orders[0].id),
+        models.Table(number=2, is_available=False, current_order_id=orders[1].id),
+        models.Table(number=1, is_available=False, current_order_id=orders[2].id, restaurant_id=2),
+    ])
+    db.commit()
+    return [order.id for order in orders], waiter.id
+
+
+def outbox_events(db):
+    return [(event.event_type, json.loads(event.payload)) for event in db.query(models.OutboxEvent).order_by("id")]
+
+
+def test_bulk_status_completes_orders_with_one_event_per_kind():
+    db = make_session()
+    (first, second, foreign), waiter_id = seed(db)
+
+    assert bulk_orders.set_status(db, 1, [first, second, foreign, 999], "completed") == [first, second]
+    db.commit()
+
+    statuses = dict(db.query(models.Order.id, models.Order.status))
+    assert statuses == {first: "completed", second: "completed", foreign: "pending"}
+    tables = db.query(models.Table.restaurant_id, models.Table.number, models.Table.current_order_id).all()
+    assert sorted(tables) == [(1, 1, None), (1, 2, None), (2, 1, foreign)]
+
+    events = outbox_events(db)
+    assert [event_type for event_type, _ in events] == [
+        "table_availability", "invalidate_tables", "invalidate_orders", "kitchen_events",
+    ]
+    assert events[0][1]["tables"] == {"1": True, "2": True}
+    assert events[2][1] == {"restaurant_id": 1, "order_ids": [first, second], "waiter_ids": [waiter_id]}
+    # Поданный чай уже не на экранах кухни
+    assert [(event, item["order_id"], item["dish_name"]) for event, item in events[3][1]["events"]] == [
+        ("removed", first, "Борщ"), ("removed", second, "Борщ"),
+    ]
+
+
+def test_bulk_delete_removes_orders_items_and_popularity():
+    db = make_session()
+    (first, second, foreign), _ = seed(db)
+    # Второй заказ принят вчера: его позиции учтены во вчерашнем бакете популярности
+    yesterday = datetime(2026, 10, 18, 12, 30, tzinfo=timezone.utc)
+    db.get(models.Order, second).created_at = yesterday
+    db.commit()
+    today = popular_hour(db.get(models.Order, first).created_at)
+
+    assert bulk_orders.delete_orders(db, 1, [first, second, foreign]) == [first, second]
+    db.commit()
+
+    assert [order_id for order_id, in db.query(models.Order.id)] == [foreign]
+    assert [item.order_id for item in db.query(models.OrderItem)] == [foreign]
+    assert db.query(models.Table).filter(models.Table.restaurant_id == 1, models.Table.is_available == False).count() == 0
+
+    assert [payload for event_type, payload in outbox_events(db) if event_type == "record_dish_orders"] == [
+        {"restaurant_id": 1, "hour": popular_hour(yesterday), "quantities": {"1": -1}},
+        {"restaurant_id": 1, "hour": today, "quantities": {"1": -2, "2": -1}},
+    ]
+    events = dict(outbox_events(db))
+    assert events["invalidate_orders"]["order_ids"] == [first, second]
+
+
+def test_waiter_orders_are_handed_over_with_one_update():
+    db = make_session()
+    (first, second, foreign), waiter_id = seed(db)
+    colleague = models.User(username="colleague", password="x", role="waiter")
+    db.add(colleague)
+    db.commit()
+
+    waiter = db.get(models.User, waiter_id)
+    assert bulk_orders.hand_over_waiter_orders(db, waiter) == (2, colleague)
+    db.delete(waiter)
+    db.commit()
+
+    assert dict(db.query(models.Order.id, models.Order.waiter_id).filter(models.Order.restaurant_id == 1)) == {
+        first: colleague.id, second: colleague.id,
+    }
+    # Столы остаются за переданными заказами
+    assert db.query(models.Table).filter(models.Table.is_available == True).count() == 0
+    assert dict(outbox_events(db))["invalidate_orders"] == {
+        "restaurant_id": 1, "order_ids": [first, second], "waiter_ids": sorted([waiter_id, colleague.id]),
+    }
+
+
+def test_orders_of_last_waiter_are_deleted():
+    db = make_session()
+    (first, second, foreign), waiter_id = seed(db)
+
+    waiter = db.get(models.User, waiter_id)
+    assert bulk_orders.hand_over_waiter_orders(db, waiter) == (2, None)
+    db.delete(waiter)
+    db.commit()
+
+    assert [order_id for order_id, in db.query(models.Order.id)] == [foreign]
+    assert db.query(models.Table).filter(models.Table.restaurant_id == 1, models.Table.is_available == False).count() == 0
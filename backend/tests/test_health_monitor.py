@@ -0,0 +1,41 @@
+import asyncio
+import time
+
+import health_monitor
+
+
+def test_hung_check_does_not_stall_the_cycle(monkeypatch):
+    """Зависшая проверка отваливается по таймауту, остальные выполняются параллельно."""
+    monkeypatch.setattr(health_monitor, "history", health_monitor.HealthHistory(size=5))
+
+    def slow():
+        time.sleep(0.3)
+        return True, "slow: OK"
+
+    checks = {"hung": lambda: time.sleep(2) or (True, "hung: OK"), "slow_1": slow, "slow_2": slow, "slow_3": slow}
+
+    async def cycle():
+        # Время меряем внутри цикла событий: asyncio.run при закрытии ждет зависший поток
+        started = time.perf_counter()
+        results = await health_monitor.monitor_all_services(checks, timeout=0.5)
+        return results, time.perf_counter() - started
+
+    results, elapsed = asyncio.run(cycle())
+
+    assert results == {"hung": False, "slow_1": True, "slow_2": True, "slow_3": True}
+    assert elapsed < 0.9
+    assert "TIMEOUT" in health_monitor.history.summary()["checks"]["hung"]["message"]
+
+
+def test_history_keeps_last_results_and_reports_p95():
+    history = health_monitor.HealthHistory(size=20)
+    for latency in range(1, 31):
+        history.record("redis", latency != 30, float(latency), "redis")
+
+    summary = history.summary()["checks"]["redis"]
+
+    assert summary["samples"] == 20
+    assert summary["p95_latency_ms"] == 29.0
+    assert summary["uptime_percent"] == 95.0
+    assert summary["ok"] is False
+    assert history.summary()["status"] == "degraded"
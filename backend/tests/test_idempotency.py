@@ -0,0 +1,113 @@
+import asyncio
+import json
+
+import auth
+import idempotency
+from idempotency import IdempotencyMiddleware
+
+
+class Storage:
+    """Хранилище ответов и блокировок в памяти вместо Redis."""
+
+    def __init__(self):
+        self.responses = {}
+        self.locks = set()
+
+    def install(self, monkeypatch):
+        client = idempotency.redis_client
+        monkeypatch.setattr(client, "get_idempotent_response", self.responses.get)
+        monkeypatch.setattr(client, "acquire_idempotency_lock", self.acquire)
+        monkeypatch.setattr(client, "store_idempotent_response", self.store)
+        monkeypatch.setattr(client, "release_idempotency_lock", self.locks.discard)
+
+    def acquire(self, key):
+        if key in self.locks:
+            return False
+        self.locks.add(key)
+        return True
+
+    def store(self, key, response, ttl):
+        self.responses[key] = response
+        self.locks.discard(key)
+        return True
+
+
+def make_app(status=200, delay=0.0):
+    calls = []
+
+    async def app(scope, receive, send):
+        message = await receive()
+        calls.append(message["body"])
+        await asyncio.sleep(delay)
+        body = json.dumps({"call": len(calls)}).encode()
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+
+    return app, calls
+
+
+async def request(app, body=b'{"table_number": 1}', key="k1", path="/orders", user="waiter"):
+    token = auth.create_access_token({"sub": user, "role": "waiter"})
+    headers = [(b"authorization", f"Bearer {token}".encode())]
+    if key:
+        headers.append((b"idempotency-key", key.encode()))
+    scope = {"type": "http", "method": "POST", "path": path, "headers": headers}
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    start = sent[0]
+    body = b"".join(m.get("body", b"") for m in sent[1:])
+    return start["status"], dict(start["headers"]), json.loads(body)
+
+
+def test_replay_returns_stored_response(monkeypatch):
+    Storage().install(monkeypatch)
+    inner, calls = make_app()
+    app = IdempotencyMiddleware(inner)
+
+    first = asyncio.run(request(app))
+    replay = asyncio.run(request(app))
+
+    assert first[2] == replay[2] == {"call": 1}
+    assert replay[1][b"idempotent-replayed"] == b"true"
+    assert len(calls) == 1
+
+    assert asyncio.run(request(app, body=b'{"table_number": 2}'))[0] == 422
+    assert asyncio.run(request(app, user="other"))[2] == {"call": 2}
+    assert asyncio.run(request(app, key=None))[2] == {"call": 3}
+
+
+def test_concurrent_duplicates_wait_for_first_response(monkeypatch):
+    Storage().install(monkeypatch)
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_POLL_SECONDS", 0.01)
+    inner, calls = make_app(delay=0.05)
+    app = IdempotencyMiddleware(inner)
+
+    async def burst():
+        return await asyncio.gather(*(request(app) for _ in range(5)))
+
+    results = asyncio.run(burst())
+
+    assert len(calls) == 1
+    assert {status for status, _, _ in results} == {200}
+    assert all(body == {"call": 1} for _, _, body in results)
+
+
+def test_failed_response_is_not_stored(monkeypatch):
+    storage = Storage()
+    storage.install(monkeypatch)
+    inner, calls = make_app(status=400)
+    app = IdempotencyMiddleware(inner)
+
+    asyncio.run(request(app))
+    asyncio.run(request(app))
+
+    assert len(calls) == 2
+    assert storage.responses == {} and storage.locks == set()
@@ -0,0 +1,70 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import kitchen
+import models
+from schemas import OrderItemCreate
+
+
+def make_order():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+
+    waiter = models.User(username="waiter", password="x", role="waiter")
+    soup = models.Dish(name="Борщ", description="", price=5.5)
+    salad = models.Dish(name="Цезарь", description="", price=4.0, station="cold")
+    tea = models.Dish(name="Чай", description="", price=1.0, station="bar")
+    db.add_all([waiter, soup, salad, tea])
+    db.flush()
+
+    order = models.Order(code="А001", table_number=3, waiter_id=waiter.id)
+    db.add(order)
+    db.flush()
+    db.add_all([
+        models.OrderItem(order_id=order.id, dish_id=soup.id, quantity=1, prep_status="cooking"),
+        models.OrderItem(order_id=order.id, dish_id=salad.id, quantity=2),
+    ])
+    db.commit()
+    return db, order, soup, salad, tea
+
+
+def test_reconcile_keeps_started_items_and_queues_additions():
+    """Правка заказа не сбрасывает начатое приготовление, добавка идет отдельной позицией."""
+    db, order, soup, salad, tea = make_order()
+    soup_item_id = db.query(models.OrderItem).filter_by(dish_id=soup.id).one().id
+
+    changes = kitchen.reconcile_items(db, order.id, [
+        OrderItemCreate(dish_id=soup.id, quantity=3),
+        OrderItemCreate(dish_id=tea.id, quantity=1),
+    ], {soup.id: soup, tea.id: tea})
+    events = kitchen.build_events(db, order, changes)
+    db.commit()
+
+    assert sorted((event_type, item["dish_name"], item["quantity"]) for event_type, item in events) == [
+        ("queued", "Борщ", 2), ("queued", "Чай", 1), ("removed", "Цезарь", 2),
+    ]
+    items = {(item.dish_id, item.quantity): item for item in db.query(models.OrderItem)}
+    assert set(items) == {(soup.id, 1), (soup.id, 2), (tea.id, 1)}
+    assert items[(soup.id, 1)].id == soup_item_id
+    assert items[(soup.id, 1)].prep_status == "cooking"
+    assert items[(soup.id, 2)].prep_status == "queued"
+    assert (items[(soup.id, 2)].dish_name, items[(soup.id, 2)].unit_price) == ("Борщ", 550)
+
+
+def test_active_items_grouped_by_station_in_age_order():
+    db, order, soup, salad, tea = make_order()
+    db.add(models.OrderItem(order_id=order.id, dish_id=tea.id, quantity=1, prep_status="served"))
+    db.commit()
+
+    stations = kitchen.group_by_station(kitchen.active_items(db))
+
+    assert [(group["station"], [item["dish_name"] for item in group["items"]]) for group in stations] == [
+        ("cold", ["Цезарь"]), ("hot", ["Борщ"]),
+    ]
+    assert stations[1]["items"][0]["table_number"] == 3
+    assert kitchen.group_by_station(kitchen.active_items(db), station="cold")[0]["station"] == "cold"
+
+    order.status = "completed"
+    db.commit()
+    assert kitchen.active_items(db) == []
@@ -0,0 +1,93 @@
+import random
+import statistics
+import time
+
+from menu_search import MenuSearchIndex
+
+
+MENU = [
+    {"id": 1, "name": "Борщ украинский", "description": "Суп со свеклой и сметаной", "price": 350.0, "available": True},
+    {"id": 2, "name": "Пельмени сибирские", "description": "С говядиной и свининой", "price": 420.0, "available": True},
+    {"id": 3, "name": "Салат Цезарь", "description": "Курица, пармезан, гренки", "price": 390.0, "available": True},
+    {"id": 4, "name": "Сырники", "description": "Со сметаной и ягодным соусом", "price": 290.0, "available": True},
+]
+
+
+def build(dishes):
+    index = MenuSearchIndex()
+    index.build(dishes, version=1)
+    return index
+
+
+def ids(results):
+    return [dish["id"] for dish in results]
+
+
+def test_search_tolerates_typos_and_prefixes():
+    """Опечатки, недописанные слова и слова из описания находят нужное блюдо."""
+    index = build(MENU)
+
+    assert ids(index.search("борш"))[0] == 1
+    assert ids(index.search("пелмени"))[0] == 2
+    assert ids(index.search("сиб"))[0] == 2
+    assert ids(index.search("цезар"))[0] == 3
+    assert ids(index.search("пармезан")) == [3]
+    assert ids(index.search("Свекла")) == [1]
+    assert index.search("шашлык") == []
+    assert index.search("   ") == []
+
+
+def test_name_matches_rank_above_description_matches():
+    index = build(MENU)
+
+    # "сыр" есть только в названии сырников, "сметан" - только в описаниях
+    assert ids(index.search("сыр")) == [4]
+    assert sorted(ids(index.search("сметан"))) == [1, 4]
+    assert ids(index.search("Сырники сметана"))[0] == 4
+
+
+def test_index_rebuilds_when_menu_version_changes():
+    index = build(MENU)
+    assert not index.needs_rebuild(1)
+    assert index.needs_rebuild(2)
+
+    index.invalidate()
+    assert index.needs_rebuild(1)
+
+
+def make_menu(size):
+    rng = random.Random(7)
+    foods = (
+        "борщ щи солянка уха пельмени вареники блины сырники котлета стейк шашлык плов рагу гуляш "
+        "голубцы курица утка говядина свинина лосось форель судак креветки кальмар салат винегрет "
+        "оливье цезарь паста лазанья пицца ризотто суп пюре каша картофель грибы пирог хачапури "
+        "манты хинкали бургер омлет торт чизкейк тирамису морс компот чай кофе"
+    ).split()
+    adjectives = "домашний острый сливочный запеченный жареный тушеный копченый фирменный легкий пряный".split()
+    letters = "абвгдежзийклмнопрстуфхцчшщыэюя"
+    words = ["".join(rng.choice(letters) for _ in range(rng.randint(4, 10))) for _ in range(3000)]
+    return [
+        {
+            "id": i,
+            "name": f"{rng.choice(adjectives)} {rng.choice(foods)}".capitalize(),
+            "description": " ".join(rng.choices(words + foods, k=rng.randint(6, 15))),
+            "price": 100.0,
+            "available": True,
+        }
+        for i in range(size)
+    ]
+
+
+def test_search_answers_under_5ms_at_10k_dishes():
+    index = build(make_menu(10_000))
+    queries = ["борщ", "борш", "пелмени", "сырн", "шашлк", "лосос", "цезар", "тирамиссу",
+               "кофе", "суп", "запеч", "острый борщ", "хачапури", "гречк", "пицца"]
+
+    timings = []
+    for _ in range(5):
+        for query in queries:
+            started = time.perf_counter()
+            index.search(query)
+            timings.append(time.perf_counter() - started)
+
+    assert statistics.median(timings) < 0.005
@@ -0,0 +1,78 @@
+from redis_client import ORDER_CACHE_TOMBSTONE, RedisClient, order_cache_key, waiter_orders_cache_key
+
+
+class ExpiringRedis:
+    """MGET/SET NX EX и конвейер в памяти; expire() имитирует истечение TTL ключа."""
+
+    def __init__(self):
+        self.values = {}
+        self.ttls = {}
+
+    def ping(self):
+        return True
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        self.ttls[key] = ex
+        return True
+
+    def pipeline(self, transaction=True):
+        return Pipeline(self)
+
+    def expire(self, key):
+        self.values.pop(key, None)
+
+
+class Pipeline:
+    def __init__(self, redis):
+        self.redis, self.commands = redis, []
+
+    def set(self, *args, **kwargs):
+        self.commands.append((args, kwargs))
+
+    def execute(self):
+        return [self.redis.set(*args, **kwargs) for args, kwargs in self.commands]
+
+
+def memory_client():
+    client = RedisClient.__new__(RedisClient)
+    client.client = ExpiringRedis()
+    return client
+
+
+def test_orders_are_read_through_per_order_and_per_waiter():
+    client = memory_client()
+    keys = [order_cache_key(1), order_cache_key(2), waiter_orders_cache_key(4)]
+
+    assert client.get_cached_orders(3, keys) == [None, None, None]
+    assert client.cache_orders(3, {order_cache_key(1): {"id": 1, "waiter_id": 4},
+                                   waiter_orders_cache_key(4): [{"id": 1, "waiter_id": 4}]})
+    assert client.get_cached_orders(3, keys) == [{"id": 1, "waiter_id": 4}, None, [{"id": 1, "waiter_id": 4}]]
+    # Пустой список официанта - тоже попадание
+    assert client.cache_orders(3, {waiter_orders_cache_key(5): []})
+    assert client.get_cached_orders(3, [waiter_orders_cache_key(5)]) == [[]]
+    # Ключи разложены по ресторанам
+    assert client.get_cached_orders(4, keys) == [None, None, None]
+
+
+def test_invalidation_keeps_stale_fill_out_of_cache():
+    client = memory_client()
+    client.cache_orders(3, {order_cache_key(1): {"status": "pending"}, waiter_orders_cache_key(4): []})
+
+    assert client.invalidate_orders_cache(3, [1], [4])
+    assert client.client.values["r:{3}:order:1"] == ORDER_CACHE_TOMBSTONE
+    assert client.get_cached_orders(3, [order_cache_key(1), waiter_orders_cache_key(4)]) == [None, None]
+
+    # Ответ, собранный из БД до коммита изменения, приходит после инвалидации и не кешируется
+    client.cache_orders(3, {order_cache_key(1): {"status": "pending"}, waiter_orders_cache_key(4): []})
+    assert client.get_cached_orders(3, [order_cache_key(1), waiter_orders_cache_key(4)]) == [None, None]
+
+    # Когда метка истекла, промах снова заполняет кеш
+    client.client.expire("r:{3}:order:1")
+    client.cache_orders(3, {order_cache_key(1): {"status": "completed"}})
+    assert client.get_cached_orders(3, [order_cache_key(1)]) == [{"status": "completed"}]
@@ -0,0 +1,66 @@
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+import pytest
+
+resource = pytest.importorskip("resource")
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+# Скрипт выполняется в отдельном процессе: ru_maxrss монотонен в пределах
+# процесса, поэтому каждое измерение должно стартовать с чистого пика.
+EXPORT_SCRIPT = textwrap.dedent("""
+    import os, resource, sys
+    sys.path.insert(0, sys.argv[1])
+    os.environ.setdefault("REDIS_HOST", "127.0.0.1")
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.orm import sessionmaker
+    import bulk_io, models
+
+    rows = int(sys.argv[2])
+    engine = create_engine("sqlite:///" + sys.argv[3])
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, username, password, role) VALUES (1, 'waiter', 'x', 'waiter')"))
+        conn.execute(text("INSERT INTO dishes (id, name, description, price, available) VALUES (1, 'Борщ', '', 5.5, 1)"))
+        # Данные генерируются внутри SQLite, чтобы наполнение не поднимало пик памяти Python
+        conn.execute(text(
+            "WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < :rows) "
+            "INSERT INTO orders (id, code, table_number, status, created_at, waiter_id) "
+            "SELECT n, 'Б' || n, n % 50 + 1, 'completed', '2026-01-01 12:00:00', 1 FROM seq"
+        ), {"rows": rows})
+        conn.execute(text("INSERT INTO order_items (order_id, dish_id, quantity) SELECT id, 1, 2 FROM orders"))
+
+    db = sessionmaker(bind=engine)()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    exported = 0
+    for chunk in bulk_io.stream_rows("ndjson", bulk_io.ORDER_EXPORT_COLUMNS, bulk_io.iter_order_export_rows(db)):
+        exported += chunk.count("\\n")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(exported, peak - baseline)
+""")
+
+
+def run_export(rows: int, tmp_path: Path):
+    db_path = tmp_path / f"export_{rows}.sqlite"
+    result = subprocess.run(
+        [sys.executable, "-c", EXPORT_SCRIPT, str(BACKEND_DIR), str(rows), str(db_path)],
+        capture_output=True, text=True, check=True, timeout=300,
+    )
+    exported, growth_kb = result.stdout.split()[-2:]
+    return int(exported), int(growth_kb)
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="ru_maxrss в килобайтах только на Linux")
+def test_order_export_peak_rss_does_not_grow_with_row_count(tmp_path):
+    """Экспорт в 10 раз большего числа заказов не должен заметно поднимать пик RSS."""
+    small_rows, small_growth = run_export(20_000, tmp_path)
+    large_rows, large_growth = run_export(200_000, tmp_path)
+
+    assert small_rows == 20_000
+    assert large_rows == 200_000
+    # Загрузка 200k строк в память целиком заняла бы сотни мегабайт
+    assert large_growth - small_growth < 16 * 1024
+    assert large_growth < 32 * 1024
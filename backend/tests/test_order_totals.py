@@ -0,0 +1,52 @@
+from sqlalchemy import create_engine, text
+
+import models
+from migrations import run_migrations
+
+
+def test_prices_are_converted_to_exact_minor_units():
+    assert [models.to_minor_units(price) for price in (0.29, 19.99, 5.5, 100)] == [29, 1999, 550, 10000]
+    assert models.from_minor_units(1999) == 19.99
+    assert models.from_minor_units(None) == 0
+
+
+def test_migration_snapshots_prices_and_totals_of_existing_orders():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        # База до снимков цен: новых колонок еще нет
+        for table, column in [("order_items", "dish_name"), ("order_items", "unit_price"), ("orders", "total_amount")]:
+            conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {column}"))
+        conn.execute(text("INSERT INTO dishes (id, name, price) VALUES (1, 'Борщ', 5.5), (2, 'Чай', 0.29)"))
+        conn.execute(text("INSERT INTO orders (id, table_number, waiter_id) VALUES (1, 1, 1), (2, 2, 1)"))
+        conn.execute(text("INSERT INTO order_items (order_id, dish_id, quantity) VALUES (1, 1, 2), (1, 2, 3)"))
+
+    run_migrations(engine)
+
+    with engine.begin() as conn:
+        assert conn.execute(text("SELECT dish_name, unit_price FROM order_items ORDER BY id")).all() == [
+            ("Борщ", 550), ("Чай", 29),
+        ]
+        assert conn.execute(text("SELECT id, total_amount FROM orders ORDER BY id")).all() == [(1, 1187), (2, 0)]
+
+
+def test_migration_converts_archived_prices_to_minor_units():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        # Архив до копеек: цена позиции в рублях во float, суммы заказа нет
+        conn.execute(text("ALTER TABLE order_items_archive DROP COLUMN unit_price"))
+        conn.execute(text("ALTER TABLE order_items_archive ADD COLUMN dish_price FLOAT"))
+        conn.execute(text("ALTER TABLE orders_archive DROP COLUMN total_amount"))
+        conn.execute(text("INSERT INTO orders_archive (id, table_number, status) VALUES (1, 1, 'completed')"))
+        conn.execute(text(
+            "INSERT INTO order_items_archive (order_id, dish_id, dish_price, quantity) VALUES (1, 1, 0.29, 3), (1, 2, 5.5, 1)"
+        ))
+
+    run_migrations(engine)
+
+    with engine.begin() as conn:
+        assert conn.execute(text("SELECT dish_id, unit_price FROM order_items_archive ORDER BY id")).all() == [
+            (1, 29), (2, 550),
+        ]
+        assert conn.execute(text("SELECT total_amount FROM orders_archive")).scalar() == 637
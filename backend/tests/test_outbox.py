@@ -0,0 +1,71 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models
+import outbox
+
+
+def make_session():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)()
+
+
+def test_batch_groups_events_by_type_and_deletes_processed(monkeypatch):
+    """Пачка передает обработчику все события типа разом, в порядке записи."""
+    calls = []
+    monkeypatch.setitem(outbox.HANDLERS, "invalidate_orders", lambda payloads: calls.append(payloads) or True)
+    monkeypatch.setitem(outbox.HANDLERS, "kitchen_events", lambda payloads: calls.append(payloads) or True)
+
+    db = make_session()
+    outbox.enqueue(db, "invalidate_orders", order_ids=[1])
+    outbox.enqueue(db, "kitchen_events", events=[["queued", {"item_id": 1}]])
+    outbox.enqueue(db, "invalidate_orders", order_ids=[2])
+    outbox.enqueue(db, "kitchen_events", events=[["removed", {"item_id": 1}]])
+    db.commit()
+
+    assert outbox.process_batch(db, batch_size=10) == 4
+    assert calls == [
+        [{"order_ids": [1]}, {"order_ids": [2]}],
+        [{"events": [["queued", {"item_id": 1}]]}, {"events": [["removed", {"item_id": 1}]]}],
+    ]
+    assert db.query(models.OutboxEvent).count() == 0
+    assert outbox.process_batch(db, batch_size=10) == 0
+
+
+def test_failed_events_are_retried_later(monkeypatch):
+    monkeypatch.setitem(outbox.HANDLERS, "invalidate_tables", lambda payloads: False)
+    monkeypatch.setitem(outbox.HANDLERS, "invalidate_dishes", lambda payloads: True)
+
+    db = make_session()
+    outbox.enqueue(db, "invalidate_tables")
+    outbox.enqueue(db, "invalidate_dishes")
+    db.commit()
+
+    assert outbox.process_batch(db, batch_size=10) == 2
+    failed = db.query(models.OutboxEvent).one()
+    assert (failed.event_type, failed.attempts) == ("invalidate_tables", 1)
+    assert failed.available_at.replace(tzinfo=timezone.utc) > datetime.now(timezone.utc)
+
+    # До времени повтора событие не выбирается
+    assert outbox.process_batch(db, batch_size=10) == 0
+
+
+def test_handlers_merge_payloads(monkeypatch):
+    recorded = {}
+    monkeypatch.setattr(outbox.redis_client, "record_dish_orders",
+                        lambda restaurant_id, orders, hour: recorded.setdefault(hour, {}).update(orders) or True)
+    monkeypatch.setattr(outbox.redis_client, "invalidate_orders_cache",
+                        lambda restaurant_id, ids, waiters: recorded.update(ids=ids, waiters=waiters) or True)
+
+    # Количества популярности остаются по событиям: повторную доставку Redis отбрасывает по id.
+    # События разложены по часам заказов; событие без hour записано до их появления
+    assert outbox.HANDLERS["record_dish_orders"]([(8, {"hour": 5, "quantities": {"1": 2}}),
+                                                  (9, {"hour": 5, "quantities": {"1": -1, "3": 1}}),
+                                                  (10, {"quantities": {"2": 1}})])
+    # Событие без waiter_ids записано до появления кеша списков официантов
+    assert outbox.HANDLERS["invalidate_orders"]([{"order_ids": [5, 2], "waiter_ids": [4, None]},
+                                                 {"order_ids": [2], "waiter_ids": [4, 3]}, {"order_ids": [2]}])
+    assert recorded == {5: {8: {1: 2}, 9: {1: -1, 3: 1}}, None: {10: {2: 1}}, "ids": [2, 5], "waiters": [3, 4]}
@@ -0,0 +1,115 @@
+from itertools import count
+
+import fakeredis
+import pytest
+
+import outbox
+import redis_client
+from redis_client import POPULAR_BUCKET_TTL, RedisClient
+
+
+HOUR = 490000
+EVENT_IDS = count(1)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = RedisClient.__new__(RedisClient)
+    client.client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(redis_client, "_current_hour", lambda: HOUR)
+    return client
+
+
+def at_hour(monkeypatch, hour):
+    monkeypatch.setattr(redis_client, "_current_hour", lambda: hour)
+
+
+def record(client, quantities, restaurant_id=1):
+    """Заказ как одно новое событие outbox"""
+    return client.record_dish_orders(restaurant_id, {next(EVENT_IDS): quantities})
+
+
+def test_orders_are_counted_in_hourly_buckets(client, monkeypatch):
+    assert record(client, {7: 2, 9: 1})
+    assert record(client, {7: 1})
+    at_hour(monkeypatch, HOUR + 1)
+    assert record(client, {9: 4})
+
+    bucket = f"r:{{1}}:stats:popular:{HOUR}"
+    assert client.client.zrange(bucket, 0, -1, withscores=True) == [("9", 1.0), ("7", 3.0)]
+    assert 0 < client.client.ttl(bucket) <= POPULAR_BUCKET_TTL
+    assert client.client.zrange(f"r:{{1}}:stats:popular:{HOUR + 1}", 0, -1, withscores=True) == [("9", 4.0)]
+    # Бакеты разложены по ресторанам
+    assert client.get_popular_dishes(2, window="week") == []
+
+
+def test_window_unions_only_its_hours(client, monkeypatch):
+    at_hour(monkeypatch, HOUR - 24)
+    record(client, {5: 10})
+    at_hour(monkeypatch, HOUR - 23)
+    record(client, {7: 3})
+    at_hour(monkeypatch, HOUR)
+    record(client, {9: 2, 7: 1})
+
+    assert client.get_popular_dishes(1, window="hour") == [(9, 2), (7, 1)]
+    # Сутки - текущий час и 23 предыдущих: бакет 24 часа назад уже не входит
+    assert client.get_popular_dishes(1, window="day") == [(7, 4), (9, 2)]
+    assert client.get_popular_dishes(1, window="week") == [(5, 10), (7, 4), (9, 2)]
+    assert client.get_popular_dishes(1, window="week", limit=1) == [(5, 10)]
+
+
+def test_order_edits_apply_deltas_and_hide_non_positive_totals(client, monkeypatch):
+    at_hour(monkeypatch, HOUR - 1)
+    record(client, {7: 2, 9: 1})
+    at_hour(monkeypatch, HOUR)
+    # Правка заказа: борща на одну порцию меньше, чай убран, добавлен хлеб
+    record(client, {7: -1, 9: -1, 11: 1})
+
+    assert sorted(client.get_popular_dishes(1, window="day")) == [(7, 1), (11, 1)]
+    assert client.get_popular_dishes(1, window="hour") == [(11, 1)]
+
+
+def test_edits_of_older_orders_change_the_bucket_of_their_hour(client, monkeypatch):
+    at_hour(monkeypatch, HOUR - 30)
+    record(client, {7: 2})
+    at_hour(monkeypatch, HOUR)
+    record(client, {9: 1})
+    # Удаление заказа, принятого 30 часов назад, снимает порции с его бакета, а не с текущего
+    assert client.record_dish_orders(1, {next(EVENT_IDS): {7: -2}}, hour=HOUR - 30)
+
+    assert client.client.zscore(f"r:{{1}}:stats:popular:{HOUR - 30}", 7) == 0
+    assert client.client.zscore(f"r:{{1}}:stats:popular:{HOUR}", 7) is None
+    assert 0 < client.client.ttl(f"r:{{1}}:stats:popular:{HOUR - 30}") <= POPULAR_BUCKET_TTL - 30 * 3600
+    assert client.get_popular_dishes(1, window="week") == [(9, 1)]
+
+    # Заказ старше недели уже не входит ни в одно окно: бакет не создается заново
+    assert client.record_dish_orders(1, {next(EVENT_IDS): {5: -1}}, hour=HOUR - 24 * 7)
+    assert not client.client.exists(f"r:{{1}}:stats:popular:{HOUR - 24 * 7}")
+
+
+def test_union_is_cached_until_it_expires(client):
+    record(client, {7: 1})
+    assert client.get_popular_dishes(1) == [(7, 1)]
+
+    record(client, {9: 5})
+    assert client.get_popular_dishes(1) == [(7, 1)]
+    client.client.delete(f"r:{{1}}:stats:popular:day:{HOUR}")
+    assert client.get_popular_dishes(1) == [(9, 5), (7, 1)]
+
+
+def test_redelivered_events_are_counted_once(client, monkeypatch):
+    monkeypatch.setattr(outbox, "redis_client", client)
+    batch = [(101, {"restaurant_id": 1, "quantities": {"7": 2}}), (102, {"restaurant_id": 1, "quantities": {"9": 1}})]
+
+    assert outbox.HANDLERS["record_dish_orders"](batch)
+    # Удаление пачки не закоммитилось: воркер доставляет ее снова, уже вместе с новым событием
+    assert outbox.HANDLERS["record_dish_orders"](batch + [(103, {"restaurant_id": 1, "quantities": {"9": 3}})])
+    assert client.get_popular_dishes(1, window="hour") == [(9, 4), (7, 2)]
+
+
+def test_without_redis_nothing_is_recorded():
+    client = RedisClient.__new__(RedisClient)
+    client.client = None
+
+    assert not record(client, {7: 1})
+    assert client.get_popular_dishes(1) == []
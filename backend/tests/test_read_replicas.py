@@ -0,0 +1,65 @@
+from fastapi import Depends, FastAPI, Request
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session, sessionmaker
+
+import database
+from database import get_db, get_read_db, primary_pinned
+from read_your_writes import ReadYourWritesMiddleware
+
+
+def make_engine(path):
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE notes (body TEXT)"))
+    return engine
+
+
+def test_reads_go_to_replica_until_client_writes(tmp_path, monkeypatch):
+    primary, replica = make_engine(tmp_path / "primary.db"), make_engine(tmp_path / "replica.db")
+    monkeypatch.setattr(database, "engine", primary)
+    monkeypatch.setattr(database, "SessionLocal", sessionmaker(autocommit=False, autoflush=False, bind=primary))
+    monkeypatch.setattr(database, "replica_engines", [replica])
+
+    app = FastAPI()
+    app.add_middleware(ReadYourWritesMiddleware)
+
+    @app.post("/notes")
+    def add_note(db: Session = Depends(get_db)):
+        db.execute(text("INSERT INTO notes VALUES ('first')"))
+        db.commit()
+        return {}
+
+    @app.get("/notes")
+    def count_notes(db: Session = Depends(get_read_db)):
+        return db.execute(text("SELECT COUNT(*) FROM notes")).scalar()
+
+    writer, other = TestClient(app), TestClient(app)
+    # Реплика отстает: запись есть только в основной БД
+    response = writer.post("/notes")
+    assert float(response.headers["x-primary-until"]) > 0
+    assert writer.get("/notes").json() == 1
+    assert other.get("/notes").json() == 0
+    # Клиент без cookie может вернуть метку заголовком; истекшая метка ведет на реплику
+    assert other.get("/notes", headers={"X-Primary-Until": response.headers["x-primary-until"]}).json() == 1
+    assert other.get("/notes", headers={"X-Primary-Until": "1"}).json() == 0
+
+
+def test_writers_are_pinned_without_replicas(monkeypatch):
+    # Кеш заказов сбрасывается после коммита, поэтому метка нужна и без реплик
+    monkeypatch.setattr(database, "replica_engines", [])
+    app = FastAPI()
+    app.add_middleware(ReadYourWritesMiddleware)
+
+    @app.post("/notes")
+    def add_note():
+        return {}
+
+    @app.get("/notes/pinned")
+    def pinned(request: Request):
+        return primary_pinned(request)
+
+    client = TestClient(app)
+    assert not client.get("/notes/pinned").json()
+    assert "x-primary-until" in client.post("/notes").headers
+    assert client.get("/notes/pinned").json()
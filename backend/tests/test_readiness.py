@@ -0,0 +1,68 @@
+import time
+
+from sqlalchemy import create_engine, text
+
+from readiness import Readiness
+
+
+class FakeRedis:
+
+    def __init__(self, available):
+        self.available = available
+
+    def is_available(self):
+        return self.available
+
+
+def test_cached_verdict_follows_dependencies_without_querying_them():
+    redis = FakeRedis(available=False)
+    readiness = Readiness(create_engine("sqlite://"), redis, interval=60)
+    assert readiness.snapshot()[0] is False
+
+    readiness.refresh()
+    ready, verdict = readiness.snapshot()
+    # Redis не обязателен: под готов, но помечен как degraded
+    assert ready is True
+    assert verdict["status"] == "degraded"
+
+    readiness.engine = create_engine("postgresql://nobody@127.0.0.1:1/none", connect_args={"connect_timeout": 1})
+    redis.available = True
+    assert readiness.snapshot()[0] is True
+
+    readiness.refresh()
+    ready, verdict = readiness.snapshot()
+    assert ready is False
+    assert verdict["status"] == "unavailable"
+    assert verdict["database"]["ok"] is False
+
+
+def test_stale_or_stopping_verdict_is_not_ready():
+    readiness = Readiness(create_engine("sqlite://"), interval=0.05)
+    readiness.start()
+    try:
+        assert readiness.snapshot()[0] is True
+        assert "redis" not in readiness.snapshot()[1]
+    finally:
+        readiness.stop()
+    assert readiness.snapshot() == (False, {"status": "shutting down"})
+
+    readiness.stopping.clear()
+    time.sleep(0.2)
+    ready, verdict = readiness.snapshot()
+    assert ready is False
+    assert verdict["status"] == "stale"
+
+
+def test_database_without_schema_is_not_ready():
+    engine = create_engine("sqlite://")
+    readiness = Readiness(engine, interval=60, required_tables=["users"])
+
+    readiness.refresh()
+    ready, verdict = readiness.snapshot()
+    assert ready is False
+    assert verdict["database"] == {**verdict["database"], "ok": False, "error": "missing tables: users"}
+
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY)"))
+    readiness.refresh()
+    assert readiness.snapshot()[0] is True
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pydantic import ValidationError
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models
+import reservations
+from schemas import ReservationCreate
+
+
+EVENING = datetime(2026, 3, 8, 19, 0, tzinfo=timezone.utc)
+
+
+def make_session():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)()
+
+
+def seed(db):
+    """Столы на 2, 4, 6 и 8 мест и брони вечера: стол 3 занят 18:00-20:00, стол 4 - с 21:00."""
+    db.add_all([models.Table(number=number, seats=seats) for number, seats in [(1, 2), (2, 4), (3, 6), (4, 8)]])
+    db.add_all([
+        models.Table(number=3, seats=6, restaurant_id=2),
+        models.Reservation(table_number=3, guest_name="Иванов", guests=5,
+                           starts_at=EVENING - timedelta(hours=1), ends_at=EVENING + timedelta(hours=1)),
+        models.Reservation(table_number=4, guest_name="Петров", guests=8,
+                           starts_at=EVENING + timedelta(hours=2), ends_at=EVENING + timedelta(hours=4)),
+    ])
+    db.commit()
+
+
+def free_numbers(db, starts_at, ends_at, guests, restaurant_id=1):
+    return [t.number for t in reservations.free_tables(db, restaurant_id, starts_at, ends_at, guests)]
+
+
+def test_free_tables_skip_small_and_overlapping_tables():
+    db = make_session()
+    seed(db)
+
+    # 19:00-21:00 на шестерых: стол 3 забронирован, стол 4 освобождается к брони в 21:00
+    assert free_numbers(db, EVENING, EVENING + timedelta(hours=2), 6) == [4]
+    assert free_numbers(db, EVENING + timedelta(minutes=30), EVENING + timedelta(hours=3), 6) == []
+    # Меньшие столы первыми
+    assert free_numbers(db, EVENING, EVENING + timedelta(hours=2), 2) == [1, 2, 4]
+    # Бронь другого ресторана на тот же номер стола не мешает
+    assert free_numbers(db, EVENING, EVENING + timedelta(hours=2), 6, restaurant_id=2) == [3]
+
+
+def test_adjacent_reservations_do_not_conflict():
+    db = make_session()
+    seed(db)
+
+    assert reservations.conflicting(db, 1, 3, EVENING + timedelta(hours=1), EVENING + timedelta(hours=3)) is None
+    assert reservations.conflicting(db, 1, 4, EVENING, EVENING + timedelta(hours=2)) is None
+    clash = reservations.conflicting(db, 1, 4, EVENING + timedelta(hours=3), EVENING + timedelta(hours=5))
+    assert clash.guest_name == "Петров"
+
+
+def test_upcoming_reservation_blocks_walk_in_order():
+    db = make_session()
+    seed(db)
+    late = db.query(models.Reservation).filter(models.Reservation.table_number == 4).one()
+
+    # За час до брони стол под гостя без брони не отдается, за три часа - отдается
+    assert reservations.blocking_order(db, 1, 4, now=late.starts_at - timedelta(hours=1)).id == late.id
+    assert reservations.blocking_order(db, 1, 4, now=late.starts_at - timedelta(hours=3)) is None
+    # Гости этой брони пришли - стол их
+    assert reservations.blocking_order(db, 1, 4, reservation_id=late.id, now=late.starts_at) is None
+
+
+def test_reservation_times_are_validated_and_stored_in_utc():
+    moscow = timezone(timedelta(hours=3))
+    reservation = ReservationCreate(table_number=1, guest_name=" Анна ", guests=2,
+                                    starts_at=datetime(2026, 3, 8, 22, 0, tzinfo=moscow),
+                                    ends_at=datetime(2026, 3, 8, 21, 0))
+    assert reservation.guest_name == "Анна"
+    assert reservation.starts_at == EVENING and reservation.starts_at.tzinfo == timezone.utc
+    assert reservation.ends_at == EVENING + timedelta(hours=2)
+
+    with pytest.raises(ValidationError):
+        ReservationCreate(table_number=1, guest_name="Анна", guests=2, starts_at=EVENING, ends_at=EVENING)
+    with pytest.raises(ValidationError):
+        ReservationCreate(table_number=1, guest_name="Анна", guests=2, starts_at=EVENING,
+                          ends_at=EVENING + timedelta(hours=13))
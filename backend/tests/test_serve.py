@@ -0,0 +1,27 @@
+from database import pool_limits
+from serve import available_cpus, cgroup_cpu_limit
+
+
+def test_cpu_limit_is_read_from_cgroup_v2_and_v1(tmp_path):
+    v2 = tmp_path / "v2"
+    v2.mkdir()
+    (v2 / "cpu.max").write_text("250000 100000\n")
+    assert cgroup_cpu_limit(v2) == 2.5
+
+    (v2 / "cpu.max").write_text("max 100000\n")
+    assert cgroup_cpu_limit(v2) is None
+
+    v1 = tmp_path / "v1" / "cpu"
+    v1.mkdir(parents=True)
+    (v1 / "cpu.cfs_quota_us").write_text("50000\n")
+    (v1 / "cpu.cfs_period_us").write_text("100000\n")
+    assert cgroup_cpu_limit(tmp_path / "v1") == 0.5
+    # Полъядра - все равно один воркер
+    assert available_cpus(tmp_path / "v1") == 1
+
+    assert cgroup_cpu_limit(tmp_path / "missing") is None
+
+
+def test_pool_budget_is_split_between_workers():
+    assert pool_limits(pool_size=20, max_overflow=10, workers=4) == {"pool_size": 5, "max_overflow": 2}
+    assert pool_limits(pool_size=2, max_overflow=0, workers=4) == {"pool_size": 1, "max_overflow": 0}
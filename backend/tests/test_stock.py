@@ -0,0 +1,255 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import fakeredis
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import bulk_orders
+import models
+import outbox
+import stock
+from redis_client import RedisClient
+
+
+def make_sessionmaker():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    models.Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    client = RedisClient.__new__(RedisClient)
+    client.client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(stock, "redis_client", client)
+    monkeypatch.setattr(outbox, "redis_client", client)
+    return client
+
+
+def seed(db):
+    """Борщ - 5 порций, чай - 1, хлеб не учитывается."""
+    dishes = [
+        models.Dish(name="Борщ", description="", price=5.5, stock=5),
+        models.Dish(name="Чай", description="", price=0.29, stock=1),
+        models.Dish(name="Хлеб", description="", price=0.5),
+    ]
+    db.add_all(dishes)
+    db.commit()
+    return [dish.id for dish in dishes]
+
+
+def test_order_takes_all_dishes_or_nothing(redis):
+    db = make_sessionmaker()()
+    soup, tea, bread = seed(db)
+
+    # Счетчики заполняются из Postgres при первом заказе; хлеб не учитывается
+    assert stock.take(db, 1, {soup: 2, tea: 1, bread: 10}) == ({soup: 2, tea: 1}, True)
+    assert redis.get_stock(1) == {soup: 3, tea: 0}
+
+    with pytest.raises(stock.OutOfStock) as error:
+        stock.take(db, 1, {soup: 1, tea: 1})
+    assert (error.value.dish_id, error.value.left) == (tea, 0)
+    # Борщ не списан: заказ не прошел целиком
+    assert redis.get_stock(1) == {soup: 3, tea: 0}
+
+    stock.give_back(1, {soup: 2, tea: 1}, counted=True)
+    assert redis.get_stock(1) == {soup: 5, tea: 1}
+
+
+def test_concurrent_orders_never_oversell(redis):
+    Session = make_sessionmaker()
+    soup, tea, _ = seed(Session())
+
+    def order(_):
+        db = Session()
+        try:
+            return stock.take(db, 1, {soup: 1})[0]
+        except stock.OutOfStock:
+            return None
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(order, range(20)))
+    assert sum(1 for result in results if result) == 5
+    assert redis.get_stock(1) == {soup: 0, tea: 1}
+
+
+def test_worker_reconciles_batches_and_takes_sold_out_dishes_off_sale(redis):
+    db = make_sessionmaker()()
+    soup, tea, bread = seed(db)
+
+    for quantities in [{soup: 2, tea: 1}, {soup: 1}, {soup: -1}]:
+        outbox.enqueue(db, "reconcile_stock", restaurant_id=1, quantities=quantities)
+    db.commit()
+    assert outbox.process_batch(db, batch_size=10) == 3
+
+    db.expire_all()
+    assert dict(db.query(models.Dish.id, models.Dish.stock)) == {soup: 3, tea: 0, bread: None}
+    assert [dish.id for dish in db.query(models.Dish).filter(models.Dish.available == False)] == [tea]
+
+    # Возврат порции правкой заказа возвращает закончившийся чай в продажу, но не блюдо,
+    # снятое с продажи не остатком
+    soup_dish = db.get(models.Dish, soup)
+    soup_dish.available = False
+    db.query(models.OutboxEvent).delete()
+    outbox.enqueue(db, "reconcile_stock", restaurant_id=1, quantities={tea: -1, soup: -1})
+    db.commit()
+    assert outbox.process_batch(db, batch_size=10) == 1
+    db.expire_all()
+    assert dict(db.query(models.Dish.id, models.Dish.available)) == {soup: False, tea: True, bread: True}
+    assert dict(db.query(models.Dish.id, models.Dish.stock)) == {soup: 4, tea: 1, bread: None}
+    # Инвалидация меню записана той же транзакцией и выполнится следующей пачкой
+    assert [(event.event_type, json.loads(event.payload)) for event in db.query(models.OutboxEvent)] == [
+        ("invalidate_dishes", {"restaurant_id": 1}),
+    ]
+
+
+def test_restock_keeps_pending_takes(redis):
+    db = make_sessionmaker()()
+    soup, tea, _ = seed(db)
+    taken, _ = stock.take(db, 1, {soup: 3})
+    outbox.enqueue(db, "reconcile_stock", restaurant_id=1, quantities=taken)
+    db.commit()
+
+    # Пока воркер не перенес списание, администратор пересчитал остаток: 10 порций
+    dish = db.get(models.Dish, soup)
+    delta = stock.set_stock(db, dish, 10)
+    outbox.enqueue(db, "set_stock", restaurant_id=1, dish_id=soup, stock=10, delta=delta)
+    db.commit()
+    # Счетчик меняется только после коммита, и заказ между коммитом и воркером не теряется
+    assert redis.get_stock(1)[soup] == 2
+    taken, _ = stock.take(db, 1, {soup: 1})
+    outbox.enqueue(db, "reconcile_stock", restaurant_id=1, quantities=taken)
+    db.commit()
+
+    while outbox.process_batch(db, batch_size=10):
+        pass
+    db.expire_all()
+    assert redis.get_stock(1) == {soup: 9, tea: 1}
+    assert db.get(models.Dish, soup).stock == 9
+
+
+def test_restock_rolled_back_leaves_counters(redis):
+    db = make_sessionmaker()()
+    soup, tea, _ = seed(db)
+    stock.take(db, 1, {soup: 3})
+
+    stock.set_stock(db, db.get(models.Dish, soup), 10)
+    outbox.enqueue(db, "set_stock", restaurant_id=1, dish_id=soup, stock=10, delta=8)
+    db.rollback()
+
+    assert redis.get_stock(1) == {soup: 2, tea: 1}
+    assert db.get(models.Dish, soup).stock == 5
+
+
+def test_counters_lost_with_redis_are_seeded_without_pending_takes(redis):
+    db = make_sessionmaker()()
+    soup, _, _ = seed(db)
+    taken, _ = stock.take(db, 1, {soup: 3})
+    outbox.enqueue(db, "reconcile_stock", restaurant_id=1, quantities=taken)
+    db.commit()
+
+    # Redis перезапущен до того, как воркер перенес списание в Postgres
+    redis.client.flushall()
+    assert stock.take(db, 1, {soup: 2}) == ({soup: 2}, True)
+    with pytest.raises(stock.OutOfStock):
+        stock.take(db, 1, {soup: 1})
+
+
+def offline_take(db, monkeypatch, quantities):
+    """Заказ, пока Redis недоступен: списание уходит в outbox вместе с догоняющим take_stock"""
+    offline = RedisClient.__new__(RedisClient)
+    offline.client = None
+    with monkeypatch.context() as patch:
+        patch.setattr(stock, "redis_client", offline)
+        taken, counted = stock.take(db, 1, quantities)
+    assert not counted
+    outbox.enqueue(db, "reconcile_stock", restaurant_id=1, quantities=taken)
+    outbox.enqueue(db, "take_stock", restaurant_id=1, quantities=taken)
+    db.commit()
+
+
+def test_catch_up_takes_each_offline_order_once(redis, monkeypatch):
+    db = make_sessionmaker()()
+    soup, _, _ = seed(db)
+    stock.take(db, 1, {soup: 1})
+
+    # Redis был недоступен, но счетчики пережили сбой: воркер догоняет списание
+    offline_take(db, monkeypatch, {soup: 2})
+    take_event = db.query(models.OutboxEvent.id).filter(models.OutboxEvent.event_type == "take_stock").scalar()
+    events = [(take_event, {"restaurant_id": 1, "quantities": {str(soup): 2}})]
+    assert outbox.HANDLERS["take_stock"](events)
+    # Удаление пачки не закоммитилось, и событие доставлено снова
+    assert outbox.HANDLERS["take_stock"](events)
+    assert redis.get_stock(1)[soup] == 2
+
+
+def test_seeded_counters_skip_catch_up_already_in_postgres(redis, monkeypatch):
+    db = make_sessionmaker()()
+    soup, _, _ = seed(db)
+
+    # Redis перезапущен: счетчики заполняются из Postgres, где списание уже ждет в outbox
+    offline_take(db, monkeypatch, {soup: 2})
+    assert stock.take(db, 1, {soup: 1}) == ({soup: 1}, True)
+    assert redis.get_stock(1)[soup] == 2
+
+    assert outbox.process_batch(db, batch_size=10) == 2
+    db.expire_all()
+    assert redis.get_stock(1)[soup] == 2
+    assert db.get(models.Dish, soup).stock == 3
+
+
+def place_order(db, quantities, status="pending"):
+    """Заказ, как его записывает POST /orders: списание в Redis и перенос в Postgres через outbox"""
+    taken, _ = stock.take(db, 1, quantities)
+    outbox.enqueue(db, "reconcile_stock", restaurant_id=1, quantities=taken)
+    waiter = db.query(models.User).first() or models.User(username="waiter", password="x", role="waiter")
+    db.add(waiter)
+    db.flush()
+    order = models.Order(code=f"А{db.query(models.Order).count():03}", table_number=1, waiter_id=waiter.id,
+                         status=status)
+    db.add(order)
+    db.flush()
+    db.add_all([models.OrderItem(order_id=order.id, dish_id=dish_id, quantity=quantity)
+                for dish_id, quantity in quantities.items()])
+    db.commit()
+    return order.id
+
+
+def test_deleted_orders_return_unserved_stock(redis):
+    db = make_sessionmaker()()
+    soup, tea, bread = seed(db)
+    pending = place_order(db, {soup: 2, tea: 1, bread: 3})
+    served = place_order(db, {soup: 1}, status="completed")
+    assert outbox.process_batch(db, batch_size=10) > 0
+    assert redis.get_stock(1) == {soup: 2, tea: 0}
+
+    # Удаление (как у синтетической проверки) возвращает порции невыполненного заказа
+    assert bulk_orders.delete_orders(db, 1, [pending, served]) == [pending, served]
+    db.commit()
+    # До коммита и обработки outbox счетчики не меняются
+    assert redis.get_stock(1) == {soup: 2, tea: 0}
+    while outbox.process_batch(db, batch_size=10):
+        pass
+
+    db.expire_all()
+    assert redis.get_stock(1) == {soup: 4, tea: 1}
+    assert dict(db.query(models.Dish.id, models.Dish.stock)) == {soup: 4, tea: 1, bread: None}
+    # Чай закончился на удаленном заказе и вернулся в продажу вместе с порцией
+    assert db.get(models.Dish, tea).available and not db.get(models.Dish, tea).sold_out
+
+
+def test_without_redis_stock_is_checked_in_postgres(monkeypatch):
+    db = make_sessionmaker()()
+    soup, tea, _ = seed(db)
+    offline = RedisClient.__new__(RedisClient)
+    offline.client = None
+    monkeypatch.setattr(stock, "redis_client", offline)
+
+    assert stock.take(db, 1, {soup: 5}) == ({soup: 5}, False)
+    with pytest.raises(stock.OutOfStock):
+        stock.take(db, 1, {tea: 2})
@@ -0,0 +1,105 @@
+import pytest
+
+import health_monitor
+from synthetic_probe import OrderProbe, ProbeError, PROBE_STEPS
+
+
+class Response:
+
+    def __init__(self, status_code=200, payload=None):
+        self.status_code = status_code
+        self.payload = payload
+        self.text = ""
+
+    @property
+    def ok(self):
+        return 200 <= self.status_code < 300
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class FakeApi:
+    """Отвечает на запросы пробы как backend-api; учетные записи пробы заведены заранее."""
+
+    def __init__(self, fail_on=None, users=None):
+        self.users = {"probe-waiter": "w", "probe-admin": "a"} if users is None else users
+        self.fail_on = fail_on
+        self.calls = []
+
+    def request(self, method, url, headers=None, timeout=None, json=None, params=None):
+        path = url.replace("http://frontend/api", "")
+        self.calls.append((method, path, (headers or {}).get("Authorization")))
+        if (method, path) == self.fail_on:
+            return Response(500)
+        if path == "/login":
+            if self.users.get(json["username"]) != json["password"]:
+                return Response(401)
+            return Response(200, {"access_token": f"token-{json['username']}"})
+        if path == "/dishes":
+            return Response(200, [{"id": 1, "available": False}, {"id": 2, "available": True}])
+        if path == "/tables/available":
+            return Response(200, [{"number": 3}, {"number": 12}])
+        if (method, path) == ("POST", "/orders"):
+            assert json == {"table_number": 12, "items": [{"dish_id": 2, "quantity": 1}]}
+            return Response(200, {"id": 77})
+        return Response(200, {})
+
+
+def make_probe(api):
+    return OrderProbe(api, "http://frontend/api/", waiter={"username": "probe-waiter", "password": "w"},
+                      admin={"username": "probe-admin", "password": "a"})
+
+
+def test_probe_times_every_step_and_deletes_its_order_as_admin():
+    api = FakeApi()
+
+    timings = make_probe(api).run()
+
+    assert list(timings) == PROBE_STEPS
+    assert api.calls[-1] == ("DELETE", "/orders/77", "Bearer token-probe-admin")
+
+
+def test_probe_never_registers_missing_accounts():
+    api = FakeApi(users={"probe-waiter": "w"})
+
+    # Заказ создан, но удалить его некому: администратора пробы нет
+    with pytest.raises(ProbeError) as error:
+        make_probe(api).run()
+
+    assert error.value.step == "delete_order"
+    assert all(path != "/register" for _, path, _ in api.calls)
+    assert api.users == {"probe-waiter": "w"}
+
+    with pytest.raises(ProbeError) as error:
+        make_probe(FakeApi(users={})).run()
+    assert error.value.step == "login"
+
+
+def test_failed_probe_cleans_up_and_is_reported_in_status(monkeypatch):
+    monkeypatch.setattr(health_monitor, "history", health_monitor.HealthHistory(size=5))
+    alerts = []
+    monkeypatch.setattr(health_monitor, "send_alert", alerts.append)
+    api = FakeApi(fail_on=("PUT", "/orders/77/status"))
+
+    assert health_monitor.run_order_probe(make_probe(api)) is False
+
+    assert ("DELETE", "/orders/77", "Bearer token-probe-admin") in api.calls
+    checks = health_monitor.history.summary()["checks"]
+    assert checks["probe:update_items"]["ok"] is True
+    assert checks["probe:complete_order"]["ok"] is False
+    assert "complete_order" in alerts[0]
+
+
+def test_slo_breaches_cover_steps_and_total():
+    timings = {"login": 120.0, "create_order": 700.0, "update_items": 300.0}
+
+    assert health_monitor.slo_breaches(timings, step_slo_ms=500, total_slo_ms=1000) == [
+        "create_order 700ms > 500ms",
+        "total 1120ms > 1000ms",
+    ]
+    assert health_monitor.slo_breaches(timings, step_slo_ms=1000, total_slo_ms=2000) == []
@@ -0,0 +1,140 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fakeredis
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models
+import outbox
+import table_state
+from redis_client import RedisClient
+
+
+def fake_client(decode_responses=False):
+    client = RedisClient.__new__(RedisClient)
+    client.client = fakeredis.FakeRedis(decode_responses=decode_responses)
+    return client
+
+
+def cache_client():
+    return fake_client(decode_responses=True)
+
+
+def herd(client, loads, callers=30):
+    """Одновременные промахи кеша столов; возвращает ответы всех вызывающих."""
+    barrier = threading.Barrier(callers)
+
+    def load():
+        loads.append(1)
+        time.sleep(0.1)
+        return [{"number": len(loads)}]
+
+    def poll(_):
+        barrier.wait()
+        return client.get_tables(5, load)
+
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        return list(pool.map(poll, range(callers)))
+
+
+def test_free_table_bitmap_uses_redis_bit_order():
+    client = fake_client()
+
+    assert client.replace_free_tables(2, [1, 9, 10], client.free_tables_generation(2))
+    # Бит N - старший-первый, как у SETBIT/GETBIT; бит 0 - признак построенной карты
+    assert client.client.get("r:{2}:tables:free") == bytes([0b11000000, 0b01100000])
+    assert client.replace_free_tables(2, [], client.free_tables_generation(2))
+    assert client.client.get("r:{2}:tables:free") == bytes([0b10000000])
+    assert client.first_free_table(2) == -1
+
+
+def test_rebuild_never_overwrites_newer_bits():
+    client = fake_client()
+    generation = client.free_tables_generation(2)
+
+    # Пока перестроение читало БД, воркер освободил стол 3
+    assert client.set_tables_free(2, {3: True})
+    assert not client.replace_free_tables(2, [1], generation)
+    assert client.is_table_free(2, 3) is None
+
+    assert client.replace_free_tables(2, [1, 3], client.free_tables_generation(2))
+    assert client.set_tables_free(2, {1: False})
+    assert client.first_free_table(2) == 3
+    # После сброса карта строится заново, а запоздавшее перестроение отбрасывается
+    generation = client.free_tables_generation(2)
+    assert client.reset_free_tables(2)
+    assert not client.replace_free_tables(2, [1, 3], generation)
+    assert client.first_free_table(2) is None
+
+
+def test_table_availability_events_merge_per_restaurant(monkeypatch):
+    updates = []
+    monkeypatch.setattr(outbox.redis_client, "set_tables_free", lambda r, tables: updates.append((r, tables)) or True)
+
+    # Номера столов приходят из JSON строками; позднее событие по столу побеждает
+    assert outbox.HANDLERS["table_availability"]([
+        {"restaurant_id": 2, "tables": {"5": False}},
+        {"tables": {"5": False}},
+        {"restaurant_id": 2, "tables": {"5": True, "7": False}},
+    ])
+    assert updates == [(2, {5: True, 7: False}), (1, {5: False})]
+
+
+def test_thundering_herd_hits_database_once():
+    client, loads = cache_client(), []
+
+    # Пустой кеш: один вызывающий читает БД, остальные дожидаются его результата
+    assert herd(client, loads) == [[{"number": 1}]] * 30
+    assert len(loads) == 1
+
+    # Свежий кеш в БД не ходит; устаревший перезаполняет один, остальные сразу получают старое
+    assert herd(client, loads) == [[{"number": 1}]] * 30
+    assert client.store_fresh("r:{5}:tables:all", [{"number": 1}], ttl=0)
+    answers = herd(client, loads)
+    assert len(loads) == 2
+    assert {answer[0]["number"] for answer in answers} <= {1, 2} and [{"number": 2}] in answers
+
+
+def test_table_changes_are_written_through(monkeypatch):
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(bind=engine)
+    db = SessionLocal()
+    db.add_all([models.Table(restaurant_id=5, number=1, is_available=False, current_order_id=7),
+                models.Table(restaurant_id=5, number=2)])
+    db.commit()
+
+    client = cache_client()
+    monkeypatch.setattr(table_state, "SessionLocal", SessionLocal)
+    monkeypatch.setattr(table_state, "redis_client", client)
+
+    assert outbox.HANDLERS["invalidate_tables"]([{"restaurant_id": 5}, {"restaurant_id": 5}])
+
+    def no_database():
+        raise AssertionError("кеш должен быть уже заполнен воркером")
+
+    assert [t["number"] for t in client.get_tables(5, no_database)] == [1, 2]
+    assert client.get_available_tables(5, no_database) == [
+        {"id": 2, "number": 2, "is_available": True, "current_order_id": None, "seats": 4},
+    ]
+
+
+def test_stale_snapshot_never_overwrites_published_tables():
+    client = cache_client()
+
+    def load_before_change():
+        # Пока вызывающий читал БД, стол 1 заняли, и воркер опубликовал новое состояние
+        assert client.publish_tables(5, [{"number": 1, "is_available": False}], client.bump_tables_version(5))
+        return [{"number": 1, "is_available": True}]
+
+    assert client.get_tables(5, load_before_change) == [{"number": 1, "is_available": True}]
+    assert client.get_tables(5, list) == [{"number": 1, "is_available": False}]
+    assert client.get_available_tables(5, list) == []
+
+    # Запоздавшая публикация воркера с прежней версией тоже отбрасывается
+    old_version = client.bump_tables_version(5)
+    assert client.publish_tables(5, [{"number": 1, "is_available": True}], client.bump_tables_version(5))
+    assert client.publish_tables(5, [{"number": 1, "is_available": False}], old_version)
+    assert client.get_available_tables(5, list) == [{"number": 1, "is_available": True}]
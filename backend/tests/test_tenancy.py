@@ -0,0 +1,114 @@
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+import auth
+import kitchen
+import models
+import outbox
+from migrations import run_migrations
+from redis_client import tenant_key
+
+
+def make_session():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)()
+
+
+def test_table_numbers_and_kitchen_queue_are_per_restaurant():
+    db = make_session()
+    db.add_all([models.Table(restaurant_id=1, number=1), models.Table(restaurant_id=2, number=1)])
+    db.commit()
+
+    db.add(models.Table(restaurant_id=2, number=1))
+    with pytest.raises(IntegrityError):
+        db.commit()
+    db.rollback()
+
+    for restaurant_id in (1, 2):
+        waiter = models.User(username=f"waiter{restaurant_id}", password="x", role="waiter", restaurant_id=restaurant_id)
+        dish = models.Dish(name="Борщ", description="", price=5.5, restaurant_id=restaurant_id)
+        db.add_all([waiter, dish])
+        db.flush()
+        # Коды заказов тоже уникальны только внутри ресторана
+        order = models.Order(code="А001", table_number=1, waiter_id=waiter.id, restaurant_id=restaurant_id)
+        db.add(order)
+        db.flush()
+        db.add(models.OrderItem(order_id=order.id, dish_id=dish.id, quantity=restaurant_id))
+    db.commit()
+
+    assert [item["quantity"] for item in kitchen.active_items(db, 2)] == [2]
+
+    db.add(models.Order(code="А001", table_number=2, waiter_id=waiter.id, restaurant_id=2))
+    with pytest.raises(IntegrityError):
+        db.commit()
+    db.rollback()
+
+
+def test_registration_never_takes_restaurant_from_the_request():
+    db = make_session()
+
+    # Пустая установка: первый пользователь - администратор ресторана по умолчанию, что бы он ни просил
+    assert auth.registration_target(db, "waiter", None, None) == (1, "admin")
+    db.add_all([models.User(username="admin3", password="x", role="admin", restaurant_id=3),
+                models.User(username="waiter3", password="x", role="waiter", restaurant_id=3)])
+    db.commit()
+
+    with pytest.raises(HTTPException) as error:
+        auth.registration_target(db, "admin", None, None)
+    assert error.value.status_code == 403
+
+    # Администратор заводит пользователей только в своем ресторане
+    admin_token = auth.create_access_token({"sub": "admin3", "role": "admin", "restaurant_id": 7})
+    assert auth.registration_target(db, "kitchen", None, f"Bearer {admin_token}") == (3, "kitchen")
+    waiter_token = auth.create_access_token({"sub": "waiter3", "role": "admin", "restaurant_id": 3})
+    with pytest.raises(HTTPException) as error:
+        auth.registration_target(db, "admin", None, f"Bearer {waiter_token}")
+    assert error.value.status_code == 403
+
+    # Роль и ресторан задает приглашение; токен входа приглашением не является
+    invite, _ = auth.create_invite(3, "waiter")
+    assert auth.registration_target(db, "admin", invite, None) == (3, "waiter")
+    assert auth.verify_invite(admin_token) is None
+    with pytest.raises(HTTPException):
+        auth.registration_target(db, "admin", admin_token, None)
+
+
+def test_outbox_invalidates_only_affected_restaurants(monkeypatch):
+    invalidated = []
+    monkeypatch.setattr(outbox.redis_client, "invalidate_dishes_cache", lambda r: invalidated.append(r) or True)
+    monkeypatch.setattr(outbox.redis_client, "invalidate_orders_cache",
+                        lambda r, ids, waiters: invalidated.append((r, ids)) or True)
+
+    # Событие без restaurant_id записано до появления нескольких ресторанов
+    assert outbox.HANDLERS["invalidate_dishes"]([{"restaurant_id": 3}, {}, {"restaurant_id": 3}])
+    assert outbox.HANDLERS["invalidate_orders"]([{"restaurant_id": 3, "order_ids": [7]}, {"order_ids": [7]}])
+    assert invalidated == [3, 1, (3, [7]), (1, [7])]
+    assert tenant_key(3, "dishes:all") == "r:{3}:dishes:all"
+
+
+def test_migration_adds_restaurant_to_existing_tables():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE tables (id INTEGER PRIMARY KEY, number INTEGER NOT NULL, "
+                          "is_available BOOLEAN, current_order_id INTEGER)"))
+        conn.execute(text("CREATE UNIQUE INDEX ix_tables_number ON tables (number)"))
+        conn.execute(text("CREATE TABLE orders (id INTEGER PRIMARY KEY, code VARCHAR(20), "
+                          "table_number INTEGER NOT NULL, status VARCHAR(20), created_at TIMESTAMP, "
+                          "waiter_id INTEGER NOT NULL)"))
+        conn.execute(text("CREATE UNIQUE INDEX ix_orders_code ON orders (code)"))
+        conn.execute(text("INSERT INTO tables (number, is_available) VALUES (1, 1)"))
+    models.Base.metadata.create_all(bind=engine)
+
+    run_migrations(engine)
+
+    indexes = {index["name"] for index in inspect(engine).get_indexes("tables")}
+    assert "ix_tables_number" not in indexes and "uq_tables_restaurant_number" in indexes
+    indexes = {index["name"] for index in inspect(engine).get_indexes("orders")}
+    assert "ix_orders_code" not in indexes and "uq_orders_restaurant_code" in indexes
+    with engine.begin() as conn:
+        assert conn.execute(text("SELECT restaurant_id FROM tables")).scalar() == 1
+        conn.execute(text("INSERT INTO tables (restaurant_id, number, is_available) VALUES (2, 1, 1)"))
@@ -0,0 +1,90 @@
+"""
+Фоновый воркер outbox: выполняет побочные эффекты запросов (инвалидация кеша,
+статистика популярности, события кухни), записанные API в outbox_events.
+Просыпается по LISTEN/NOTIFY сразу после коммита, а без уведомлений -
+раз в OUTBOX_POLL_SECONDS секунд подбирает отложенные повторы
+"""
+import logging
+import os
+import select
+import time
+
+import psycopg2
+
+import models
+import outbox
+from database import SessionLocal, engine, wait_for_db
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("OutboxWorker")
+
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "200"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+
+
+def drain_outbox(batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+    processed = 0
+    while True:
+        db = SessionLocal()
+        try:
+            count = outbox.process_batch(db, batch_size)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        processed += count
+        if count < batch_size:
+            return processed
+
+
+def listen_connection():
+    """Отдельное от пула соединение в autocommit, подписанное на канал outbox."""
+    if engine.dialect.name != "postgresql":
+        return None
+    connection = psycopg2.connect(engine.url.set(drivername="postgresql").render_as_string(hide_password=False))
+    connection.autocommit = True
+    connection.cursor().execute(f"LISTEN {outbox.OUTBOX_CHANNEL}")
+    return connection
+
+
+def wait_for_events(connection) -> None:
+    if connection is None:
+        time.sleep(OUTBOX_POLL_SECONDS)
+        return
+    ready, _, _ = select.select([connection], [], [], OUTBOX_POLL_SECONDS)
+    if ready:
+        connection.poll()
+        # Уведомление только будит воркер, сами события читаются из таблицы
+        connection.notifies.clear()
+
+
+if __name__ == "__main__":
+    logger.info("Outbox Worker Started")
+    logger.info(f"Batch size {OUTBOX_BATCH_SIZE}, poll interval {OUTBOX_POLL_SECONDS} seconds")
+
+    if wait_for_db():
+        models.Base.metadata.create_all(bind=engine)
+
+    connection = None
+    while True:
+        try:
+            if connection is None:
+                connection = listen_connection()
+            count = drain_outbox()
+            if count:
+                logger.info(f"Processed {count} outbox events")
+            wait_for_events(connection)
+        except Exception as e:
+            logger.error(f"Error processing outbox: {e}")
+            if connection is not None:
+                connection.close()
+            connection = None
+            time.sleep(OUTBOX_POLL_SECONDS)
@@ -27,7 +27,11 @@ function showInterface(role) {
     document.querySelectorAll('.interface').forEach(iface => {
         iface.classList.add('hidden');
     });
-    document.getElementById(`${role}-interface`).classList.remove('hidden');
+    // У кухни свой экран (GET /kitchen/queue), в веб-интерфейсе для нее раздела нет
+    const iface = document.getElementById(`${role}-interface`);
+    if (iface) {
+        iface.classList.remove('hidden');
+    }
 
     // Добавляем кнопку удаления аккаунта, если её ещё нет
 }
@@ -56,7 +60,7 @@ function showError(message, error = null) {
         'Order not found': 'Заказ не найден',
         'New waiter not found': 'Новый официант не найден',
         'Only administrators can update restaurant config': 'Только администраторы могут изменять конфигурацию ресторана',
-        'Total tables must be between 1 and 100': 'Количество столов должно быть от 1 до 100',
+        'Total tables must be between 1 and 5000': 'Количество столов должно быть от 1 до 5000',
         'Only administrators can create dishes': 'Только администраторы могут добавлять блюда',
         'Dish not found': 'Блюдо не найдено',
         'Only administrators can delete dishes': 'Только администраторы могут удалять блюда',
@@ -156,18 +160,38 @@ async function apiCall(endpoint, options = {}) {
         ...options.headers
     };
 
-    if (token) {
+    // Публичные GET без токена nginx отдает из микрокеша
+    if (token && !options.anonymous) {
         headers['Authorization'] = `Bearer ${token}`;
     }
+    // Без токена ресторан передается параметром: он же разделяет записи микрокеша по ресторанам
+    if (options.anonymous && currentUser && currentUser.restaurant_id) {
+        endpoint += `${endpoint.includes('?') ? '&' : '?'}restaurant_id=${currentUser.restaurant_id}`;
+    }
+    if (options.idempotencyKey) {
+        headers['Idempotency-Key'] = options.idempotencyKey;
+    }
 
     console.log(`Отправка запроса: ${API_BASE}${endpoint}`, options.body ? JSON.parse(options.body) : '');
 
     try {
-        const response = await fetch(`${API_BASE}${endpoint}`, {
-            headers,
-            ...options,
-            signal: controller.signal
-        });
+        // Сетевую ошибку повторяем только для запросов с ключом идемпотентности:
+        // сервер вернет сохраненный ответ и не выполнит запрос второй раз
+        const attempts = options.idempotencyKey ? 3 : 1;
+        let response;
+        for (let attempt = 1; ; attempt++) {
+            try {
+                response = await fetch(`${API_BASE}${endpoint}`, {
+                    ...options,
+                    headers,
+                    signal: controller.signal
+                });
+                break;
+            } catch (error) {
+                if (attempt >= attempts || error.name === 'AbortError') throw error;
+                await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+            }
+        }
 
         clearTimeout(timeoutId);
 
@@ -249,6 +273,25 @@ async function apiCall(endpoint, options = {}) {
     }
 }
 
+// Ключ идемпотентности сохраняется, пока то же самое действие не выполнено успешно,
+// поэтому повторное нажатие после сбоя сети не создаст дубль
+const pendingIdempotencyKeys = {};
+
+function idempotencyKeyFor(action, body) {
+    const pending = pendingIdempotencyKeys[action];
+    if (pending && pending.body === body) return pending.key;
+
+    const key = window.crypto && crypto.randomUUID
+        ? crypto.randomUUID()
+        : `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+    pendingIdempotencyKeys[action] = { body, key };
+    return key;
+}
+
+function clearIdempotencyKey(action) {
+    delete pendingIdempotencyKeys[action];
+}
+
 // Аутентификация
 async function login() {
     const username = document.getElementById('login-username').value;
@@ -326,7 +369,8 @@ async function confirmPasswordChange() {
 async function register() {
     const username = document.getElementById('reg-username').value;
     const password = document.getElementById('reg-password').value;
-    const role = document.getElementById('reg-role').value;
+    // Ресторан и роль задает приглашение; без него регистрируется только первый администратор
+    const invite = document.getElementById('reg-invite').value.trim() || null;
 
     if (!username || !password) {
         showError('Заполните все поля');
@@ -336,7 +380,7 @@ async function register() {
     try {
         const result = await apiCall('/register', {
             method: 'POST',
-            body: JSON.stringify({ username, password, role })
+            body: JSON.stringify({ username, password, invite })
         });
 
         if (result) {
@@ -344,6 +388,7 @@ async function register() {
             showTab('login');
             document.getElementById('reg-username').value = '';
             document.getElementById('reg-password').value = '';
+            document.getElementById('reg-invite').value = '';
         }
     } catch (error) {
         // Ошибка уже обработана в apiCall
@@ -381,7 +426,7 @@ async function startApp() {
 
     const userRoleElement = document.getElementById('user-role');
     if (userRoleElement) {
-        userRoleElement.textContent = `Роль: ${currentUser.role === 'admin' ? 'Администратор' : 'Официант'}`;
+        userRoleElement.textContent = `Роль: ${getRoleText(currentUser.role)}`;
     }
 
     showInterface(currentUser.role);
@@ -394,7 +439,8 @@ async function startApp() {
 
 async function loadData() {
     try {
-        dishes = await apiCall('/dishes') || [];
+        // Администратор сразу видит свои правки меню, официантам хватает кеша nginx
+        dishes = await apiCall('/dishes', { anonymous: currentUser.role !== 'admin' }) || [];
 
         if (currentUser.role === 'admin') {
             await loadTables();
@@ -452,6 +498,26 @@ async function updateTableConfig() {
 }
 
 // Функции администратора
+async function createInvite() {
+    const role = document.getElementById('invite-role').value;
+
+    try {
+        const result = await apiCall('/invites', {
+            method: 'POST',
+            body: JSON.stringify({ role })
+        });
+
+        if (result) {
+            const code = document.getElementById('invite-code');
+            code.value = result.invite;
+            code.classList.remove('hidden');
+            code.select();
+        }
+    } catch (error) {
+        // Ошибка уже обработана в apiCall
+    }
+}
+
 async function loadUsers() {
     try {
         const users = await apiCall('/users') || [];
@@ -461,7 +527,7 @@ async function loadUsers() {
         container.innerHTML = users.map(user => `
             <div class="user-card">
                 <h4>${user.username}</h4>
-                <p>Роль: ${user.role === 'admin' ? 'Администратор' : 'Официант'}</p>
+                <p>Роль: ${getRoleText(user.role)}</p>
                 <div class="user-actions">
                     ${user.id !== currentUser.id && user.role !== 'admin' ?
                         `<button class="danger-btn" onclick="deleteUser(${user.id})">Удалить</button>` : ''}
@@ -592,6 +658,7 @@ async function loadDishes() {
                 <h4>${dish.name}</h4>
                 <p>${dish.description}</p>
                 <p>Цена: ${dish.price} руб.</p>
+                <p>Участок кухни: ${getStationText(dish.station)}</p>
                 <button onclick="deleteDish(${dish.id})">Удалить</button>
             </div>
         `).join('');
@@ -600,21 +667,46 @@ async function loadDishes() {
     }
 }
 
+function getRoleText(role) {
+    const roles = {
+        'admin': 'Администратор',
+        'waiter': 'Официант',
+        'kitchen': 'Кухня'
+    };
+    return roles[role] || role;
+}
+
+function getStationText(station) {
+    const stations = {
+        'hot': 'Горячий цех',
+        'cold': 'Холодный цех',
+        'grill': 'Гриль',
+        'bar': 'Бар',
+        'dessert': 'Десерты'
+    };
+    return stations[station] || station || stations.hot;
+}
+
 async function addDish() {
     const name = document.getElementById('dish-name').value;
     const description = document.getElementById('dish-desc').value;
     const price = parseFloat(document.getElementById('dish-price').value);
+    const station = document.getElementById('dish-station').value;
 
     if (!name || !description || !price) {
         showError('Заполните все поля');
         return;
     }
 
+    const body = JSON.stringify({ name, description, price, station });
+
     try {
         await apiCall('/dishes', {
             method: 'POST',
-            body: JSON.stringify({ name, description, price })
+            body,
+            idempotencyKey: idempotencyKeyFor('addDish', body)
         });
+        clearIdempotencyKey('addDish');
 
         document.getElementById('dish-name').value = '';
         document.getElementById('dish-desc').value = '';
@@ -648,6 +740,7 @@ async function loadOrders() {
         <div class="order-card">
             <h4>Заказ ${order.code ? '#' + order.code : '#' + order.id} (Стол ${order.table_number})</h4>
             <p>Блюда: ${order.items.map(item => `${item.dish_name} x${item.quantity}`).join(', ')}</p>
+            <p>Сумма: ${(order.total_amount || 0).toFixed(2)} руб.</p>
             <p>Статус: <span class="status-${order.status}">${getStatusText(order.status)}</span></p>
             <p>Официант: ${order.waiter_name}</p>
             <p>Создан: ${new Date(order.created_at).toLocaleString()}</p>
@@ -684,23 +777,55 @@ async function deleteOrder(orderId) {
 }
 
 // Функции официанта
+let menuSearchTimer = null;
+
+function renderMenu(menuDishes) {
+    const container = document.getElementById('menu-items');
+    if (!container) return;
+
+    container.innerHTML = menuDishes.filter(dish => dish.available).map(dish => `
+        <div class="menu-item" onclick="selectDish(${dish.id})">
+            <h4>${dish.name}</h4>
+            <p>${dish.description}</p>
+            <p>Цена: ${dish.price} руб.</p>
+        </div>
+    `).join('');
+}
+
 async function loadMenu() {
     try {
-        const container = document.getElementById('menu-items');
-        if (!container) return;
-
-        container.innerHTML = dishes.filter(dish => dish.available).map(dish => `
-            <div class="menu-item" onclick="selectDish(${dish.id})">
-                <h4>${dish.name}</h4>
-                <p>${dish.description}</p>
-                <p>Цена: ${dish.price} руб.</p>
-            </div>
-        `).join('');
+        const searchInput = document.getElementById('menu-search');
+        if (searchInput && searchInput.value.trim()) {
+            await searchMenu(searchInput.value);
+            return;
+        }
+        renderMenu(dishes);
     } catch (error) {
         // Ошибка уже обработана в apiCall
     }
 }
 
+// Поиск идет на сервере по индексу меню, запрос отправляется после паузы в наборе
+function searchMenu(query) {
+    clearTimeout(menuSearchTimer);
+    return new Promise(resolve => {
+        menuSearchTimer = setTimeout(async () => {
+            const text = query.trim();
+            try {
+                if (!text) {
+                    renderMenu(dishes);
+                } else {
+                    const found = await apiCall(`/dishes/search?q=${encodeURIComponent(text)}`, { anonymous: true }) || [];
+                    renderMenu(found);
+                }
+            } catch (error) {
+                // Ошибка уже обработана в apiCall
+            }
+            resolve();
+        }, 250);
+    });
+}
+
 function selectDish(dishId) {
     const dish = dishes.find(d => d.id === dishId);
     if (!dish) return;
@@ -754,11 +879,15 @@ async function createOrder() {
         }))
     };
 
+    const body = JSON.stringify(order);
+
     try {
         await apiCall('/orders', {
             method: 'POST',
-            body: JSON.stringify(order)
+            body,
+            idempotencyKey: idempotencyKeyFor('createOrder', body)
         });
+        clearIdempotencyKey('createOrder');
 
         selectedItems = [];
         document.getElementById('table-select').value = '';
@@ -781,6 +910,7 @@ async function loadCurrentOrders() {
             <div class="order-card">
                 <h4>Заказ ${order.code ? '#' + order.code : '#' + order.id} (Стол ${order.table_number})</h4>
                 <p>Блюда: ${order.items.map(item => `${item.dish_name} x${item.quantity}`).join(', ')}</p>
+                <p>Сумма: ${(order.total_amount || 0).toFixed(2)} руб.</p>
                 <p>Статус: <span class="status-${order.status}">${getStatusText(order.status)}</span></p>
                 <p>Создан: ${new Date(order.created_at).toLocaleString()}</p>
                 <select onchange="updateOrderStatus(${order.id}, this.value)">
@@ -938,11 +1068,16 @@ async function saveOrderChanges() {
         items: editSelectedItems
     };
 
+    const body = JSON.stringify(orderUpdate);
+    const action = `updateOrder:${editingOrderId}`;
+
     try {
         await apiCall(`/orders/${editingOrderId}`, {
             method: 'PUT',
-            body: JSON.stringify(orderUpdate)
+            body,
+            idempotencyKey: idempotencyKeyFor(action, body)
         });
+        clearIdempotencyKey(action);
 
         closeEditModal();
         await loadCurrentOrders();
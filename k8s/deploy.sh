@@ -37,6 +37,12 @@ echo "✅ Services created"
 kubectl apply -f 10-ingress.yaml
 echo "✅ Ingress created"
 
+kubectl apply -f 11-order-archiver-deployment.yaml
+echo "✅ Order Archiver Deployment created"
+
+kubectl apply -f 12-outbox-worker-deployment.yaml
+echo "✅ Outbox Worker Deployment created"
+
 echo ""
 echo "✅ Deployment complete!"
 echo ""